@@ -10,6 +10,7 @@ import os
 # Убедись, что rag_engine.py лежит рядом
 
 from rag.rag_engine import RAGEngine
+from rag.cache_utils import AsyncSingleFlight
 
 # Настройка (как в твоем shukabase_rag.py)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -19,11 +20,15 @@ print(f"Инициализация RAG из {RAG_DIR}...")
 rag_engine = RAGEngine(
     reranker_model="jinaai/jina-reranker-v2-base-multilingual",
     languages=['ru', 'en'],
-    base_dir=RAG_DIR
+    base_dir=RAG_DIR,
+    lazy_loading=True  # Язык загружается при первом запросе на нем
 )
 
 app = FastAPI()
 
+# Одинаковые одновременные запросы (например, после общей ссылки) считаются один раз
+search_flight = AsyncSingleFlight()
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], # Разрешаем доступ с React приложения
@@ -33,7 +38,7 @@ app.add_middleware(
 )
 
 @app.get("/search")
-def search(q: str):
+async def search(q: str):
     """
     Простой поиск для Shukabase Frontend
     """
@@ -43,11 +48,15 @@ def search(q: str):
         
         # Используем твой мощный RAG поиск
         # Мы НЕ используем OpenAI здесь, только поиск чанков
-        result = rag_engine.search(
-            query=q,
-            language=lang,
-            top_k=5,
-            use_reranking=True
+        # Эмбеддинги ждем асинхронно, одинаковые запросы в полете объединяются
+        result = await search_flight.run(
+            (q, lang, 5),
+            lambda: rag_engine.search_async(
+                query=q,
+                language=lang,
+                top_k=5,
+                use_reranking=True
+            )
         )
         
         if not result.get('success'):
@@ -82,3 +91,9 @@ def search(q: str):
     except Exception as e:
         print(f"Ошибка: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/stats")
+def stats():
+    """Счетчики объединения запросов"""
+    return search_flight.stats()
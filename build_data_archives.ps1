@@ -24,7 +24,9 @@ else {
     Copy-Item "rag\faiss_index_en.bin" $EN_DIR
     Copy-Item "rag\faiss_metadata_en.json" $EN_DIR
     Copy-Item "rag\chunked_scriptures_en.json" $EN_DIR
-    if (Test-Path "rag\bm25_index_en.pkl") { Copy-Item "rag\bm25_index_en.pkl" $EN_DIR }
+    if (Test-Path "rag\bm25_index_en.bin") { Copy-Item "rag\bm25_index_en.bin" $EN_DIR }
+    if (Test-Path "rag\chunk_texts_en.bin") { Copy-Item "rag\chunk_texts_en.bin" $EN_DIR }
+    if (Test-Path "rag\chunk_meta_en.bin") { Copy-Item "rag\chunk_meta_en.bin" $EN_DIR }
 
     Write-Host "   Copying English books..."
     Copy-Item -Recurse "public\books\en" "$EN_DIR\books\"
@@ -50,7 +52,9 @@ else {
     Copy-Item "rag\faiss_index_ru.bin" $RU_DIR
     Copy-Item "rag\faiss_metadata_ru.json" $RU_DIR
     Copy-Item "rag\chunked_scriptures_ru.json" $RU_DIR
-    if (Test-Path "rag\bm25_index_ru.pkl") { Copy-Item "rag\bm25_index_ru.pkl" $RU_DIR }
+    if (Test-Path "rag\bm25_index_ru.bin") { Copy-Item "rag\bm25_index_ru.bin" $RU_DIR }
+    if (Test-Path "rag\chunk_texts_ru.bin") { Copy-Item "rag\chunk_texts_ru.bin" $RU_DIR }
+    if (Test-Path "rag\chunk_meta_ru.bin") { Copy-Item "rag\chunk_meta_ru.bin" $RU_DIR }
 
     Write-Host "   Copying Russian books..."
     Copy-Item -Recurse "public\books\ru" "$RU_DIR\books\"
@@ -79,8 +83,12 @@ else {
     Copy-Item "rag\faiss_index_ru.bin" $ALL_DIR
     Copy-Item "rag\faiss_metadata_ru.json" $ALL_DIR
     Copy-Item "rag\chunked_scriptures_ru.json" $ALL_DIR
-    if (Test-Path "rag\bm25_index_en.pkl") { Copy-Item "rag\bm25_index_en.pkl" $ALL_DIR }
-    if (Test-Path "rag\bm25_index_ru.pkl") { Copy-Item "rag\bm25_index_ru.pkl" $ALL_DIR }
+    if (Test-Path "rag\bm25_index_en.bin") { Copy-Item "rag\bm25_index_en.bin" $ALL_DIR }
+    if (Test-Path "rag\bm25_index_ru.bin") { Copy-Item "rag\bm25_index_ru.bin" $ALL_DIR }
+    if (Test-Path "rag\chunk_texts_en.bin") { Copy-Item "rag\chunk_texts_en.bin" $ALL_DIR }
+    if (Test-Path "rag\chunk_meta_en.bin") { Copy-Item "rag\chunk_meta_en.bin" $ALL_DIR }
+    if (Test-Path "rag\chunk_texts_ru.bin") { Copy-Item "rag\chunk_texts_ru.bin" $ALL_DIR }
+    if (Test-Path "rag\chunk_meta_ru.bin") { Copy-Item "rag\chunk_meta_ru.bin" $ALL_DIR }
 
     Write-Host "   Copying all books..."
     Copy-Item -Recurse "public\books\en" "$ALL_DIR\books\"
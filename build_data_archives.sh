@@ -21,7 +21,10 @@ cp rag/faiss_index_en.bin "$EN_DIR/"
 cp rag/faiss_metadata_en.json "$EN_DIR/"
 cp rag/chunked_scriptures_en.json "$EN_DIR/"
 # BM25 will be regenerated on first run, but include if exists
-[ -f rag/bm25_index_en.pkl ] && cp rag/bm25_index_en.pkl "$EN_DIR/"
+[ -f rag/bm25_index_en.bin ] && cp rag/bm25_index_en.bin "$EN_DIR/"
+# Binary chunk store (mmap), optional
+[ -f rag/chunk_texts_en.bin ] && cp rag/chunk_texts_en.bin "$EN_DIR/"
+[ -f rag/chunk_meta_en.bin ] && cp rag/chunk_meta_en.bin "$EN_DIR/"
 
 # Copy books
 echo "   Copying English books..."
@@ -43,7 +46,10 @@ mkdir -p "$RU_DIR"
 cp rag/faiss_index_ru.bin "$RU_DIR/"
 cp rag/faiss_metadata_ru.json "$RU_DIR/"
 cp rag/chunked_scriptures_ru.json "$RU_DIR/"
-[ -f rag/bm25_index_ru.pkl ] && cp rag/bm25_index_ru.pkl "$RU_DIR/"
+[ -f rag/bm25_index_ru.bin ] && cp rag/bm25_index_ru.bin "$RU_DIR/"
+# Binary chunk store (mmap), optional
+[ -f rag/chunk_texts_ru.bin ] && cp rag/chunk_texts_ru.bin "$RU_DIR/"
+[ -f rag/chunk_meta_ru.bin ] && cp rag/chunk_meta_ru.bin "$RU_DIR/"
 
 # Copy books
 echo "   Copying Russian books..."
@@ -69,8 +75,12 @@ cp rag/chunked_scriptures_en.json "$ALL_DIR/"
 cp rag/faiss_index_ru.bin "$ALL_DIR/"
 cp rag/faiss_metadata_ru.json "$ALL_DIR/"
 cp rag/chunked_scriptures_ru.json "$ALL_DIR/"
-[ -f rag/bm25_index_en.pkl ] && cp rag/bm25_index_en.pkl "$ALL_DIR/"
-[ -f rag/bm25_index_ru.pkl ] && cp rag/bm25_index_ru.pkl "$ALL_DIR/"
+[ -f rag/bm25_index_en.bin ] && cp rag/bm25_index_en.bin "$ALL_DIR/"
+[ -f rag/bm25_index_ru.bin ] && cp rag/bm25_index_ru.bin "$ALL_DIR/"
+[ -f rag/chunk_texts_en.bin ] && cp rag/chunk_texts_en.bin "$ALL_DIR/"
+[ -f rag/chunk_meta_en.bin ] && cp rag/chunk_meta_en.bin "$ALL_DIR/"
+[ -f rag/chunk_texts_ru.bin ] && cp rag/chunk_texts_ru.bin "$ALL_DIR/"
+[ -f rag/chunk_meta_ru.bin ] && cp rag/chunk_meta_ru.bin "$ALL_DIR/"
 
 # Copy all books
 echo "   Copying all books..."
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🗄️  ФАЙЛ МАССИВОВ С ОТОБРАЖЕНИЕМ В ПАМЯТЬ (mmap)
+
+Простой контейнер для бинарных индексов RAG: JSON-заголовок и набор
+выровненных numpy-массивов. При чтении файл отображается в память,
+поэтому массивы не копируются, а в RSS попадают только прочитанные страницы.
+
+Формат:
+    MAGIC (8 байт) | длина заголовка (uint64) | JSON заголовок | массивы
+Каждый массив выровнен по ALIGNMENT байт от начала области данных.
+"""
+
+import json
+import mmap
+import weakref
+import numpy as np
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+MAGIC = b'SHKARR01'
+ALIGNMENT = 64
+
+# Открытые отображения -> путь файла (для явного закрытия, см. close_array_files)
+_open_maps: 'weakref.WeakKeyDictionary[mmap.mmap, Path]' = weakref.WeakKeyDictionary()
+
+
+def _align(n: int) -> int:
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_array_file(path: Path, header: Dict[str, Any], arrays: Dict[str, np.ndarray]):
+    """
+    Записывает массивы и заголовок в файл (атомарно через временный файл).
+
+    Args:
+        path: путь к файлу
+        header: произвольные JSON-сериализуемые поля заголовка
+        arrays: именованные массивы (сохраняются в C-порядке)
+    """
+    path = Path(path)
+    layout = {}
+    offset = 0
+    prepared = {}
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        prepared[name] = arr
+        layout[name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset}
+        offset = _align(offset + arr.nbytes)
+
+    full_header = dict(header)
+    full_header['arrays'] = layout
+    header_bytes = json.dumps(full_header, ensure_ascii=False).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        f.write(b'\0' * (data_start - f.tell()))
+        for name, arr in prepared.items():
+            f.seek(data_start + layout[name]['offset'])
+            f.write(arr.tobytes())
+    tmp_path.replace(path)
+
+
+def open_array_file(path: Path) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """
+    Открывает файл массивов через mmap.
+
+    Returns:
+        (header, arrays) - массивы только для чтения, без копирования
+
+    Raises:
+        ValueError: если файл не является файлом массивов
+    """
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if mm[:len(MAGIC)] != MAGIC:
+        mm.close()
+        raise ValueError(f"Неизвестный формат файла: {path}")
+    _open_maps[mm] = Path(path).resolve()
+
+    header_len = int(np.frombuffer(mm, dtype=np.uint64, count=1, offset=len(MAGIC))[0])
+    header_start = len(MAGIC) + 8
+    header = json.loads(mm[header_start:header_start + header_len].decode('utf-8'))
+    data_start = _align(header_start + header_len)
+
+    arrays = {}
+    for name, spec in header.get('arrays', {}).items():
+        dtype = np.dtype(spec['dtype'])
+        shape = tuple(spec['shape'])
+        count = int(np.prod(shape)) if shape else 1
+        if count == 0:
+            arrays[name] = np.empty(shape, dtype=dtype)
+            continue
+        arrays[name] = np.frombuffer(
+            mm, dtype=dtype, count=count, offset=data_start + spec['offset']
+        ).reshape(shape)
+    return header, arrays
+
+
+def close_array_files(directory: Path) -> List[Path]:
+    """
+    Закрывает отображения файлов массивов из каталога (например, перед его удалением).
+
+    Отображение закрывается автоматически, когда на его массивы не остается
+    ссылок; здесь закрываются оставшиеся.
+
+    Returns:
+        файлы, которые не удалось закрыть (на их массивы еще есть ссылки)
+    """
+    directory = Path(directory).resolve()
+    still_open = []
+    for mm, path in list(_open_maps.items()):
+        if directory not in path.parents:
+            continue
+        try:
+            mm.close()
+        except BufferError:
+            still_open.append(path)
+    return still_open
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🔑 РАЗРЕЖЕННЫЙ BM25 (Okapi) ДЛЯ KEYWORD ПОИСКА
+
+Векторизованная замена rank_bm25.BM25Okapi. Корпус хранится как
+CSR-матрица "термин → документы", поэтому при поиске просматриваются
+только списки документов терминов запроса, а не весь корпус.
+
+Формулы и константы совпадают с BM25Okapi (k1=1.5, b=0.75, epsilon=0.25,
+отрицательный idf заменяется на epsilon * средний idf), так что оценки
+идентичны оценкам rank_bm25.
+
+Массивы:
+    term_offsets - границы списков в doc_ids/term_freqs для каждого термина (int64)
+    doc_ids      - id документов (строки FAISS), по возрастанию внутри списка (int32)
+    term_freqs   - частота термина в документе (int32)
+    idf          - idf каждого термина (float64)
+    doc_len      - длина документа в токенах (int32)
+
+Формат хранения (bm25_index_{lang}.bin, открывается через mmap): те же массивы
+плюс словарь (отсортированные термины в UTF-8 буфере). В заголовке - версия
+формата, версия токенизатора/стеммера, отпечаток корпуса и CRC32 массивов.
+"""
+
+import math
+import zlib
+import numpy as np
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+
+try:
+    from rag.array_file import write_array_file, open_array_file
+except ImportError:
+    from array_file import write_array_file, open_array_file
+
+logger = logging.getLogger(__name__)
+
+
+class SortedVocabulary:
+    """Словарь терминов из отсортированного UTF-8 буфера (поиск бинарным поиском)"""
+
+    def __init__(self, blob, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def _term_bytes(self, term_id: int) -> bytes:
+        return bytes(self.blob[self.offsets[term_id]:self.offsets[term_id + 1]])
+
+    def get(self, word: str, default=None) -> Optional[int]:
+        key = word.encode('utf-8')
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self._term_bytes(lo) == key:
+            return lo
+        return default
+
+    def __contains__(self, word: str) -> bool:
+        return self.get(word) is not None
+
+
+class SparseBM25:
+    """BM25 Okapi поверх CSR-постингов"""
+
+    FORMAT_VERSION = 1
+
+    def __init__(
+        self,
+        vocab,
+        term_offsets: np.ndarray,
+        doc_ids: np.ndarray,
+        term_freqs: np.ndarray,
+        idf: np.ndarray,
+        doc_len: np.ndarray,
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25
+    ):
+        """
+        Args:
+            vocab: термин -> id (dict или SortedVocabulary из файла)
+        """
+        self.vocab = vocab
+        self.term_offsets = term_offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.idf = idf
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+
+        self.corpus_size = len(doc_len)
+        self.avgdl = int(np.sum(doc_len, dtype=np.int64)) / self.corpus_size if self.corpus_size else 0.0
+        # Нормализация длины документа: k1 * (1 - b + b * |D| / avgdl)
+        if self.corpus_size:
+            self.doc_norm = self.k1 * (1 - self.b + self.b * np.asarray(doc_len, dtype=np.int64) / self.avgdl)
+        else:
+            self.doc_norm = np.empty(0, dtype=np.float64)
+
+    @classmethod
+    def build(cls, corpus: Iterable[List[str]], k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25) -> 'SparseBM25':
+        """
+        Строит индекс по токенизированному корпусу.
+
+        Args:
+            corpus: списки токенов документов в порядке id (строк FAISS)
+        """
+        vocab: Dict[str, int] = {}
+        doc_counts: List[int] = []
+        term_parts, doc_parts, freq_parts = [], [], []
+        doc_len = []
+
+        for doc_id, document in enumerate(corpus):
+            doc_len.append(len(document))
+            frequencies: Dict[int, int] = {}
+            for word in document:
+                term_id = vocab.get(word)
+                if term_id is None:
+                    term_id = vocab[word] = len(vocab)
+                    doc_counts.append(0)
+                frequencies[term_id] = frequencies.get(term_id, 0) + 1
+            for term_id in frequencies:
+                doc_counts[term_id] += 1
+            if frequencies:
+                term_parts.append(np.fromiter(frequencies.keys(), dtype=np.int64, count=len(frequencies)))
+                freq_parts.append(np.fromiter(frequencies.values(), dtype=np.int32, count=len(frequencies)))
+                doc_parts.append(np.full(len(frequencies), doc_id, dtype=np.int32))
+
+        term_offsets, doc_ids, term_freqs = cls._to_csr(len(vocab), term_parts, doc_parts, freq_parts)
+        idf = cls._calc_idf(doc_counts, len(doc_len), epsilon)
+        return cls(vocab, term_offsets, doc_ids, term_freqs, idf, np.asarray(doc_len, dtype=np.int32), k1, b, epsilon)
+
+    def with_documents(
+        self,
+        documents: Dict[int, List[str]],
+        removed: Iterable[int] = (),
+        num_docs: int = None
+    ) -> 'SparseBM25':
+        """
+        Новый индекс с добавленными или замененными документами: токенизируются
+        только они, постинги остального корпуса переносятся как есть.
+
+        Args:
+            documents: id документа -> токены (новые id или замена существующих)
+            removed: id документов, которые становятся пустыми (длина 0)
+            num_docs: число документов (id) нового индекса
+
+        Оценки совпадают с build() по тому же корпусу (пустые документы на месте удаленных).
+        """
+        num_docs = max(num_docs or 0, self.corpus_size, max(documents, default=-1) + 1)
+        dropped = np.zeros(num_docs, dtype=bool)
+        dropped[np.fromiter(removed, dtype=np.int64)] = True
+        dropped[np.fromiter(documents.keys(), dtype=np.int64, count=len(documents))] = True
+
+        # Постинги оставшихся документов (термин, документ, частота)
+        counts = np.diff(np.asarray(self.term_offsets))
+        terms = np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+        keep = ~dropped[np.asarray(self.doc_ids)]
+        term_parts = [terms[keep]]
+        doc_parts = [np.asarray(self.doc_ids)[keep]]
+        freq_parts = [np.asarray(self.term_freqs)[keep]]
+
+        if isinstance(self.vocab, SortedVocabulary):
+            vocab = {self.vocab._term_bytes(term_id).decode('utf-8'): term_id for term_id in range(len(self.vocab))}
+        else:
+            vocab = dict(self.vocab)
+
+        doc_len = np.zeros(num_docs, dtype=np.int32)
+        doc_len[:self.corpus_size] = self.doc_len
+        doc_len[dropped] = 0
+        for doc_id in sorted(documents):
+            document = documents[doc_id]
+            doc_len[doc_id] = len(document)
+            frequencies: Dict[int, int] = {}
+            for word in document:
+                term_id = vocab.setdefault(word, len(vocab))
+                frequencies[term_id] = frequencies.get(term_id, 0) + 1
+            if frequencies:
+                term_parts.append(np.fromiter(frequencies.keys(), dtype=np.int64, count=len(frequencies)))
+                freq_parts.append(np.fromiter(frequencies.values(), dtype=np.int32, count=len(frequencies)))
+                doc_parts.append(np.full(len(frequencies), doc_id, dtype=np.int32))
+
+        terms = np.concatenate(term_parts)
+        docs = np.concatenate(doc_parts)
+        freqs = np.concatenate(freq_parts)
+
+        # Термины без документов удаляются из словаря, как если бы индекс строился заново
+        doc_counts = np.bincount(terms, minlength=len(vocab))
+        live = doc_counts > 0
+        remap = np.cumsum(live) - 1
+        vocab = {word: int(remap[term_id]) for word, term_id in vocab.items() if live[term_id]}
+        terms = remap[terms]
+
+        order = np.lexsort((docs, terms))
+        term_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocab)), out=term_offsets[1:])
+        idf = self._calc_idf(doc_counts[live].tolist(), num_docs, self.epsilon)
+        return type(self)(
+            vocab, term_offsets, docs[order], freqs[order], idf, doc_len, self.k1, self.b, self.epsilon
+        )
+
+    @staticmethod
+    def _to_csr(num_terms: int, term_parts, doc_parts, freq_parts) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Собирает пары (термин, документ) в term-major CSR."""
+        if not term_parts:
+            return np.zeros(num_terms + 1, dtype=np.int64), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+
+        terms = np.concatenate(term_parts)
+        docs = np.concatenate(doc_parts)
+        freqs = np.concatenate(freq_parts)
+
+        # Стабильная сортировка сохраняет возрастающий порядок документов внутри списка
+        order = np.argsort(terms, kind='stable')
+        counts = np.bincount(terms, minlength=num_terms)
+        term_offsets = np.zeros(num_terms + 1, dtype=np.int64)
+        np.cumsum(counts, out=term_offsets[1:])
+        return term_offsets, docs[order], freqs[order]
+
+    @staticmethod
+    def _calc_idf(doc_counts: List[int], corpus_size: int, epsilon: float) -> np.ndarray:
+        """idf как в BM25Okapi: log(N - n + 0.5) - log(n + 0.5) с нижней границей epsilon * средний idf."""
+        idf = np.empty(len(doc_counts), dtype=np.float64)
+        idf_sum = 0
+        for term_id, freq in enumerate(doc_counts):
+            value = math.log(corpus_size - freq + 0.5) - math.log(freq + 0.5)
+            idf[term_id] = value
+            idf_sum += value
+        if len(doc_counts):
+            average_idf = idf_sum / len(doc_counts)
+            idf[idf < 0] = epsilon * average_idf
+        return idf
+
+    def _term_postings(self, word: str, term_cache: Optional[Dict] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """(id документов, вклад в оценку) для термина; None, если термина нет в словаре."""
+        if term_cache is not None and word in term_cache:
+            return term_cache[word]
+        postings = None
+        term_id = self.vocab.get(word)
+        if term_id is not None:
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            freqs = self.term_freqs[start:end]
+            postings = (docs, self.idf[term_id] * (freqs * (self.k1 + 1) / (freqs + self.doc_norm[docs])))
+        if term_cache is not None:
+            term_cache[word] = postings
+        return postings
+
+    def _score_postings(self, query: List[str], term_cache: Optional[Dict] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Возвращает (id документов, оценки) для документов с хотя бы одним термином запроса."""
+        doc_parts, score_parts = [], []
+        for word in query:
+            postings = self._term_postings(word, term_cache)
+            if postings is None:
+                continue
+            doc_parts.append(postings[0])
+            score_parts.append(postings[1])
+
+        if not doc_parts:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+        if len(doc_parts) == 1:
+            return doc_parts[0], score_parts[0]
+
+        # bincount суммирует в порядке терминов запроса - как get_scores в rank_bm25
+        docs, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts), minlength=len(docs))
+        return docs, scores
+
+    def get_scores(self, query: List[str]) -> np.ndarray:
+        """Оценки всех документов корпуса (совместимо с BM25Okapi.get_scores)."""
+        scores = np.zeros(self.corpus_size)
+        docs, doc_scores = self._score_postings(query)
+        scores[docs] = doc_scores
+        return scores
+
+    def top_k(self, query: List[str], k: int, term_cache: Optional[Dict] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Лучшие k документов с положительной оценкой.
+
+        Args:
+            term_cache: общий словарь вкладов терминов для серии запросов (см. top_k_many)
+
+        Returns:
+            (id документов, оценки) по убыванию оценки; при равенстве - по возрастанию id
+        """
+        docs, scores = self._score_postings(query, term_cache)
+        positive = scores > 0
+        if not positive.all():
+            docs, scores = docs[positive], scores[positive]
+        if k <= 0 or not len(docs):
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+
+        if len(docs) > k:
+            # Порог k-й оценки; все документы с такой же оценкой участвуют в сортировке
+            kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+            keep = scores >= kth
+            docs, scores = docs[keep], scores[keep]
+
+        order = np.lexsort((docs, -scores))[:k]
+        return docs[order], scores[order]
+
+    def top_k_many(self, queries: List[List[str]], k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """top_k для пакета запросов: вклад каждого термина считается один раз на пакет."""
+        term_cache = {}
+        return [self.top_k(query, k, term_cache) for query in queries]
+
+    def _sorted_arrays(self) -> Dict[str, np.ndarray]:
+        """Массивы для записи: термины словаря переупорядочены по UTF-8 байтам."""
+        if isinstance(self.vocab, SortedVocabulary):
+            vocab_blob, vocab_offsets = self.vocab.blob, self.vocab.offsets
+            term_offsets, doc_ids, term_freqs, idf = self.term_offsets, self.doc_ids, self.term_freqs, self.idf
+        else:
+            encoded = [(word.encode('utf-8'), term_id) for word, term_id in self.vocab.items()]
+            encoded.sort()
+            perm = np.array([term_id for _, term_id in encoded], dtype=np.int64)
+            vocab_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            if encoded:
+                np.cumsum([len(word) for word, _ in encoded], out=vocab_offsets[1:])
+            vocab_blob = np.frombuffer(b''.join(word for word, _ in encoded), dtype=np.uint8)
+
+            # Переставляем списки постингов в новом порядке терминов
+            lengths = np.diff(self.term_offsets)[perm]
+            term_offsets = np.zeros(len(perm) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=term_offsets[1:])
+            gather = np.repeat(self.term_offsets[:-1][perm] - term_offsets[:-1], lengths) + np.arange(term_offsets[-1])
+            doc_ids, term_freqs, idf = self.doc_ids[gather], self.term_freqs[gather], self.idf[perm]
+
+        return {
+            'vocab_blob': vocab_blob,
+            'vocab_offsets': vocab_offsets,
+            'term_offsets': term_offsets,
+            'doc_ids': doc_ids,
+            'term_freqs': term_freqs,
+            'idf': idf,
+            'doc_len': self.doc_len
+        }
+
+    @staticmethod
+    def _checksum(arrays: Dict[str, np.ndarray]) -> int:
+        crc = 0
+        for name in sorted(arrays):
+            crc = zlib.crc32(np.ascontiguousarray(arrays[name]), crc)
+        return crc
+
+    def save(self, path: Path, tokenizer: str, corpus_fingerprint: str):
+        """
+        Сохраняет индекс в файл массивов.
+
+        Args:
+            tokenizer: версия токенизатора/стеммера, которым построен корпус
+            corpus_fingerprint: отпечаток текстов корпуса
+        """
+        arrays = self._sorted_arrays()
+        write_array_file(
+            path,
+            {
+                'kind': 'bm25_index',
+                'version': self.FORMAT_VERSION,
+                'tokenizer': tokenizer,
+                'corpus': corpus_fingerprint,
+                'k1': self.k1,
+                'b': self.b,
+                'epsilon': self.epsilon,
+                'checksum': self._checksum(arrays)
+            },
+            arrays
+        )
+
+    @classmethod
+    def load(cls, path: Path, tokenizer: str, corpus_fingerprint: str) -> Optional['SparseBM25']:
+        """
+        Открывает индекс через mmap.
+
+        Returns:
+            None, если файл другой версии, построен другим токенизатором,
+            для другого корпуса или поврежден (не совпадает CRC32)
+        """
+        header, arrays = open_array_file(path)
+        if header.get('kind') != 'bm25_index' or header.get('version') != cls.FORMAT_VERSION:
+            logger.warning(f"⚠️ {path}: другая версия формата BM25")
+            return None
+        if header.get('tokenizer') != tokenizer:
+            logger.warning(f"⚠️ {path}: индекс построен другим токенизатором ({header.get('tokenizer')})")
+            return None
+        if header.get('corpus') != corpus_fingerprint:
+            logger.warning(f"⚠️ {path}: индекс построен для другого корпуса")
+            return None
+        if header.get('checksum') != cls._checksum(arrays):
+            logger.warning(f"⚠️ {path}: контрольная сумма не совпадает")
+            return None
+
+        return cls(
+            SortedVocabulary(arrays['vocab_blob'], arrays['vocab_offsets']),
+            arrays['term_offsets'], arrays['doc_ids'], arrays['term_freqs'],
+            arrays['idf'], arrays['doc_len'],
+            header['k1'], header['b'], header['epsilon']
+        )
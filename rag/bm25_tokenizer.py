@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+✂️  ТОКЕНИЗАТОР СО СТЕММИНГОМ ДЛЯ BM25
+
+Слова (\\w+) в нижнем регистре, приведенные к основе стеммером Snowball.
+Словоформ в корпусе на порядки меньше, чем слов, поэтому результаты
+стемминга кэшируются (ограниченный LRU). Токенизацию всего корпуса при
+построении индекса можно распределить по процессам (tokenize_corpus).
+"""
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+import nltk
+from nltk.stem import SnowballStemmer
+
+TOKENIZER_VERSION = 1  # Увеличить при изменении токенизации (индексы BM25 перестроятся)
+STEM_CACHE_SIZE = 500_000
+CORPUS_BATCH_SIZE = 2000  # Документов в одной задаче для процесса
+
+STEMMER_LANGUAGES = {
+    'ru': 'russian',
+    'en': 'english'
+}
+
+_WORD_RE = re.compile(r'\w+')
+
+
+@lru_cache(maxsize=None)
+def get_stemmer(language: str) -> Optional[SnowballStemmer]:
+    name = STEMMER_LANGUAGES.get(language)
+    return SnowballStemmer(name) if name else None
+
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(word: str, language: str) -> str:
+    """Основа словоформы (с кэшированием)."""
+    stemmer = get_stemmer(language)
+    return stemmer.stem(word) if stemmer else word
+
+
+def tokenize(text: str, language: str) -> List[str]:
+    """Токенизация со стеммингом для BM25"""
+    words = _WORD_RE.findall(text.lower())
+    if get_stemmer(language) is None:
+        return words
+    return [stem(w, language) for w in words]
+
+
+def tokenizer_signature(language: str) -> str:
+    """Версия токенизатора и стеммера (записывается в заголовок индекса BM25)."""
+    stemmer = get_stemmer(language)
+    stemmer_name = type(stemmer.stemmer).__name__ if stemmer else 'none'
+    return f"v{TOKENIZER_VERSION}:{stemmer_name}:nltk-{nltk.__version__}"
+
+
+def _tokenize_batch(texts: List[str], language: str) -> List[List[str]]:
+    return [tokenize(text, language) for text in texts]
+
+
+def tokenize_corpus(texts: Iterable[str], language: str, workers: int = 1) -> List[List[str]]:
+    """
+    Токенизирует корпус, сохраняя порядок документов.
+
+    Args:
+        texts: тексты документов
+        workers: число процессов (1 - в текущем процессе, 0/None - по числу ядер)
+    """
+    texts = list(texts)
+    if not workers:
+        workers = os.cpu_count() or 1
+    workers = min(workers, max(1, len(texts) // CORPUS_BATCH_SIZE))
+    if workers <= 1:
+        return _tokenize_batch(texts, language)
+
+    batches = [texts[i:i + CORPUS_BATCH_SIZE] for i in range(0, len(texts), CORPUS_BATCH_SIZE)]
+    corpus = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for tokens in executor.map(_tokenize_batch, batches, [language] * len(batches)):
+            corpus.extend(tokens)
+    return corpus
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🗃️  КЭШИ ДЛЯ RAG ENGINE
+
+LRUCache      - потокобезопасный LRU-кэш в памяти со счетчиками попаданий
+EmbeddingCache - кэш эмбеддингов запросов: LRU в памяти + SQLite на диске
+SearchResultCache - кэш ответов поиска (TTL + LRU, сброс при смене данных)
+AsyncSingleFlight - объединение одинаковых одновременных запросов в asyncio
+normalize_query - нормализация текста запроса для ключей кэшей
+"""
+
+import asyncio
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION_TAIL = re.compile(r'[\s?!.,;:]+$')
+
+
+def normalize_query(text: str) -> str:
+    """Нормализует запрос: регистр, пробелы и финальная пунктуация не влияют на ключ."""
+    return _PUNCTUATION_TAIL.sub('', ' '.join(text.lower().split()))
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш с ограничением числа записей"""
+
+    def __init__(self, max_items: int = 1024):
+        self.max_items = max_items
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_items': self.max_items,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class EmbeddingCache:
+    """
+    Кэш эмбеддингов запросов по ключу (model, task_type, нормализованный текст).
+
+    Сначала проверяется LRU в памяти, затем SQLite на диске. Размер базы
+    ограничен max_disk_mb: при превышении удаляются давно не использованные записи.
+    """
+
+    def __init__(self, db_path: Optional[Path] = None, max_memory_items: int = 2048, max_disk_mb: float = 200.0):
+        self.memory = LRUCache(max_memory_items)
+        self.db_path = Path(db_path) if db_path else None
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disk_bytes = 0
+
+        self._connect()
+
+    def _connect(self):
+        if self.db_path is not None:
+            try:
+                self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings ("
+                    " key TEXT PRIMARY KEY, model TEXT, task_type TEXT, text TEXT,"
+                    " vector BLOB, last_used REAL)"
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+                self._conn.commit()
+                row = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+                self._disk_bytes = int(row[0])
+            except Exception as e:
+                logger.warning(f"⚠️ Дисковый кэш эмбеддингов недоступен ({self.db_path}): {e}")
+                self._conn = None
+
+    def after_fork(self):
+        """Открывает новое соединение SQLite в дочернем процессе (соединения нельзя наследовать через fork)."""
+        self._lock = threading.Lock()
+        self._conn = None
+        self._connect()
+
+    def close(self):
+        """Закрывает базу SQLite (кэш в памяти продолжает работать)."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @classmethod
+    def normalize(cls, text: str) -> str:
+        return normalize_query(text)
+
+    @classmethod
+    def make_key(cls, model: str, task_type: str, text: str) -> str:
+        raw = f"{model}\x1f{task_type}\x1f{cls.normalize(text)}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get_many(self, model: str, task_type: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Возвращает эмбеддинги из кэша (None для отсутствующих)."""
+        keys = [self.make_key(model, task_type, t) for t in texts]
+        found: List[Optional[np.ndarray]] = [self.memory.get(k) for k in keys]
+
+        missing = [i for i, v in enumerate(found) if v is None]
+        if missing and self._conn is not None:
+            missing_keys = [keys[i] for i in missing]
+            try:
+                with self._lock:
+                    placeholders = ','.join('?' * len(missing_keys))
+                    rows = self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", missing_keys
+                    ).fetchall()
+                    if rows:
+                        self._conn.executemany(
+                            "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                            [(time.time(), key) for key, _ in rows]
+                        )
+                        self._conn.commit()
+                from_disk = {key: np.frombuffer(blob, dtype=np.float32).copy() for key, blob in rows}
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка чтения кэша эмбеддингов: {e}")
+                from_disk = {}
+
+            for i in missing:
+                vector = from_disk.get(keys[i])
+                if vector is not None:
+                    found[i] = vector
+                    self.memory.put(keys[i], vector)
+                    self.disk_hits += 1
+
+        for vector in found:
+            if vector is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return found
+
+    def put_many(self, model: str, task_type: str, texts: List[str], vectors: np.ndarray):
+        """Сохраняет эмбеддинги в память и на диск."""
+        rows = []
+        now = time.time()
+        for text, vector in zip(texts, vectors):
+            vector = np.asarray(vector, dtype=np.float32)
+            key = self.make_key(model, task_type, text)
+            self.memory.put(key, vector)
+            rows.append((key, model, task_type, self.normalize(text), vector.tobytes(), now))
+
+        if not rows or self._conn is None:
+            return
+        try:
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, model, task_type, text, vector, last_used)"
+                    " VALUES (?, ?, ?, ?, ?, ?)", rows
+                )
+                self._disk_bytes += sum(len(r[4]) for r in rows)
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._evict()
+                self._conn.commit()
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка записи кэша эмбеддингов: {e}")
+
+    def _evict(self):
+        """Удаляет самые старые записи, пока размер не станет ниже 90% лимита."""
+        count, total = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()
+        if not count:
+            self._disk_bytes = 0
+            return
+        target = int(self.max_disk_bytes * 0.9)
+        excess_rows = int(np.ceil((total - target) / (total / count))) if total > target else 0
+        if excess_rows > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN"
+                " (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess_rows,)
+            )
+            logger.info(f"🧹 Кэш эмбеддингов: удалено {excess_rows} старых записей")
+        self._disk_bytes = int(self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0])
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'memory': self.memory.stats(),
+            'disk_enabled': self._conn is not None,
+            'disk_mb': round(self._disk_bytes / (1024 * 1024), 2)
+        }
+
+
+class SearchResultCache:
+    """
+    Кэш готовых ответов RAGEngine.search с TTL и LRU вытеснением.
+
+    version_fn возвращает подпись версии данных (например, mtime/размеры
+    файлов индексов); при ее изменении кэш полностью сбрасывается. Подпись
+    проверяется не чаще, чем раз в check_interval секунд.
+    """
+
+    def __init__(
+        self,
+        max_items: int = 1024,
+        ttl_seconds: float = 600.0,
+        version_fn: Optional[Callable[[], Hashable]] = None,
+        check_interval: float = 1.0
+    ):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.version_fn = version_fn
+        self.check_interval = check_interval
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(query: str, language: str, top_k: int, flags: Optional[Dict[str, Any]] = None) -> Hashable:
+        """Ключ (запрос, язык, top_k, флаги поиска); флаги сортируются по имени."""
+        return (query, language, int(top_k), tuple(sorted((flags or {}).items())))
+
+    def _check_version(self):
+        if self.version_fn is None:
+            return
+        now = time.monotonic()
+        if self._version_checked_at and now - self._version_checked_at < self.check_interval:
+            return
+        self._version_checked_at = now
+        try:
+            version = self.version_fn()
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось определить версию данных для кэша поиска: {e}")
+            version = None
+        if version != self._version:
+            if self._data:
+                logger.info("🧹 Данные изменились - кэш результатов поиска сброшен")
+                self.invalidations += 1
+            self._data.clear()
+            self._version = version
+
+    def get(self, key: Hashable) -> Any:
+        if self.max_items <= 0:
+            return None
+        with self._lock:
+            self._check_version()
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if time.monotonic() < expires_at:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expired += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            self._check_version()
+            self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._version_checked_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_items': self.max_items,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'invalidations': self.invalidations,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class AsyncSingleFlight:
+    """
+    Объединение одинаковых одновременных запросов (single-flight) в asyncio.
+
+    Пока вычисление по ключу выполняется, новые запросы с тем же ключом
+    ожидают его результат, а не запускают свое. Результат общий - вызывающие
+    не должны его изменять. Отмена одного ожидающего не отменяет вычисление.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, "asyncio.Future"] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            self._inflight[key] = future
+            future.add_done_callback(lambda f, k=key: self._forget(k, f))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: "asyncio.Future"):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {'in_flight': len(self._inflight), 'started': self.started, 'coalesced': self.coalesced}
@@ -15,6 +15,11 @@ from pathlib import Path
 from typing import List, Dict
 import time
 
+try:
+    from rag.chunk_store import write_chunk_texts_from_chunked
+except ImportError:
+    from chunk_store import write_chunk_texts_from_chunked
+
 
 class ChunkSplitter:
     """Разбивает текст на чанки с перекрытием"""
@@ -131,6 +136,14 @@ class ChunkSplitter:
         
         return chunked_data, total_chunks
     
+    def save_binary(self, chunked_data: Dict, binary_file: str, source_file: str):
+        """
+        Сохраняет тексты чанков в бинарном формате для mmap (chunk_texts_{lang}.bin)
+        """
+        count = write_chunk_texts_from_chunked(Path(binary_file), chunked_data, Path(source_file))
+        binary_size = Path(binary_file).stat().st_size / (1024*1024)
+        print(f"Binary chunk store saved: {binary_file} ({count} chunks, {binary_size:.2f} MB)")
+
     def process_language(self, language: str = 'ru') -> tuple:
         """
         Полный процесс обработки одного языка
@@ -143,12 +156,17 @@ class ChunkSplitter:
         """
         parsed_file = f"rag/parsed_scriptures_{language}.json"
         output_file = f"rag/chunked_scriptures_{language}.json"
+        binary_file = f"rag/chunk_texts_{language}.bin"
         
         if not Path(parsed_file).exists():
             print(f"WARNING: File {parsed_file} not found. Skipping {language}.")
             return None, None
         if Path(output_file).exists():
             print(f"SKIP: {output_file} already exists. Skipping {language}.")
+            if not Path(binary_file).exists():
+                print(f"Writing binary chunk store {binary_file} from existing JSON...")
+                with open(output_file, 'r', encoding='utf-8') as f:
+                    self.save_binary(json.load(f), binary_file, output_file)
             file_size = Path(output_file).stat().st_size / (1024*1024)
             stats = {
                 'language': language,
@@ -172,6 +190,7 @@ class ChunkSplitter:
         with open(output_file, 'w', encoding='utf-8') as f:
             json.dump(chunked_data, f, ensure_ascii=False, indent=2)
         file_size = Path(output_file).stat().st_size / (1024*1024)
+        self.save_binary(chunked_data, binary_file, output_file)
         elapsed = time.time() - start_time
         print(f"File saved! Size: {file_size:.2f} MB")
         print(f"Processing time: {elapsed:.1f} sec ({elapsed/60:.1f} min)")
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+📦 ХРАНИЛИЩЕ ТЕКСТОВ И МЕТАДАННЫХ ЧАНКОВ
+
+Плоское хранилище текстов чанков, адресуемое по id строки FAISS.
+Все тексты лежат в одном UTF-8 буфере, а таблица смещений позволяет
+получить чанк N одним срезом (без вложенных словарей книга/глава/чанк).
+Параллельно хранится копия в нижнем регистре для поиска фраз и стихов.
+
+Бинарные файлы (открываются через mmap, см. array_file.py):
+    chunk_texts_{lang}.bin - тексты чанков и ключи (книга, глава, чанк);
+                             пишет chunk_splitter.py
+    chunk_meta_{lang}.bin  - записи фиксированной ширины в порядке строк
+                             FAISS со ссылкой на текст; пишет faiss_indexer.py
+В заголовках - размер, время изменения и SHA-1 исходного JSON: при другом
+времени изменения содержимое сверяется по хэшу (правка без изменения размера).
+"""
+
+import hashlib
+import zlib
+import numpy as np
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from rag.array_file import write_array_file, open_array_file
+except ImportError:
+    from array_file import write_array_file, open_array_file
+
+CHUNK_STORE_VERSION = 2
+
+# Колонки записи метаданных (int32)
+META_BOOK, META_CHAPTER, META_CHUNK_IDX, META_HTML_PATH, META_TEXT_ID = range(5)
+META_COLUMNS = 5
+NO_VALUE = -1
+
+
+def _structure_chapters(raw_metadata: Dict) -> List[Dict[str, Any]]:
+    """Файлы структуры faiss_metadata_{lang}.json в порядке ключей эмбеддингов."""
+    structure = raw_metadata.get('structure', {})
+
+    # Collect all chapters
+    all_chapters = []
+    for book_key, book_data in structure.items():
+        for chapter_key, chapter_data in book_data.items():
+            if 'embedding_key' in chapter_data:
+                all_chapters.append({
+                    'book': book_key,
+                    'chapter': chapter_key,
+                    'data': chapter_data
+                })
+
+    # Sort by embedding_key index (e.g., embeddings_0, embeddings_1)
+    def get_embedding_index(item):
+        key = item['data']['embedding_key']
+        try:
+            return int(key.split('_')[1])
+        except (IndexError, ValueError):
+            return 999999
+
+    all_chapters.sort(key=get_embedding_index)
+    return all_chapters
+
+
+def chunk_ids(raw_metadata: Dict) -> Dict[Tuple[str, str], List[int]]:
+    """
+    id строк FAISS для чанков каждого файла (book, chapter).
+
+    После инкрементального обновления (incremental_update.py) id записаны в
+    поле 'ids' файла; иначе строки идут подряд в порядке ключей эмбеддингов.
+    """
+    ids = {}
+    next_id = 0
+    for item in _structure_chapters(raw_metadata):
+        data = item['data']
+        num_chunks = data.get('num_chunks', 0)
+        if 'ids' in data:
+            ids[(item['book'], item['chapter'])] = list(data['ids'])
+        else:
+            ids[(item['book'], item['chapter'])] = list(range(next_id, next_id + num_chunks))
+            next_id += num_chunks
+    return ids
+
+
+def empty_chunk_meta() -> Dict[str, Any]:
+    """Запись на месте удаленного чанка (id строки FAISS не переиспользуется)."""
+    return {'book': None, 'chapter': None, 'chunk_idx': NO_VALUE, 'text_preview': '', 'html_path': None}
+
+
+def flatten_faiss_metadata(raw_metadata: Dict) -> List[Dict[str, Any]]:
+    """
+    Разворачивает faiss_metadata_{lang}.json в плоский список в порядке строк FAISS.
+    """
+    all_chapters = _structure_chapters(raw_metadata)
+    ids_by_file = chunk_ids(raw_metadata)
+    size = max((i + 1 for ids in ids_by_file.values() for i in ids), default=0)
+    flat_metadata = [None] * size
+
+    # Create flat list
+    for item in all_chapters:
+        book = item['book']
+        chapter = item['chapter']
+        data = item['data']
+        text_previews = data.get('text_previews', [])
+
+        for i, row in enumerate(ids_by_file[(book, chapter)]):
+            preview = text_previews[i] if i < len(text_previews) else ""
+            flat_metadata[row] = {
+                'book': book,
+                'chapter': chapter,
+                'chunk_idx': i,
+                'text_preview': preview,
+                'html_path': data.get('html_path')
+            }
+
+    return [meta if meta is not None else empty_chunk_meta() for meta in flat_metadata]
+
+
+class StringTable:
+    """Таблица уникальных строк (книги, главы, пути) в одном буфере"""
+
+    def __init__(self, blob, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+        self._cache: Dict[int, str] = {}
+
+    @staticmethod
+    def build(strings: Iterable[Optional[str]]) -> Tuple['StringTable', np.ndarray]:
+        """Возвращает таблицу и массив id строк (NO_VALUE для None)."""
+        ids = []
+        lookup: Dict[str, int] = {}
+        for value in strings:
+            if value is None:
+                ids.append(NO_VALUE)
+                continue
+            if value not in lookup:
+                lookup[value] = len(lookup)
+            ids.append(lookup[value])
+        blob, offsets = ChunkTextStore._pack(lookup.keys())
+        return StringTable(np.frombuffer(blob, dtype=np.uint8), offsets), np.array(ids, dtype=np.int32)
+
+    def get(self, sid: int) -> Optional[str]:
+        if sid == NO_VALUE:
+            return None
+        value = self._cache.get(sid)
+        if value is None:
+            value = str(self.blob[self.offsets[sid]:self.offsets[sid + 1]], 'utf-8')
+            self._cache[sid] = value
+        return value
+
+
+class ChunkTextStore:
+    """Тексты чанков в одном буфере со смещениями по id строки FAISS"""
+
+    def __init__(
+        self,
+        blob,
+        offsets: np.ndarray,
+        lower_blob=None,
+        lower_offsets: Optional[np.ndarray] = None,
+        order: Optional[np.ndarray] = None
+    ):
+        """
+        Args:
+            blob: UTF-8 буфер (bytes, memoryview или массив uint8)
+            offsets: границы текстов в buffer (len = число текстов + 1)
+            lower_blob, lower_offsets: то же для копии в нижнем регистре
+            order: отображение id строки FAISS -> номер текста (NO_VALUE = нет текста)
+        """
+        self.blob = blob
+        self.offsets = offsets
+        self.lower_blob = lower_blob
+        self.lower_offsets = lower_offsets
+        self.order = order
+
+    @staticmethod
+    def _pack(texts: Iterable[str]):
+        parts = [t.encode('utf-8') for t in texts]
+        offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+        if parts:
+            np.cumsum([len(p) for p in parts], out=offsets[1:])
+        return b''.join(parts), offsets
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str], with_lower: bool = True) -> 'ChunkTextStore':
+        """
+        Собирает хранилище из текстов в порядке id.
+
+        Args:
+            texts: тексты чанков (индекс в последовательности = id строки FAISS)
+            with_lower: хранить ли копию в нижнем регистре
+        """
+        texts = list(texts)
+        blob, offsets = cls._pack(texts)
+        if not with_lower:
+            return cls(blob, offsets)
+        lower_blob, lower_offsets = cls._pack(t.lower() for t in texts)
+        return cls(blob, offsets, lower_blob, lower_offsets)
+
+    def __len__(self) -> int:
+        if self.order is not None:
+            return len(self.order)
+        return len(self.offsets) - 1
+
+    def _slot(self, idx: int) -> int:
+        return int(self.order[idx]) if self.order is not None else idx
+
+    def get(self, idx: int) -> str:
+        slot = self._slot(idx)
+        if slot == NO_VALUE:
+            return ''
+        return str(self.blob[self.offsets[slot]:self.offsets[slot + 1]], 'utf-8')
+
+    def get_lower(self, idx: int) -> str:
+        if self.lower_blob is None:
+            return self.get(idx).lower()
+        slot = self._slot(idx)
+        if slot == NO_VALUE:
+            return ''
+        return str(self.lower_blob[self.lower_offsets[slot]:self.lower_offsets[slot + 1]], 'utf-8')
+
+    def get_prefix(self, idx: int, length: int) -> str:
+        """Первые length символов текста без декодирования всего чанка."""
+        slot = self._slot(idx)
+        if slot == NO_VALUE:
+            return ''
+        start = self.offsets[slot]
+        end = min(self.offsets[slot + 1], start + length * 4)
+        return str(self.blob[start:end], 'utf-8', 'ignore')[:length]
+
+    def fingerprint(self) -> str:
+        """Отпечаток корпуса: число текстов и CRC32 их длин (в байтах) по id."""
+        lengths = np.diff(np.asarray(self.offsets, dtype=np.int64))
+        if self.order is not None:
+            # NO_VALUE (-1) указывает на добавленный в конец маркер -1
+            lengths = np.append(lengths, -1)[np.asarray(self.order)]
+        return f"{len(self)}:{zlib.crc32(lengths.tobytes()):08x}"
+
+    def iter_lower(self) -> Iterator[str]:
+        for idx in range(len(self)):
+            yield self.get_lower(idx)
+
+
+class ChunkMetadata(Sequence):
+    """
+    Метаданные чанков поверх записей фиксированной ширины.
+    Ведет себя как список словарей, но словари создаются только при обращении.
+    """
+
+    PREVIEW_LENGTH = 100
+
+    def __init__(self, records: np.ndarray, strings: StringTable, texts: ChunkTextStore):
+        self.records = records
+        self.strings = strings
+        self.texts = texts
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        rec = self.records[idx]
+        return {
+            'book': self.strings.get(int(rec[META_BOOK])),
+            'chapter': self.strings.get(int(rec[META_CHAPTER])),
+            'chunk_idx': int(rec[META_CHUNK_IDX]),
+            'text_preview': self.texts.get_prefix(idx, self.PREVIEW_LENGTH),
+            'html_path': self.strings.get(int(rec[META_HTML_PATH]))
+        }
+
+
+def _file_sha1(path: Path) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_info(source_file: Optional[Path]) -> Dict[str, Any]:
+    if source_file is None or not Path(source_file).exists():
+        return {}
+    stat = Path(source_file).stat()
+    return {
+        'source_file': Path(source_file).name,
+        'source_size': stat.st_size,
+        'source_mtime_ns': stat.st_mtime_ns,
+        'source_sha1': _file_sha1(source_file)
+    }
+
+
+def write_chunk_texts(path: Path, entries: Iterable[Tuple[str, str, int, str]], source_file: Path = None) -> int:
+    """
+    Записывает chunk_texts_{lang}.bin.
+
+    Args:
+        entries: (book, chapter, chunk_idx, text) в любом порядке
+        source_file: исходный JSON (его размер сохраняется для проверки актуальности)
+
+    Returns:
+        число записанных чанков
+    """
+    entries = list(entries)
+    texts = [e[3] for e in entries]
+    blob, offsets = ChunkTextStore._pack(texts)
+    lower_blob, lower_offsets = ChunkTextStore._pack(t.lower() for t in texts)
+    strings, sids = StringTable.build(s for e in entries for s in (e[0], e[1]))
+
+    keys = np.empty((len(entries), 3), dtype=np.int32)
+    keys[:, 0] = sids[0::2]
+    keys[:, 1] = sids[1::2]
+    keys[:, 2] = [e[2] for e in entries]
+
+    header = {'kind': 'chunk_texts', 'version': CHUNK_STORE_VERSION, 'count': len(entries)}
+    header.update(_source_info(source_file))
+    write_array_file(path, header, {
+        'offsets': offsets,
+        'blob': np.frombuffer(blob, dtype=np.uint8),
+        'lower_offsets': lower_offsets,
+        'lower_blob': np.frombuffer(lower_blob, dtype=np.uint8),
+        'keys': keys,
+        'strings_offsets': strings.offsets,
+        'strings_blob': strings.blob
+    })
+    return len(entries)
+
+
+def write_chunk_texts_from_chunked(path: Path, chunked_data: Dict[str, Dict[str, List[str]]], source_file: Path = None) -> int:
+    """Записывает chunk_texts_{lang}.bin из структуры chunked_scriptures_{lang}.json."""
+    return write_chunk_texts(path, (
+        (book, chapter, chunk_idx, text)
+        for book, chapters in chunked_data.items()
+        for chapter, chunks in chapters.items()
+        for chunk_idx, text in enumerate(chunks)
+    ), source_file)
+
+
+def read_chunk_text_keys(path: Path) -> Dict[Tuple[str, str, int], int]:
+    """Возвращает отображение (book, chapter, chunk_idx) -> номер текста в chunk_texts_{lang}.bin."""
+    _, arrays = open_array_file(path)
+    strings = StringTable(arrays['strings_blob'], arrays['strings_offsets'])
+    return {
+        (strings.get(int(b)), strings.get(int(c)), int(i)): slot
+        for slot, (b, c, i) in enumerate(arrays['keys'])
+    }
+
+
+def write_chunk_meta(path: Path, flat_metadata: List[Dict[str, Any]], text_slots: List[int], source_file: Path = None):
+    """
+    Записывает chunk_meta_{lang}.bin.
+
+    Args:
+        flat_metadata: метаданные в порядке строк FAISS (см. flatten_faiss_metadata)
+        text_slots: номер текста в chunk_texts_{lang}.bin для каждой строки (NO_VALUE = нет)
+        source_file: исходный JSON метаданных
+    """
+    strings, sids = StringTable.build(
+        s for meta in flat_metadata for s in (meta.get('book'), meta.get('chapter'), meta.get('html_path'))
+    )
+    records = np.empty((len(flat_metadata), META_COLUMNS), dtype=np.int32)
+    records[:, META_BOOK] = sids[0::3]
+    records[:, META_CHAPTER] = sids[1::3]
+    records[:, META_HTML_PATH] = sids[2::3]
+    records[:, META_CHUNK_IDX] = [meta.get('chunk_idx', 0) for meta in flat_metadata]
+    records[:, META_TEXT_ID] = np.asarray(text_slots, dtype=np.int32)
+
+    header = {'kind': 'chunk_meta', 'version': CHUNK_STORE_VERSION, 'count': len(flat_metadata)}
+    header.update(_source_info(source_file))
+    write_array_file(path, header, {
+        'records': records,
+        'strings_offsets': strings.offsets,
+        'strings_blob': strings.blob
+    })
+
+
+def write_chunk_meta_for_texts(meta_path: Path, texts_path: Path, flat_metadata: List[Dict[str, Any]], source_file: Path = None) -> int:
+    """
+    Записывает chunk_meta_{lang}.bin, связывая строки FAISS с текстами из chunk_texts_{lang}.bin.
+
+    Returns:
+        число строк без найденного текста
+    """
+    slots_by_key = read_chunk_text_keys(texts_path)
+    text_slots = [
+        slots_by_key.get((meta.get('book'), meta.get('chapter'), meta.get('chunk_idx')), NO_VALUE)
+        for meta in flat_metadata
+    ]
+    write_chunk_meta(meta_path, flat_metadata, text_slots, source_file)
+    return sum(1 for slot in text_slots if slot == NO_VALUE)
+
+
+def _is_current(header: Dict[str, Any], kind: str, source_file: Optional[Path]) -> bool:
+    if header.get('kind') != kind or header.get('version') != CHUNK_STORE_VERSION:
+        return False
+    # Если рядом лежит исходный JSON с другим содержимым, бинарный файл устарел
+    if source_file is not None and Path(source_file).exists() and 'source_size' in header:
+        stat = Path(source_file).stat()
+        if stat.st_size != header['source_size']:
+            return False
+        if stat.st_mtime_ns == header.get('source_mtime_ns'):
+            return True
+        # Файл перезаписан или скопирован: сверяем содержимое
+        return _file_sha1(source_file) == header.get('source_sha1')
+    return True
+
+
+def open_chunk_store(
+    texts_path: Path,
+    meta_path: Path,
+    texts_source: Path = None,
+    meta_source: Path = None
+) -> Optional[Tuple[ChunkTextStore, ChunkMetadata]]:
+    """
+    Открывает бинарные файлы чанков через mmap.
+
+    Returns:
+        (text_store, metadata) или None, если файлы устарели или другой версии
+    """
+    texts_header, texts = open_array_file(texts_path)
+    meta_header, meta = open_array_file(meta_path)
+    if not _is_current(texts_header, 'chunk_texts', texts_source) or \
+       not _is_current(meta_header, 'chunk_meta', meta_source):
+        return None
+
+    records = meta['records']
+    store = ChunkTextStore(
+        texts['blob'], texts['offsets'],
+        texts['lower_blob'], texts['lower_offsets'],
+        order=records[:, META_TEXT_ID]
+    )
+    strings = StringTable(meta['strings_blob'], meta['strings_offsets'])
+    return store, ChunkMetadata(records, strings, store)
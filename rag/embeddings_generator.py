@@ -211,26 +211,33 @@ class EmbeddingsGenerator:
         return stats
 
 
-def process_all_languages():
-    """Обрабатывает эмбеддинги для обоих языков"""
-    
-    import sys
-    
-    print("="*70)
-    print("EMBEDDINGS GENERATOR - START (GOOGLE GEMINI API)")
-    print("="*70)
-
+def configure_api() -> bool:
+    """Настраивает Gemini API ключом GEMINI_API_KEY (из окружения или .env файла)."""
     # Загружаем API ключ из .env файла
     load_dotenv()
     if 'GEMINI_API_KEY' not in os.environ:
         print("ERROR: GEMINI_API_KEY environment variable not found.")
-        return
+        return False
     
     try:
         genai.configure(api_key=os.environ['GEMINI_API_KEY'])
         print("API Key configured.")
+        return True
     except Exception as e:
         print(f"Error configuring API: {e}")
+        return False
+
+
+def process_all_languages():
+    """Обрабатывает эмбеддинги для обоих языков"""
+    
+    import sys
+    
+    print("="*70)
+    print("EMBEDDINGS GENERATOR - START (GOOGLE GEMINI API)")
+    print("="*70)
+
+    if not configure_api():
         return
 
     generator = EmbeddingsGenerator()
@@ -7,9 +7,36 @@
 по эмбеддингам чанков.
 
 ЗАПУСК:
-    python rag/faiss_indexer.py
+    python rag/faiss_indexer.py [ru|en|all] [--index-type TYPE] [--metric l2|ip] [--tune]
+
+ТИПЫ ИНДЕКСА (--index-type):
+    auto   - IndexFlatL2 до 10 000 векторов, иначе IVFFlat (по умолчанию)
+    flat   - точный поиск, полные float32 векторы
+    ivf    - IVF{nlist},Flat
+    ivfpq  - IVF{nlist},PQ{m}x{bits}: векторы сжаты до m байт
+    opq    - OPQ{m},IVF{nlist},PQ{m}x{bits}: PQ с обученным поворотом (точнее ivfpq)
+    hnsw   - HNSW{M},Flat: граф, быстрый поиск без обучения
+    sq8    - скалярное квантование в int8 (в 4 раза меньше float32)
+    fp16   - скалярное квантование в float16 (в 2 раза меньше float32)
+
+Выбранный тип и его параметры записываются в faiss_metadata_{lang}.json
+(раздел "index") и в faiss_index_{lang}.json рядом с индексом; параметры
+поиска (nprobe, efSearch) применяются движком при загрузке индекса.
+
+МЕТРИКА (--metric):
+    l2 - квадрат евклидова расстояния (по умолчанию)
+    ip - скалярное произведение: векторы хранятся нормализованными, FAISS
+         возвращает косинусное сходство; движок переводит его в расстояние
+         2 - 2*cos, поэтому оценки и пороги совпадают с l2
+
+ПОДБОР ПАРАМЕТРОВ (--tune):
+    Для отложенных запросов (--tune-queries файл .npy/.npz, иначе случайные
+    векторы корпуса) точные соседи вычисляются плоским индексом (IndexFlat), затем
+    перебираются nlist/nprobe (IVF) или efSearch (HNSW), и сохраняется самая
+    дешевая настройка с recall@k >= --target-recall.
 """
 
+import argparse
 import json
 import numpy as np
 from pathlib import Path
@@ -23,6 +50,120 @@ except ImportError:
     print("   pip install faiss-cpu  (or faiss-gpu for GPU)")
     exit(1)
 
+try:
+    from rag.chunk_store import flatten_faiss_metadata, write_chunk_meta_for_texts
+except ImportError:
+    from chunk_store import flatten_faiss_metadata, write_chunk_meta_for_texts
+
+
+INDEX_TYPES = ('auto', 'flat', 'ivf', 'ivfpq', 'opq', 'hnsw', 'sq8', 'fp16')
+# l2 - квадрат расстояния между нормализованными векторами (2 - 2*cos),
+# ip - скалярное произведение нормализованных векторов (косинусное сходство)
+METRICS = {'l2': faiss.METRIC_L2, 'ip': faiss.METRIC_INNER_PRODUCT}
+FLAT_THRESHOLD = 10000  # auto: до этого числа векторов используется IndexFlatL2
+
+DEFAULT_PQ_M = 64       # Байт на вектор для PQ (768 / 64 = 12 измерений на подквантователь)
+DEFAULT_PQ_BITS = 8
+DEFAULT_HNSW_M = 32
+DEFAULT_EF_CONSTRUCTION = 80
+DEFAULT_EF_SEARCH = 64
+
+DEFAULT_TARGET_RECALL = 0.95
+DEFAULT_RECALL_K = 10
+DEFAULT_TUNE_QUERIES = 1000  # Векторов корпуса в роли запросов, если --tune-queries не задан
+
+
+def _powers_of_two(limit: int) -> List[int]:
+    values = [1]
+    while values[-1] * 2 < limit:
+        values.append(values[-1] * 2)
+    return values + ([limit] if limit > 1 else [])
+
+
+def recall_at_k(index: faiss.Index, queries: np.ndarray, ground_truth: np.ndarray, k: int) -> float:
+    """Доля точных k ближайших соседей, найденных индексом (в среднем по запросам)."""
+    _, found = index.search(queries, k)
+    hits = sum(len(np.intersect1d(row, truth)) for row, truth in zip(found, ground_truth))
+    return round(hits / (len(queries) * k), 4)
+
+
+def _cheaper(best, candidate, target_recall: float):
+    """Выбирает между лучшей настройкой и кандидатом: сначала достижение цели, затем стоимость, затем recall."""
+    if best is None:
+        return candidate
+
+    def rank(entry):
+        point = entry[1]
+        reached = point['recall'] >= target_recall
+        return (not reached, point['cost'] if reached else -point['recall'])
+
+    return candidate if rank(candidate) < rank(best) else best
+
+
+def load_query_embeddings(path: str) -> np.ndarray:
+    """Эмбеддинги запросов для подбора параметров (.npy или .npz с массивами embeddings_*)."""
+    data = np.load(path)
+    if isinstance(data, np.ndarray):
+        return data.astype('float32')
+    arrays = [data[key] for key in sorted(data.files)]
+    return np.vstack(arrays).astype('float32')
+
+
+def sample_queries(embeddings: np.ndarray, count: int, seed: int = 0) -> np.ndarray:
+    """Случайные векторы корпуса как запросы, если отложенных запросов нет."""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(embeddings.shape[0], size=min(count, embeddings.shape[0]), replace=False)
+    return embeddings[rows].copy()
+
+
+def default_nlist(num_vectors: int) -> int:
+    """Число кластеров IVF: ~4*sqrt(n) (рекомендация FAISS), не больше 65536."""
+    return max(1, min(65536, int(4 * np.sqrt(num_vectors))))
+
+
+def index_factory_string(index_type: str, nlist: int = None, pq_m: int = DEFAULT_PQ_M,
+                         pq_bits: int = DEFAULT_PQ_BITS, hnsw_m: int = DEFAULT_HNSW_M) -> str:
+    """Строка для faiss.index_factory по типу индекса."""
+    factories = {
+        'flat': "Flat",
+        'ivf': f"IVF{nlist},Flat",
+        'ivfpq': f"IVF{nlist},PQ{pq_m}x{pq_bits}",
+        'opq': f"OPQ{pq_m},IVF{nlist},PQ{pq_m}x{pq_bits}",
+        'hnsw': f"HNSW{hnsw_m},Flat",
+        'sq8': "SQ8",
+        'fp16': "SQfp16",
+    }
+    if index_type not in factories:
+        raise ValueError(f"Неизвестный тип индекса: {index_type} (доступны: {', '.join(INDEX_TYPES)})")
+    return factories[index_type]
+
+
+def search_parameters(index: faiss.Index) -> Dict[str, int]:
+    """Параметры поиска индекса в именах faiss.ParameterSpace (nprobe, efSearch)."""
+    params = {}
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        params['nprobe'] = int(ivf.nprobe)
+    if hasattr(index, 'hnsw'):
+        params['efSearch'] = int(index.hnsw.efSearch)
+    return params
+
+
+def saved_index_options(config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Аргументы build_index из сохраненных параметров индекса (раздел "index"
+    faiss_metadata_{lang}.json или faiss_index_{lang}.json).
+    """
+    config = config or {}
+    search_params = config.get('search_params', {})
+    options = {
+        'index_type': config.get('type', 'auto'), 'metric': config.get('metric', 'l2'),
+        'nlist': config.get('nlist'), 'nprobe': search_params.get('nprobe'),
+        'pq_m': config.get('pq_m'), 'pq_bits': config.get('pq_bits'),
+        'hnsw_m': config.get('hnsw_m'), 'ef_search': search_params.get('efSearch')
+    }
+    return {key: value for key, value in options.items() if value is not None}
+
 
 class FAISSIndexer:
     def __init__(self, embedding_dim: int = 768): # Обновленная размерность для text-embedding-004
@@ -31,6 +172,7 @@ class FAISSIndexer:
             embedding_dim: размерность эмбеддингов
         """
         self.embedding_dim = embedding_dim
+        self.index_config: Dict[str, Any] = {}
         # Создаем индекс с использованием IVFFlat для больших наборов данных
         # Количество кластеров (nlist) должно быть подобрано для вашего датасета
         self.quantizer = faiss.IndexFlatL2(embedding_dim)
@@ -77,49 +219,187 @@ class FAISSIndexer:
             
         return embeddings, metadata
         
-    def build_index(self, embeddings: np.ndarray) -> faiss.Index:
+    def build_index(
+        self,
+        embeddings: np.ndarray,
+        index_type: str = 'auto',
+        nlist: int = None,
+        nprobe: int = None,
+        pq_m: int = DEFAULT_PQ_M,
+        pq_bits: int = DEFAULT_PQ_BITS,
+        hnsw_m: int = DEFAULT_HNSW_M,
+        ef_search: int = DEFAULT_EF_SEARCH,
+        metric: str = 'l2'
+    ) -> faiss.Index:
         """
         Строит FAISS индекс из массива эмбеддингов.
         
         Args:
             embeddings: массив эмбеддингов
+            index_type: тип индекса (см. INDEX_TYPES)
+            nlist, nprobe: число кластеров IVF и кластеров для поиска
+            pq_m, pq_bits: число подквантователей PQ и бит на код
+            hnsw_m, ef_search: связность графа HNSW и глубина поиска
+            metric: 'l2' или 'ip' (косинусное сходство; векторы хранятся нормализованными)
             
         Returns:
-            Построенный FAISS индекс
+            Построенный FAISS индекс (параметры - в self.index_config)
         """
         print(f"\nBuilding FAISS index for {embeddings.shape[0]:,} embeddings...")
         start_time = time.time()
+        num_vectors = embeddings.shape[0]
         
         # Нормализуем эмбеддинги перед добавлением в индекс
         faiss.normalize_L2(embeddings)
         
-        # Выбираем тип индекса в зависимости от количества эмбеддингов
-        # IndexFlatL2 - простой, для небольших наборов данных
-        # IndexIVFFlat - более сложный, для больших наборов данных, требует обучения
-        if embeddings.shape[0] < 10000: # Можно настроить порог
-            index = faiss.IndexFlatL2(self.embedding_dim)
-            print(f"  📍 Используется IndexFlatL2")
-            index.add(embeddings)
-        else:
-            # Инициализация IndexIVFFlat требует обучения
-            quantizer = faiss.IndexFlatL2(self.embedding_dim)
-            nlist = min(100, int(np.sqrt(embeddings.shape[0]))) # Количество кластеров, эвристика
-            index = faiss.IndexIVFFlat(quantizer, self.embedding_dim, nlist, faiss.METRIC_L2)
-            index.nprobe = min(50, nlist) # Количество кластеров для поиска
-            print(f"  📍 Используется IndexIVFFlat с {nlist} кластерами, nprobe={index.nprobe}")
-            
-            # Обучение индекса
-            if not index.is_trained:
-                print("  Training IndexIVFFlat (may take some time)...")
-                index.train(embeddings)
-                print("  Training completed.")
+        if metric not in METRICS:
+            raise ValueError(f"Неизвестная метрика: {metric} (доступны: {', '.join(METRICS)})")
+        config = {'type': index_type, 'metric': metric}
+        if index_type == 'auto':
+            # IndexFlatL2 - простой, для небольших наборов данных
+            # IndexIVFFlat - более сложный, для больших наборов данных, требует обучения
+            if num_vectors < FLAT_THRESHOLD: # Можно настроить порог
+                index_type = 'flat'
+            else:
+                index_type = 'ivf'
+                nlist = nlist or min(100, int(np.sqrt(num_vectors))) # Количество кластеров, эвристика
+                nprobe = nprobe or min(50, nlist) # Количество кластеров для поиска
+
+        if index_type in ('ivf', 'ivfpq', 'opq'):
+            nlist = nlist or default_nlist(num_vectors)
+            if num_vectors < nlist:
+                raise ValueError(f"Для {index_type} нужно не меньше {nlist} векторов (nlist), получено {num_vectors}")
+            if index_type != 'ivf':
+                if self.embedding_dim % pq_m:
+                    raise ValueError(f"Размерность {self.embedding_dim} не делится на число подквантователей PQ ({pq_m})")
+                if num_vectors < 2 ** pq_bits:
+                    raise ValueError(f"Для обучения PQ{pq_m}x{pq_bits} нужно не меньше {2 ** pq_bits} векторов")
+                config.update(pq_m=pq_m, pq_bits=pq_bits)
+            config['nlist'] = nlist
+        elif index_type == 'hnsw':
+            config.update(hnsw_m=hnsw_m, ef_construction=DEFAULT_EF_CONSTRUCTION)
+
+        factory = index_factory_string(index_type, nlist, pq_m, pq_bits, hnsw_m)
+        index = faiss.index_factory(self.embedding_dim, factory, METRICS[metric])
+        print(f"  📍 Используется {factory} ({type(index).__name__})")
+
+        if index_type == 'hnsw':
+            index.hnsw.efConstruction = DEFAULT_EF_CONSTRUCTION
+            index.hnsw.efSearch = ef_search
+        elif index_type in ('ivf', 'ivfpq', 'opq'):
+            faiss.extract_index_ivf(index).nprobe = min(nprobe or max(1, nlist // 16), nlist)
+
+        # Обучение индекса (IVF, PQ, SQ)
+        if not index.is_trained:
+            print(f"  Training {factory} (may take some time)...")
+            index.train(embeddings)
+            print("  Training completed.")
             
-            index.add(embeddings)
+        index.add(embeddings)
+
+        config['factory'] = factory
+        config['search_params'] = search_parameters(index)
+        config['bytes_per_vector'] = self._bytes_per_vector(index)
+        self.index_config = config
         
         elapsed = time.time() - start_time
-        print(f"✅ Индекс построен за {elapsed:.1f} сек")
+        print(f"✅ Индекс построен за {elapsed:.1f} сек (параметры поиска: {config['search_params']})")
         return index
-    
+
+    def _bytes_per_vector(self, index: faiss.Index) -> int:
+        try:
+            return int(index.sa_code_size())
+        except RuntimeError:
+            # HNSW: полные векторы + связи графа (оценка)
+            return self.embedding_dim * 4
+
+    def tune_index(
+        self,
+        embeddings: np.ndarray,
+        queries: np.ndarray,
+        index_type: str = 'ivf',
+        target_recall: float = DEFAULT_TARGET_RECALL,
+        k: int = DEFAULT_RECALL_K,
+        nlists: List[int] = None,
+        **options
+    ) -> faiss.Index:
+        """
+        Подбирает самые дешевые параметры поиска с recall@k не ниже target_recall.
+
+        Точные соседи запросов вычисляются по IndexFlat с той же метрикой. Для IVF перебираются
+        nlist (индекс строится заново для каждого) и nprobe, для HNSW - efSearch.
+        Стоимость - число вычислений расстояний на запрос: nlist + nprobe * n / nlist
+        для IVF, efSearch для HNSW. Если цель недостижима, выбирается настройка
+        с наибольшим recall.
+
+        Returns:
+            индекс с выбранными параметрами (результаты перебора - в self.index_config['tuning'])
+        """
+        if index_type == 'auto':
+            index_type = 'flat' if embeddings.shape[0] < FLAT_THRESHOLD else 'ivf'
+        faiss.normalize_L2(embeddings)
+        queries = np.ascontiguousarray(queries, dtype='float32').copy()
+        faiss.normalize_L2(queries)
+        k = min(k, embeddings.shape[0])
+
+        exact = faiss.IndexFlat(self.embedding_dim, METRICS[options.get('metric', 'l2')])
+        exact.add(embeddings)
+        _, ground_truth = exact.search(queries, k)
+        print(f"  🎯 Подбор параметров {index_type}: {len(queries)} запросов, цель recall@{k} >= {target_recall}")
+
+        sweep = []
+        best = None  # (index, point, index_config)
+        options.pop('nprobe', None)
+        if index_type in ('ivf', 'ivfpq', 'opq'):
+            base = default_nlist(embeddings.shape[0])
+            fixed_nlist = options.pop('nlist', None)
+            nlists = nlists or ([fixed_nlist] if fixed_nlist else sorted({max(1, base // 4), max(1, base // 2), base, base * 2}))
+            for nlist in [n for n in nlists if n <= embeddings.shape[0]]:
+                index = self.build_index(embeddings, index_type=index_type, nlist=nlist, **options)
+                ivf = faiss.extract_index_ivf(index)
+                for nprobe in _powers_of_two(nlist):
+                    ivf.nprobe = nprobe
+                    point = {
+                        'nlist': nlist, 'nprobe': nprobe,
+                        'recall': recall_at_k(index, queries, ground_truth, k),
+                        'cost': nlist + nprobe * embeddings.shape[0] / nlist
+                    }
+                    sweep.append(point)
+                    best = _cheaper(best, (index, point, self.index_config), target_recall)
+                    if point['recall'] >= target_recall:
+                        break  # Больший nprobe только дороже
+            index, point, self.index_config = best
+            faiss.extract_index_ivf(index).nprobe = point['nprobe']
+        elif index_type == 'hnsw':
+            options.pop('ef_search', None)
+            index = self.build_index(embeddings, index_type=index_type, **options)
+            for ef_search in (16, 32, 64, 128, 256, 512):
+                index.hnsw.efSearch = ef_search
+                point = {'efSearch': ef_search, 'recall': recall_at_k(index, queries, ground_truth, k), 'cost': ef_search}
+                sweep.append(point)
+                best = _cheaper(best, (index, point, self.index_config), target_recall)
+                if point['recall'] >= target_recall:
+                    break
+            index, point, self.index_config = best
+            index.hnsw.efSearch = point['efSearch']
+        else:
+            # Flat и SQ: параметров поиска нет, только проверка recall
+            index = self.build_index(embeddings, index_type=index_type, **options)
+            point = {'recall': recall_at_k(index, queries, ground_truth, k), 'cost': embeddings.shape[0]}
+            sweep.append(point)
+
+        if point['recall'] < target_recall:
+            print(f"  ⚠️ Цель recall@{k} >= {target_recall} не достигнута, лучший recall: {point['recall']:.3f}")
+        print(f"  ✅ Выбрано: {point}")
+
+        self.index_config = dict(self.index_config)
+        self.index_config['search_params'] = search_parameters(index)
+        self.index_config['tuning'] = {
+            'target_recall': target_recall, 'k': k, 'queries': len(queries),
+            'selected': point, 'sweep': sweep
+        }
+        return index
+
     def save_index(self, index: faiss.Index, metadata: Dict, language: str = 'ru'):
         """
         Сохраняет FAISS индекс и метаданные в файлы.
@@ -136,28 +416,102 @@ class FAISSIndexer:
         metadata['embedding_model'] = "models/text-embedding-004"
         metadata['embedding_dim'] = self.embedding_dim
         metadata['total_embeddings'] = int(index.ntotal)
+        metadata['index'] = self.index_config or {'type': 'auto', 'metric': 'l2', 'search_params': search_parameters(index)}
 
         with open(metadata_file, 'w', encoding='utf-8') as f:
             json.dump(metadata, f, ensure_ascii=False, indent=2)
         metadata_size = Path(metadata_file).stat().st_size / (1024*1024)
         print(f"Metadata saved: {metadata_size:.2f} MB")
+        self.save_index_config(metadata['index'], language)
+
+        self.save_binary_metadata(metadata, language)
         return index_file, metadata_file
 
-    def process_language(self, language: str = 'ru') -> Dict[str, Any]:
+    def save_index_config(self, config: Dict[str, Any], language: str = 'ru') -> str:
+        """
+        Сохраняет параметры индекса в faiss_index_{lang}.json: движок читает их
+        при загрузке, не открывая большой faiss_metadata_{lang}.json.
+        """
+        config_file = f"rag/faiss_index_{language}.json"
+        with open(config_file, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        return config_file
+
+    def save_binary_metadata(self, metadata: Dict, language: str = 'ru'):
+        """
+        Сохраняет метаданные в бинарном формате для mmap (chunk_meta_{lang}.bin).
+        Требует chunk_texts_{lang}.bin от chunk_splitter.py.
+        """
+        texts_file = Path(f"rag/chunk_texts_{language}.bin")
+        binary_file = Path(f"rag/chunk_meta_{language}.bin")
+        if not texts_file.exists():
+            print(f"WARNING: {texts_file} not found. Run chunk_splitter.py to create the binary chunk store.")
+            return None
+
+        flat_metadata = flatten_faiss_metadata(metadata)
+        missing = write_chunk_meta_for_texts(
+            binary_file, texts_file, flat_metadata, Path(f"rag/faiss_metadata_{language}.json")
+        )
+        print(f"Binary metadata saved: {binary_file} ({len(flat_metadata)} records)")
+        if missing:
+            print(f"WARNING: {missing} records have no chunk text in {texts_file}")
+        return binary_file
+
+    def process_language(
+        self,
+        language: str = 'ru',
+        index_options: Dict[str, Any] = None,
+        tune_options: Dict[str, Any] = None
+    ) -> Dict[str, Any]:
         """
         Полный процесс создания индекса для одного языка.
+
+        Args:
+            index_options: аргументы build_index (index_type, nlist, ...); None - оставить
+                как у существующего индекса. Индекс строится заново, только если явно
+                заданный параметр отличается от сохраненного
+            tune_options: подбор параметров (queries_file, target_recall, k, sample);
+                индекс строится заново с выбранными параметрами
         """
         index_file = f"rag/faiss_index_{language}.bin"
         metadata_file_out = f"rag/faiss_metadata_{language}.json"
+        config_file = Path(f"rag/faiss_index_{language}.json")
+        index_options = {key: value for key, value in (index_options or {}).items() if value is not None}
 
-        # Проверяем, существует ли индекс и метаданные
+        existing_metadata = None
+        saved_config = None
         if Path(index_file).exists() and Path(metadata_file_out).exists():
-            index_size = Path(index_file).stat().st_size / (1024*1024)
-            print(f"SKIP: Index and metadata for {language} already exist ({index_size:.2f} MB). Skipping.")
-            
             # Загружаем существующие метаданные, чтобы вернуть их в статистику
             with open(metadata_file_out, 'r', encoding='utf-8') as f:
                 existing_metadata = json.load(f)
+            saved_config = existing_metadata.get('index')
+        if saved_config is None and config_file.exists():
+            # Полное обновление удаляет индекс, но параметры остаются в faiss_index_{lang}.json
+            with open(config_file, 'r', encoding='utf-8') as f:
+                saved_config = json.load(f)
+        saved_options = saved_index_options(saved_config)
+
+        if existing_metadata is not None:
+            changed = {key: value for key, value in index_options.items() if saved_options.get(key) != value}
+            if tune_options is not None:
+                existing_metadata = None
+            elif changed:
+                print(f"REBUILD: Index for {language} differs from requested {changed}.")
+                existing_metadata = None
+
+        if tune_options is not None:
+            # nlist/nprobe/efSearch подбираются заново, сохраняется только устройство индекса
+            for key in ('nlist', 'nprobe', 'ef_search'):
+                saved_options.pop(key, None)
+        index_options = {**saved_options, **index_options}
+
+        # Проверяем, существует ли индекс и метаданные
+        if existing_metadata is not None:
+            index_size = Path(index_file).stat().st_size / (1024*1024)
+            print(f"SKIP: Index and metadata for {language} already exist ({index_size:.2f} MB). Skipping.")
+
+            if not Path(f"rag/chunk_meta_{language}.bin").exists():
+                self.save_binary_metadata(existing_metadata, language)
             
             # Попытаемся подсчитать общее количество эмбеддингов, если его нет в метаданных
             total_embeddings = existing_metadata.get('total_embeddings')
@@ -181,7 +535,20 @@ class FAISSIndexer:
         if embeddings is None or metadata is None:
             return None
 
-        index = self.build_index(embeddings)
+        if tune_options is not None:
+            queries_file = tune_options.get('queries_file')
+            if queries_file:
+                queries = load_query_embeddings(queries_file)
+            else:
+                queries = sample_queries(embeddings, tune_options.get('sample', DEFAULT_TUNE_QUERIES))
+            index = self.tune_index(
+                embeddings, queries,
+                target_recall=tune_options.get('target_recall', DEFAULT_TARGET_RECALL),
+                k=tune_options.get('k', DEFAULT_RECALL_K),
+                **index_options
+            )
+        else:
+            index = self.build_index(embeddings, **index_options)
         index_file, metadata_file = self.save_index(index, metadata, language)
         
         # Тестирование поиска (опционально, можно добавить сюда)
@@ -197,10 +564,49 @@ class FAISSIndexer:
         return stats
 
 
-def process_all_languages():
-    """Обрабатывает индексы для обоих языков."""
+def add_index_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    """
+    Параметры индекса и подбора (общие с update_rag_db.py). По умолчанию None:
+    параметры существующего индекса сохраняются.
+    """
+    parser.add_argument('--index-type', choices=INDEX_TYPES, default=None,
+                        help="тип индекса FAISS (по умолчанию - как у существующего индекса, иначе auto)")
+    parser.add_argument('--metric', choices=tuple(METRICS), default=None,
+                        help="l2 или ip (косинусное сходство; движок переводит его в расстояние 2 - 2*cos, "
+                             "оценки совпадают с l2). По умолчанию - как у существующего индекса, иначе l2")
+    parser.add_argument('--nlist', type=int, default=None, help="число кластеров IVF (по умолчанию ~4*sqrt(n))")
+    parser.add_argument('--nprobe', type=int, default=None, help="кластеров IVF для поиска")
+    parser.add_argument('--pq-m', type=int, default=None, help=f"байт на вектор для ivfpq/opq (по умолчанию {DEFAULT_PQ_M})")
+    parser.add_argument('--pq-bits', type=int, default=None, help=f"бит на код PQ (по умолчанию {DEFAULT_PQ_BITS})")
+    parser.add_argument('--hnsw-m', type=int, default=None, help=f"связность графа HNSW (по умолчанию {DEFAULT_HNSW_M})")
+    parser.add_argument('--ef-search', type=int, default=None, help=f"efSearch для HNSW (по умолчанию {DEFAULT_EF_SEARCH})")
+    parser.add_argument('--tune', action='store_true', help="подобрать nlist/nprobe/efSearch под целевой recall")
+    parser.add_argument('--tune-queries', default=None, help="эмбеддинги отложенных запросов (.npy/.npz)")
+    parser.add_argument('--tune-sample', type=int, default=DEFAULT_TUNE_QUERIES,
+                        help="векторов корпуса в роли запросов, если --tune-queries не задан")
+    parser.add_argument('--target-recall', type=float, default=DEFAULT_TARGET_RECALL, help="целевой recall@k")
+    parser.add_argument('--recall-k', type=int, default=DEFAULT_RECALL_K, help="k для recall@k")
+    return parser
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="FAISS indexer")
+    parser.add_argument('language', nargs='?', default='all', help="ru, en или all")
+    add_index_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def process_all_languages(argv: List[str] = None, args: argparse.Namespace = None):
+    """
+    Обрабатывает индексы для обоих языков.
+
+    Args:
+        argv: аргументы командной строки
+        args: уже разобранные аргументы (update_rag_db.py); без language - оба языка
+    """
     
-    import sys
+    if args is None:
+        args = parse_args(argv)
     
     print("="*70)
     print("FAISS INDEXER - START")
@@ -210,21 +616,25 @@ def process_all_languages():
     
     all_stats = {}
     
-    # CLI: python faiss_indexer.py [ru|en|all]
-    langs = []
-    if len(sys.argv) > 1:
-        arg = sys.argv[1].lower()
-        if arg in ('ru', 'en'):
-            langs = [arg]
-        else:
-            langs = ['ru', 'en']
-    else:
-        langs = ['ru', 'en']
+    # CLI: python faiss_indexer.py [ru|en|all] [--index-type ...]
+    language = getattr(args, 'language', 'all').lower()
+    langs = [language] if language in ('ru', 'en') else ['ru', 'en']
+    index_options = {
+        'index_type': args.index_type, 'nlist': args.nlist, 'nprobe': args.nprobe,
+        'pq_m': args.pq_m, 'pq_bits': args.pq_bits, 'hnsw_m': args.hnsw_m, 'ef_search': args.ef_search,
+        'metric': args.metric
+    }
+    tune_options = None
+    if args.tune:
+        tune_options = {
+            'queries_file': args.tune_queries, 'sample': args.tune_sample,
+            'target_recall': args.target_recall, 'k': args.recall_k
+        }
 
     for lang in langs:
         print(f"\nSTAGE: {lang.upper()} SCRIPTURES")
         print("-" * 70)
-        stats = indexer.process_language(lang)
+        stats = indexer.process_language(lang, index_options, tune_options)
         if stats:
             all_stats[lang] = stats
     
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+🌐 КОНФИГУРАЦИЯ GUNICORN (POSIX, несколько процессов)
+
+Движок загружается один раз в мастер-процессе до fork: индексы FAISS и
+mmap-хранилища текстов разделяются воркерами (copy-on-write), а не
+загружаются каждым воркером заново.
+
+gunicorn работает только на POSIX (в requirements.txt - с маркером платформы);
+на Windows сервер запускается через waitress (rag_api_server.py).
+
+Запуск (из корня проекта):
+    gunicorn -c rag/gunicorn_conf.py rag.rag_api_server:app
+
+Переменные окружения:
+    SHUKABASE_WORKERS        - число процессов (по умолчанию 2)
+    SHUKABASE_SERVER_THREADS - потоков в каждом процессе (по умолчанию 8)
+    SHUKABASE_HOST / SHUKABASE_PORT
+"""
+
+import os
+
+bind = f"{os.environ.get('SHUKABASE_HOST', '0.0.0.0')}:{os.environ.get('SHUKABASE_PORT', '5000')}"
+workers = int(os.environ.get("SHUKABASE_WORKERS", "2"))
+threads = int(os.environ.get("SHUKABASE_SERVER_THREADS", "8"))
+worker_class = "gthread"
+preload_app = True
+backlog = 256
+timeout = 120
+
+
+def when_ready(server):
+    """Загружает движок в мастер-процессе (после импорта приложения, до запуска воркеров)."""
+    from rag import rag_api_server
+    if rag_api_server.initialize_engine():
+        # Все языки загружаются до fork, иначе каждый воркер загрузит их отдельно
+        engine = rag_api_server.rag_engine_instance
+        for language in engine.languages:
+            engine.load_language(language)
+
+
+def post_fork(server, worker):
+    """Пересоздает пул потоков и соединение SQLite движка в воркере."""
+    from rag import rag_api_server
+    if rag_api_server.rag_engine_instance is not None:
+        rag_api_server.rag_engine_instance.after_fork()
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+♻️  ИНКРЕМЕНТАЛЬНОЕ ОБНОВЛЕНИЕ RAG БАЗЫ
+
+Вместо полной пересборки (update_rag_db.py без флагов) сравнивает
+parsed_scriptures_{lang}.json с манифестом хэшей содержимого файлов
+(update_manifest_{lang}.json) и обрабатывает только новые, измененные и
+удаленные файлы:
+
+    1. чанки и эмбеддинги (Gemini API) - только для новых/измененных файлов;
+    2. FAISS: remove_ids для старых чанков, add_with_ids для новых. id строк
+       не переиспользуются: на месте удаленных чанков в метаданных остаются
+       пустые записи, а у файлов в faiss_metadata_{lang}.json появляется поле 'ids';
+    3. BM25: постинги удаленных документов убираются, токенизируются только
+       новые документы (SparseBM25.with_documents);
+    4. chunked_scriptures_{lang}.json, embeddings_{lang}.npz и бинарные
+       хранилища чанков переписываются (без обращений к API);
+    5. индексы фраз и стихов удаляются - движок перестроит их при загрузке.
+
+При первом запуске манифест создается по текущей базе: файл считается
+неизмененным, если его повторное разбиение совпадает с chunked_scriptures
+и для всех чанков есть эмбеддинги.
+
+Индекс HNSW не поддерживает удаление векторов: для него обновление с
+измененными или удаленными файлами требует полной пересборки.
+
+ЗАПУСК:
+    python update_rag_db.py --incremental [ru|en|all]
+"""
+
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import faiss
+
+try:
+    from rag.chunk_splitter import ChunkSplitter
+    from rag.chunk_store import (
+        chunk_ids, flatten_faiss_metadata, open_chunk_store,
+        write_chunk_meta_for_texts, write_chunk_texts_from_chunked
+    )
+    from rag.bm25_sparse import SparseBM25
+    from rag.bm25_tokenizer import tokenize, tokenizer_signature
+except ImportError:
+    from chunk_splitter import ChunkSplitter
+    from chunk_store import (
+        chunk_ids, flatten_faiss_metadata, open_chunk_store,
+        write_chunk_meta_for_texts, write_chunk_texts_from_chunked
+    )
+    from bm25_sparse import SparseBM25
+    from bm25_tokenizer import tokenize, tokenizer_signature
+
+MANIFEST_VERSION = 1
+
+FileKey = Tuple[str, str]  # (книга, файл)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _embedding_key_number(key: str) -> int:
+    try:
+        return int(key.split('_')[1])
+    except (IndexError, ValueError):
+        return -1
+
+
+class IncrementalUpdater:
+    """Обновляет базу одного языка по изменившимся файлам parsed_scriptures"""
+
+    def __init__(self, language: str = 'ru', base_dir: Path = Path("rag"), splitter: ChunkSplitter = None, generator=None):
+        """
+        Args:
+            splitter: разбиение на чанки (параметры должны совпадать с полной сборкой)
+            generator: EmbeddingsGenerator (по умолчанию создается при первом использовании)
+        """
+        self.language = language
+        self.base_dir = Path(base_dir)
+        self.splitter = splitter or ChunkSplitter(chunk_size=2048, overlap=256)
+        self.generator = generator
+
+    def _path(self, name: str) -> Path:
+        return self.base_dir / name.format(lang=self.language)
+
+    @staticmethod
+    def _load_json(path: Path) -> Any:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _save_json(path: Path, data: Any):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    def load_manifest(self, parsed: Dict, chunked: Dict, raw_metadata: Dict) -> Dict[str, Any]:
+        """Манифест хэшей; без файла - по текущей базе (неизмененные файлы получают хэш)."""
+        manifest_file = self._path("update_manifest_{lang}.json")
+        if manifest_file.exists():
+            manifest = self._load_json(manifest_file)
+            if manifest.get('version') == MANIFEST_VERSION:
+                return manifest
+            print(f"WARNING: {manifest_file} has another version. Rebuilding manifest from the current database.")
+
+        print(f"Creating manifest from the current database ({self.language})...")
+        structure = raw_metadata.get('structure', {})
+        files = {}
+        for book, book_files in parsed.items():
+            for file_path, text in book_files.items():
+                chunks = self.splitter.split_text(text)
+                indexed = structure.get(book, {}).get(file_path, {})
+                current = (
+                    chunks == chunked.get(book, {}).get(file_path, [])
+                    and indexed.get('num_chunks', 0) == len(chunks)
+                )
+                files.setdefault(book, {})[file_path] = content_hash(text) if current else None
+        return {
+            'version': MANIFEST_VERSION,
+            'chunk_size': self.splitter.chunk_size,
+            'overlap': self.splitter.overlap,
+            'files': files
+        }
+
+    @staticmethod
+    def diff(parsed: Dict, manifest: Dict[str, Any]) -> Tuple[List[FileKey], List[FileKey]]:
+        """(новые или измененные файлы, удаленные файлы)"""
+        known = manifest.get('files', {})
+        changed = [
+            (book, file_path)
+            for book, book_files in parsed.items()
+            for file_path, text in book_files.items()
+            if known.get(book, {}).get(file_path) != content_hash(text)
+        ]
+        removed = [
+            (book, file_path)
+            for book, book_files in known.items()
+            for file_path in book_files
+            if file_path not in parsed.get(book, {})
+        ]
+        return changed, removed
+
+    def _embed(self, chunks: Dict[str, Dict[str, List[str]]]) -> Dict[FileKey, np.ndarray]:
+        """Эмбеддинги чанков по файлам; файлы с неполными эмбеддингами (ошибка API) пропускаются."""
+        if not chunks:
+            return {}
+        if self.generator is None:
+            try:
+                from rag.embeddings_generator import EmbeddingsGenerator
+            except ImportError:
+                from embeddings_generator import EmbeddingsGenerator
+            self.generator = EmbeddingsGenerator()
+
+        embeddings_data = self.generator.generate_embeddings(chunks, language=self.language, batch_size=100)
+        vectors = {}
+        for book, book_files in chunks.items():
+            for file_path, file_chunks in book_files.items():
+                items = embeddings_data['books'].get(book, {}).get(file_path, [])
+                if len(items) != len(file_chunks):
+                    print(f"WARNING: {book}/{file_path}: {len(items)} of {len(file_chunks)} embeddings. Skipping file.")
+                    continue
+                items = sorted(items, key=lambda item: item['chunk_idx'])
+                vectors[(book, file_path)] = np.array([item['embedding'] for item in items], dtype='float32')
+        return vectors
+
+    @staticmethod
+    def _update_faiss(index: faiss.Index, remove_ids: List[int], add_ids: List[int], vectors: np.ndarray) -> faiss.Index:
+        """Удаляет и добавляет векторы с постоянными id строк."""
+        appending = not remove_ids and (not add_ids or add_ids[0] == index.ntotal)
+        id_mapped = isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) or faiss.try_extract_index_ivf(index) is not None
+
+        if not appending and not id_mapped:
+            if hasattr(index, 'hnsw'):
+                raise ValueError("HNSW индекс не поддерживает удаление векторов: нужна полная пересборка")
+            # Flat/SQ: переносим векторы в IndexIDMap2 с id = номер строки
+            existing = index.reconstruct_n(0, index.ntotal)
+            base = faiss.clone_index(index)
+            base.reset()
+            index = faiss.IndexIDMap2(base)
+            index.add_with_ids(existing, np.arange(len(existing), dtype='int64'))
+            id_mapped = True
+
+        if remove_ids:
+            index.remove_ids(np.array(remove_ids, dtype='int64'))
+        if add_ids:
+            # Векторы хранятся нормализованными, как в FAISSIndexer.build_index
+            faiss.normalize_L2(vectors)
+            if id_mapped:
+                index.add_with_ids(vectors, np.array(add_ids, dtype='int64'))
+            else:
+                index.add(vectors)
+        return index
+
+    def _update_embeddings_file(self, removed: List[FileKey], added: Dict[FileKey, Tuple[str, np.ndarray, List[str]]]):
+        """Синхронизирует embeddings_{lang}.npz и его метаданные (для последующей полной сборки индекса)."""
+        npz_file = self._path("embeddings_{lang}.npz")
+        metadata_file = self._path("embeddings_metadata_{lang}.json")
+        if not npz_file.exists() or not metadata_file.exists():
+            return
+
+        metadata = self._load_json(metadata_file)
+        with np.load(npz_file) as npz_data:
+            arrays = {key: npz_data[key] for key in npz_data.files}
+        structure = metadata.setdefault('structure', {})
+        for book, file_path in removed + list(added):
+            entry = structure.get(book, {}).pop(file_path, None)
+            if entry:
+                arrays.pop(entry.get('embedding_key'), None)
+        for (book, file_path), (key, vectors, previews) in added.items():
+            arrays[key] = vectors
+            structure.setdefault(book, {})[file_path] = {
+                'embedding_key': key, 'num_chunks': len(vectors), 'text_previews': previews
+            }
+        np.savez_compressed(npz_file, **arrays)
+        self._save_json(metadata_file, metadata)
+
+    def _update_bm25(self, old_fingerprint: Optional[str], documents: Dict[int, List[str]], removed_ids: List[int], num_docs: int, new_fingerprint: str) -> bool:
+        """Обновляет постинги BM25; если индекс устарел - удаляет его (движок построит заново)."""
+        bm25_file = self._path("bm25_index_{lang}.bin")
+        if not bm25_file.exists():
+            return False
+        tokenizer = tokenizer_signature(self.language)
+        bm25 = SparseBM25.load(bm25_file, tokenizer, old_fingerprint) if old_fingerprint else None
+        if bm25 is None:
+            print(f"WARNING: {bm25_file} is stale. Removing it; the engine will rebuild BM25 on load.")
+            bm25_file.unlink()
+            return False
+        tokens = {doc_id: tokenize(text, self.language) for doc_id, text in documents.items()}
+        updated = bm25.with_documents(tokens, removed_ids, num_docs)
+        del bm25
+        updated.save(bm25_file, tokenizer, new_fingerprint)
+        return True
+
+    def run(self) -> Optional[Dict[str, Any]]:
+        """Выполняет обновление; None, если базы для инкрементального обновления нет."""
+        parsed_file = self._path("parsed_scriptures_{lang}.json")
+        chunked_file = self._path("chunked_scriptures_{lang}.json")
+        index_file = self._path("faiss_index_{lang}.bin")
+        metadata_file = self._path("faiss_metadata_{lang}.json")
+        texts_file = self._path("chunk_texts_{lang}.bin")
+        meta_file = self._path("chunk_meta_{lang}.bin")
+        for required in (parsed_file, chunked_file, index_file, metadata_file):
+            if not required.exists():
+                print(f"WARNING: {required} not found. Run the full update for '{self.language}'.")
+                return None
+
+        start_time = time.time()
+        parsed = self._load_json(parsed_file)
+        chunked = self._load_json(chunked_file)
+        raw_metadata = self._load_json(metadata_file)
+        manifest = self.load_manifest(parsed, chunked, raw_metadata)
+        if (manifest.get('chunk_size'), manifest.get('overlap')) != (self.splitter.chunk_size, self.splitter.overlap):
+            print("ERROR: Chunking parameters differ from the manifest. Run the full update.")
+            return None
+
+        changed, removed = self.diff(parsed, manifest)
+        stats = {'language': self.language, 'changed_files': 0, 'removed_files': 0, 'embedded_chunks': 0, 'skipped_files': 0}
+        if not changed and not removed:
+            print(f"Database for '{self.language}' is up to date.")
+            self._save_json(self._path("update_manifest_{lang}.json"), manifest)
+            return stats
+        print(f"Files to update: {len(changed)} new/changed, {len(removed)} removed")
+
+        # 1. Чанки и эмбеддинги только для новых/измененных файлов
+        new_chunks: Dict[str, Dict[str, List[str]]] = {}
+        for book, file_path in changed:
+            chunks = self.splitter.split_text(parsed[book][file_path])
+            if chunks:
+                new_chunks.setdefault(book, {})[file_path] = chunks
+        vectors = self._embed(new_chunks)
+        emptied = [key for key in changed if key[1] not in new_chunks.get(key[0], {})]
+        skipped = [key for key in changed if key not in vectors and key not in emptied]
+
+        # Отпечаток корпуса до изменений (для проверки индекса BM25)
+        old_fingerprint = None
+        if texts_file.exists() and meta_file.exists():
+            opened = open_chunk_store(texts_file, meta_file, texts_source=chunked_file, meta_source=metadata_file)
+            if opened is not None:
+                old_fingerprint = opened[0].fingerprint()
+            del opened
+
+        # 2. id строк FAISS: старые чанки удаляются, новые получают id после максимального
+        ids_by_file = chunk_ids(raw_metadata)
+        next_id = max((i + 1 for ids in ids_by_file.values() for i in ids), default=0)
+        replaced = [key for key in list(vectors) + emptied + removed if key in ids_by_file]
+        remove_ids = sorted(i for key in replaced for i in ids_by_file[key])
+
+        structure = raw_metadata.setdefault('structure', {})
+        for (book, file_path), ids in ids_by_file.items():
+            structure[book][file_path]['ids'] = ids
+        for book, file_path in replaced:
+            structure[book].pop(file_path, None)
+            if not structure[book]:
+                structure.pop(book)
+
+        next_key = 1 + max(
+            (_embedding_key_number(data.get('embedding_key', '')) for book_files in structure.values() for data in book_files.values()),
+            default=-1
+        )
+        add_ids, add_vectors, documents, added = [], [], {}, {}
+        for book, file_path in sorted(vectors):
+            file_chunks = new_chunks[book][file_path]
+            ids = list(range(next_id, next_id + len(file_chunks)))
+            next_id += len(file_chunks)
+            key = f"embeddings_{next_key}"
+            next_key += 1
+            previews = [chunk[:100] for chunk in file_chunks]
+            structure.setdefault(book, {})[file_path] = {
+                'embedding_key': key, 'num_chunks': len(file_chunks), 'text_previews': previews, 'ids': ids
+            }
+            add_ids.extend(ids)
+            add_vectors.append(vectors[(book, file_path)])
+            documents.update(zip(ids, file_chunks))
+            added[(book, file_path)] = (key, vectors[(book, file_path)].copy(), previews)
+
+        # 3. FAISS
+        index = faiss.read_index(str(index_file))
+        matrix = np.vstack(add_vectors) if add_vectors else np.empty((0, index.d), dtype='float32')
+        index = self._update_faiss(index, remove_ids, add_ids, matrix)
+        faiss.write_index(index, str(index_file))
+        raw_metadata['total_embeddings'] = int(index.ntotal)
+        self._save_json(metadata_file, raw_metadata)
+
+        # 4. Чанки (JSON и бинарные хранилища)
+        for book, file_path in replaced:
+            chunked.get(book, {}).pop(file_path, None)
+            if book in chunked and not chunked[book]:
+                chunked.pop(book)
+        for (book, file_path) in added:
+            chunked.setdefault(book, {})[file_path] = new_chunks[book][file_path]
+        self._save_json(chunked_file, chunked)
+        flat_metadata = flatten_faiss_metadata(raw_metadata)
+        write_chunk_texts_from_chunked(texts_file, chunked, chunked_file)
+        write_chunk_meta_for_texts(meta_file, texts_file, flat_metadata, metadata_file)
+        store, _ = open_chunk_store(texts_file, meta_file, texts_source=chunked_file, meta_source=metadata_file)
+
+        # 5. BM25, эмбеддинги для полной сборки, производные индексы
+        self._update_bm25(old_fingerprint, documents, remove_ids, len(flat_metadata), store.fingerprint())
+        del store
+        self._update_embeddings_file(removed + emptied, added)
+        for name in ("phrase_index_{lang}.bin", "verse_index_{lang}.bin"):
+            derived = self._path(name)
+            if derived.exists():
+                derived.unlink()
+
+        # 6. Манифест: пропущенные файлы (ошибка API) будут обработаны при следующем запуске
+        files = manifest.setdefault('files', {})
+        for book, file_path in removed:
+            files.get(book, {}).pop(file_path, None)
+        for book, file_path in changed:
+            if (book, file_path) not in skipped:
+                files.setdefault(book, {})[file_path] = content_hash(parsed[book][file_path])
+        manifest['files'] = {book: book_files for book, book_files in files.items() if book_files}
+        self._save_json(self._path("update_manifest_{lang}.json"), manifest)
+
+        stats.update(
+            changed_files=len(added) + len(emptied), removed_files=len(removed),
+            embedded_chunks=len(add_ids), skipped_files=len(skipped),
+            total_embeddings=int(index.ntotal), elapsed_seconds=round(time.time() - start_time, 1)
+        )
+        return stats
+
+
+def update_all_languages(languages: List[str] = None, base_dir: Path = Path("rag")) -> Dict[str, Any]:
+    """Инкрементальное обновление для нескольких языков."""
+    all_stats = {}
+    for lang in languages or ['ru', 'en']:
+        print(f"\nSTAGE: {lang.upper()} SCRIPTURES")
+        print("-" * 70)
+        stats = IncrementalUpdater(lang, base_dir).run()
+        if stats:
+            all_stats[lang] = stats
+            print(f"   Changed files: {stats['changed_files']}, removed: {stats['removed_files']}, "
+                  f"embedded chunks: {stats['embedded_chunks']}, skipped: {stats['skipped_files']}")
+    return all_stats
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🔤 ТРИГРАММНЫЙ ИНДЕКС ДЛЯ ПОИСКА ТОЧНЫХ ФРАЗ
+
+Инвертированный индекс символьных триграмм поверх текстов чанков
+в нижнем регистре. Используется RAGEngine для поиска точной подстроки:
+вместо сканирования всего корпуса проверяются только чанки, в которых
+встречаются все триграммы запроса.
+
+Формат хранения (phrase_index_{lang}.bin, открывается через mmap):
+    grams    - отсортированные коды триграмм (uint64)
+    offsets  - границы списков в postings для каждой триграммы (int64)
+    postings - id чанков (строки FAISS), отсортированные внутри списка (int32)
+В заголовке - число документов и отпечаток корпуса.
+"""
+
+import numpy as np
+from pathlib import Path
+from typing import Iterable, Optional
+import logging
+
+try:
+    from rag.array_file import write_array_file, open_array_file
+except ImportError:
+    from array_file import write_array_file, open_array_file
+
+logger = logging.getLogger(__name__)
+
+
+class PhraseIndex:
+    """Инвертированный индекс триграмм для поиска подстрок"""
+
+    FORMAT_VERSION = 2
+    GRAM_SIZE = 3
+
+    def __init__(self, grams: np.ndarray, offsets: np.ndarray, postings: np.ndarray, num_docs: int, corpus: str = ''):
+        self.grams = grams
+        self.offsets = offsets
+        self.postings = postings
+        self.num_docs = int(num_docs)
+        self.corpus = corpus
+
+    @staticmethod
+    def _encode(text: str) -> np.ndarray:
+        """Кодирует все триграммы строки в uint64 (3 кодпоинта по 21 биту)."""
+        codepoints = np.frombuffer(text.encode('utf-32-le', errors='surrogatepass'), dtype=np.uint32)
+        if len(codepoints) < PhraseIndex.GRAM_SIZE:
+            return np.empty(0, dtype=np.uint64)
+        cp = codepoints.astype(np.uint64)
+        return (cp[:-2] << np.uint64(42)) | (cp[1:-1] << np.uint64(21)) | cp[2:]
+
+    @classmethod
+    def build(cls, lower_texts: Iterable[str], corpus: str = '') -> 'PhraseIndex':
+        """
+        Строит индекс по текстам в нижнем регистре.
+
+        Args:
+            lower_texts: тексты чанков в порядке id (строк FAISS)
+            corpus: отпечаток корпуса (сохраняется в заголовке)
+        """
+        code_parts = []
+        doc_parts = []
+        num_docs = 0
+
+        for doc_id, text in enumerate(lower_texts):
+            codes = np.unique(cls._encode(text or ''))
+            if len(codes):
+                code_parts.append(codes)
+                doc_parts.append(np.full(len(codes), doc_id, dtype=np.int32))
+            num_docs += 1
+
+        if not code_parts:
+            empty_codes = np.empty(0, dtype=np.uint64)
+            return cls(empty_codes, np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int32), num_docs, corpus)
+
+        codes = np.concatenate(code_parts)
+        docs = np.concatenate(doc_parts)
+        del code_parts, doc_parts
+
+        # Стабильная сортировка сохраняет возрастающий порядок id внутри каждого списка
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        docs = docs[order]
+        del order
+
+        grams, starts = np.unique(codes, return_index=True)
+        offsets = np.append(starts, len(codes)).astype(np.int64)
+        return cls(grams, offsets, docs, num_docs, corpus)
+
+    def candidates(self, lower_query: str) -> Optional[np.ndarray]:
+        """
+        Возвращает отсортированные id чанков, содержащих все триграммы запроса.
+
+        Returns:
+            None, если запрос короче триграммы (нужно полное сканирование)
+        """
+        codes = np.unique(self._encode(lower_query))
+        if not len(codes):
+            return None
+
+        positions = np.searchsorted(self.grams, codes)
+        lists = []
+        for code, pos in zip(codes, positions):
+            if pos >= len(self.grams) or self.grams[pos] != code:
+                return np.empty(0, dtype=np.int32)
+            lists.append(self.postings[self.offsets[pos]:self.offsets[pos + 1]])
+
+        # Пересекаем начиная с самых коротких списков
+        lists.sort(key=len)
+        result = lists[0]
+        for other in lists[1:]:
+            result = np.intersect1d(result, other, assume_unique=True)
+            if not len(result):
+                break
+        return result
+
+    def save(self, path: Path):
+        write_array_file(
+            path,
+            {'kind': 'phrase_index', 'version': self.FORMAT_VERSION, 'num_docs': self.num_docs, 'corpus': self.corpus},
+            {'grams': self.grams, 'offsets': self.offsets, 'postings': self.postings}
+        )
+
+    @classmethod
+    def load(cls, path: Path, corpus: str) -> Optional['PhraseIndex']:
+        """Открывает индекс через mmap; None, если другая версия формата или другой корпус."""
+        header, arrays = open_array_file(path)
+        if header.get('kind') != 'phrase_index' or header.get('version') != cls.FORMAT_VERSION:
+            return None
+        if header.get('corpus') != corpus:
+            return None
+        return cls(arrays['grams'], arrays['offsets'], arrays['postings'], header['num_docs'], corpus)
@@ -22,6 +22,7 @@ import zipfile
 import requests
 import threading
 import time
+import functools
 from pathlib import Path
 
 # --- Настройка логгирования (СРАЗУ) ---
@@ -38,7 +39,8 @@ try:
     else:
         base_path = os.path.dirname(os.path.abspath(__file__))
 
-    log_dir = os.path.join(base_path, "logs")
+    # SHUKABASE_LOG_DIR - другая папка логов (например, временная в тестах)
+    log_dir = os.environ.get("SHUKABASE_LOG_DIR") or os.path.join(base_path, "logs")
     os.makedirs(log_dir, exist_ok=True)
     
     log_file = os.path.join(log_dir, "rag_api_server.log")
@@ -86,6 +88,11 @@ except Exception as e:
     # Пытаемся продолжить чтобы сервер запустился и отдал лог, но без движка
     RAGEngine = None 
 
+try:
+    from rag.cache_utils import SearchResultCache
+except ImportError:
+    from cache_utils import SearchResultCache
+
 # --- Константы ---
 
 # ID архива данных
@@ -95,11 +102,141 @@ DATA_VERSION = 6 # Increment this to force re-download on client updates
 DATA_DIR = os.path.join(base_path, "rag_data") if getattr(sys, 'frozen', False) else base_path
 CHAT_HISTORY_DIR = os.path.join(base_path, "chat_history")
 
+# Кэш результатов поиска (0 записей - кэш выключен)
+SEARCH_CACHE_SIZE = int(os.environ.get("SHUKABASE_SEARCH_CACHE_SIZE", "1024"))
+SEARCH_CACHE_TTL = float(os.environ.get("SHUKABASE_SEARCH_CACHE_TTL", "600"))
+
+# Файлы, изменение которых сбрасывает кэш результатов поиска
+DATA_SIGNATURE_PREFIXES = (
+    "data_version.txt", "faiss_index_", "faiss_metadata_", "chunked_scriptures_",
+    "bm25_index_", "phrase_index_", "verse_index_", "chunk_texts_", "chunk_meta_"
+)
+
+# Режим сервера: waitress (production, по умолчанию) или flask (dev-сервер)
+SERVER_HOST = os.environ.get("SHUKABASE_HOST", "0.0.0.0")
+SERVER_PORT = int(os.environ.get("SHUKABASE_PORT", "5000"))
+SERVER_MODE = os.environ.get("SHUKABASE_SERVER", "waitress")
+SERVER_THREADS = int(os.environ.get("SHUKABASE_SERVER_THREADS", "8"))
+
+# Ограничение нагрузки: одновременные поиски и очередь ожидающих (сверх - 503)
+MAX_CONCURRENT_SEARCHES = int(os.environ.get("SHUKABASE_MAX_CONCURRENT_SEARCHES", "4"))
+SEARCH_QUEUE_SIZE = int(os.environ.get("SHUKABASE_SEARCH_QUEUE_SIZE", "16"))
+SEARCH_QUEUE_TIMEOUT = float(os.environ.get("SHUKABASE_SEARCH_QUEUE_TIMEOUT", "30"))
+
+# Данные языка загружаются при первом поиске на нем; 0 - без ограничения памяти
+LAZY_LOADING = os.environ.get("SHUKABASE_LAZY_LOADING", "1") != "0"
+MEMORY_BUDGET_MB = float(os.environ.get("SHUKABASE_MEMORY_BUDGET_MB", "0"))
+
+# Языки, которые загружаются при старте ('all' - все); остальные - при первом запросе
+_warmup_languages = os.environ.get("SHUKABASE_WARMUP_LANGUAGES", "ru")
+WARMUP_LANGUAGES = None if _warmup_languages == "all" else [l.strip() for l in _warmup_languages.split(",") if l.strip()]
+
+# Максимум запросов в /api/search/batch
+MAX_BATCH_QUERIES = int(os.environ.get("SHUKABASE_MAX_BATCH_QUERIES", "100"))
+
+# Необязательные параметры RAGEngine.search, которые можно передать в /api/search
+SEARCH_FLAGS = ('use_reranking', 'expand_query', 'vector_distance_threshold')
+
 # --- Глобальные переменные ---
 app = Flask(__name__)
 CORS(app)
 rag_engine_instance = None
 init_lock = threading.Lock()
+warmup_lock = threading.Lock()
+
+# Состояние прогрева движка (компоненты - в RAGEngine.readiness())
+warmup_state = {
+    "status": "idle", # idle, warming, ready, error
+    "error": None,
+    "elapsed_ms": None
+}
+
+
+def data_signature():
+    """Подпись версии данных: имена, mtime и размеры файлов индексов в DATA_DIR."""
+    if not os.path.exists(DATA_DIR):
+        return None
+    signature = []
+    for entry in sorted(os.scandir(DATA_DIR), key=lambda e: e.name):
+        if entry.is_file() and entry.name.startswith(DATA_SIGNATURE_PREFIXES):
+            stat = entry.stat()
+            signature.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+class SearchAdmission:
+    """
+    Контроль нагрузки на поиск: не более max_active одновременных запросов и
+    max_queued ожидающих. Если очередь полна или ожидание дольше timeout,
+    запрос отклоняется (back-pressure) вместо бесконечного накопления.
+    """
+
+    def __init__(self, max_active: int, max_queued: int, timeout: float):
+        self.max_active = max(1, max_active)
+        self.max_queued = max(0, max_queued)
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+
+    def acquire(self) -> bool:
+        with self._cond:
+            if self.active >= self.max_active:
+                if self.queued >= self.max_queued:
+                    self.rejected += 1
+                    return False
+                self.queued += 1
+                try:
+                    admitted = self._cond.wait_for(lambda: self.active < self.max_active, self.timeout)
+                finally:
+                    self.queued -= 1
+                if not admitted:
+                    self.rejected += 1
+                    return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def stats(self):
+        return {
+            'active': self.active,
+            'queued': self.queued,
+            'rejected': self.rejected,
+            'max_active': self.max_active,
+            'max_queued': self.max_queued
+        }
+
+
+search_admission = SearchAdmission(MAX_CONCURRENT_SEARCHES, SEARCH_QUEUE_SIZE, SEARCH_QUEUE_TIMEOUT)
+
+
+def limit_search_load(view):
+    """Декоратор: пропускает запрос через search_admission, при перегрузке отвечает 503."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        admission = search_admission
+        if not admission.acquire():
+            logger.warning("⚠️ Поиск перегружен - запрос отклонен (503)")
+            response = jsonify({'success': False, 'error': 'Server is busy, please retry later.'})
+            response.headers['Retry-After'] = '1'
+            return response, 503
+        try:
+            return view(*args, **kwargs)
+        finally:
+            admission.release()
+    return wrapper
+
+
+search_cache = SearchResultCache(
+    max_items=SEARCH_CACHE_SIZE,
+    ttl_seconds=SEARCH_CACHE_TTL,
+    version_fn=data_signature
+)
 
 # Состояние процесса установки
 setup_state = {
@@ -119,8 +256,19 @@ DATA_URLS = {
     'en': "https://github.com/amritagopi/shukabase-install-data/releases/download/data-v2/shukabase_data_en.zip"
 }
 
+def has_index_files():
+    """Есть ли в DATA_DIR хотя бы один индекс FAISS (иначе движок не загрузить)."""
+    return os.path.exists(DATA_DIR) and any(f.startswith("faiss_index_") for f in os.listdir(DATA_DIR))
+
 def initialize_engine():
-    """Initializes the RAG engine if data exists."""
+    """
+    Initializes the RAG engine if data exists.
+
+    Движок публикуется сразу после создания (без модели re-ranking), затем
+    прогревается поэтапно: FAISS и метаданные языков прогрева, индексы BM25,
+    фраз и стихов, модель re-ranking. Поиск отвечает уже после первого этапа,
+    ответы без недостающих компонентов помечаются полем 'degraded'.
+    """
     global rag_engine_instance
     
     with init_lock:
@@ -129,30 +277,73 @@ def initialize_engine():
 
         if not os.path.exists(DATA_DIR):
             logger.info(f"Data directory not found at {DATA_DIR}. Engine will not be initialized.")
+            warmup_state["status"] = "idle"
             return False
 
         # Check for essential files before trying to load (avoid crash in constructor)
         # We need at least one index file to consider it loadable
-        has_index = any(f.startswith("faiss_index_") for f in os.listdir(DATA_DIR))
-        if not has_index:
+        if not has_index_files():
              logger.info("No index files found in data directory. Waiting for download.")
+             warmup_state["status"] = "idle"
              return False
 
+        warmup_state.update({"status": "warming", "error": None, "elapsed_ms": None})
+        warmup_start = time.perf_counter()
         try:
             logger.info(f"Initializing RAGEngine from {DATA_DIR}...")
             
             if RAGEngine is None:
                 logger.critical("Cannot initialize engine: RAGEngine class is missing (import failed).")
+                warmup_state.update({"status": "error", "error": "RAGEngine import failed"})
                 return False
                 
             # Initialize with our data directory
-            rag_engine_instance = RAGEngine(base_dir=DATA_DIR)
-            
-            logger.info("✅ RAGEngine initialized successfully!")
-            return True
+            engine = RAGEngine(
+                base_dir=DATA_DIR,
+                lazy_loading=LAZY_LOADING,
+                memory_budget_mb=MEMORY_BUDGET_MB or None,
+                load_reranker=False
+            )
+            rag_engine_instance = engine
         except Exception as e:
             logger.error(f"❌ Failed to initialize RAGEngine: {e}", exc_info=True)
+            warmup_state.update({"status": "error", "error": str(e)})
+            return False
+
+    # Прогрев вне init_lock: поиск уже обслуживается по мере готовности компонентов
+    try:
+        engine.warm_up(WARMUP_LANGUAGES)
+        warmup_state["status"] = "ready"
+        logger.info("✅ RAGEngine initialized successfully!")
+    except Exception as e:
+        logger.error(f"❌ RAGEngine warm-up failed: {e}", exc_info=True)
+        warmup_state.update({"status": "error", "error": str(e)})
+    warmup_state["elapsed_ms"] = round((time.perf_counter() - warmup_start) * 1000, 2)
+    return True
+
+def start_engine_warmup():
+    """Запускает загрузку движка в фоне. True - загрузка идет (или уже шла)."""
+    with warmup_lock:
+        if warmup_state["status"] == "warming" and rag_engine_instance is None:
+            return True
+        if RAGEngine is None or not has_index_files():
             return False
+        warmup_state["status"] = "warming"
+        threading.Thread(target=initialize_engine, daemon=True).start()
+        return True
+
+def engine_unavailable():
+    """Ответ 503, пока движка нет. Не ждет загрузку, а запускает ее в фоне."""
+    warming = start_engine_warmup()
+    if warming:
+        response = jsonify({
+            'success': False,
+            'error': 'Knowledge base is loading, please retry shortly.',
+            'warming_up': True
+        })
+        response.headers['Retry-After'] = '2'
+        return response, 503
+    return jsonify({'success': False, 'error': 'Knowledge base not loaded. Please complete setup.'}), 503
 
 def download_file_direct(url, destination):
     session = requests.Session()
@@ -321,12 +512,19 @@ def start_download():
     
     return jsonify({"success": True, "message": "Download started"})
 
+def cacheable(response) -> bool:
+    """
+    Можно ли кэшировать ответ поиска: ошибки и ответы без части компонентов
+    (прогрев движка, ошибка API эмбеддингов - поле 'degraded') не кэшируем.
+    """
+    return bool(response.get('success')) and not response.get('degraded')
+
 @app.route('/api/search', methods=['POST'])
+@limit_search_load
 def search():
     if rag_engine_instance is None:
-        # Пытаемся инициализировать, если вдруг файлы появились
-        if not initialize_engine():
-            return jsonify({'success': False, 'error': 'Knowledge base not loaded. Please complete setup.'}), 503
+        # Запускаем загрузку в фоне, если вдруг файлы появились
+        return engine_unavailable()
 
     try:
         data = request.json
@@ -334,25 +532,171 @@ def search():
         language = data.get('language', 'ru')
         top_k = int(data.get('top_k', 10))
         
+        flags = {name: data[name] for name in SEARCH_FLAGS if data.get(name) is not None}
+        
         if not query:
             return jsonify({'success': False, 'error': 'Empty query'}), 400
 
-        search_results = rag_engine_instance.search(
-            query=query,
-            language=language,
-            top_k=top_k,
-            api_key=data.get('api_key') # Pass API key from request
-        )
+        cache_key = search_cache.make_key(query, language, top_k, flags)
+        search_results = search_cache.get(cache_key)
+        if search_results is None:
+            search_results = rag_engine_instance.search(
+                query=query,
+                language=language,
+                top_k=top_k,
+                api_key=data.get('api_key'), # Pass API key from request
+                **flags
+            )
+            if cacheable(search_results):
+                search_cache.put(cache_key, search_results)
         return jsonify(search_results), 200
     except Exception as e:
         logger.error(f"Search error: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/search/stream', methods=['POST'])
+def search_stream():
+    """
+    Потоковый поиск (NDJSON, одна JSON-строка на стадию): сначала точные
+    стихи или результаты BM25/фраз, затем список после RRF, затем финальный
+    порядок после re-ranking (stage='final', формат как у /api/search).
+    """
+    if rag_engine_instance is None:
+        return engine_unavailable()
+
+    data = request.json or {}
+    query = data.get('query', '').strip()
+    language = data.get('language', 'ru')
+    top_k = int(data.get('top_k', 10))
+    flags = {name: data[name] for name in SEARCH_FLAGS if data.get(name) is not None}
+    if not query:
+        return jsonify({'success': False, 'error': 'Empty query'}), 400
+
+    cache_key = search_cache.make_key(query, language, top_k, flags)
+    cached = search_cache.get(cache_key)
+    engine = rag_engine_instance
+    # Слот занят, пока идет поток (освобождается при закрытии ответа, в т.ч. при обрыве)
+    admission = search_admission
+    if cached is None and not admission.acquire():
+        response = jsonify({'success': False, 'error': 'Server is busy, please retry later.'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    def generate():
+        if cached is not None:
+            yield json.dumps(dict(cached, stage='final'), ensure_ascii=False) + "\n"
+            return
+        try:
+            for stage in engine.search_stream(
+                query=query,
+                language=language,
+                top_k=top_k,
+                api_key=data.get('api_key'),
+                **flags
+            ):
+                if stage['stage'] == 'final' and cacheable(stage):
+                    search_cache.put(cache_key, {k: v for k, v in stage.items() if k != 'stage'})
+                yield json.dumps(stage, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error(f"Stream search error: {e}", exc_info=True)
+            yield json.dumps({'stage': 'final', 'success': False, 'error': str(e)}, ensure_ascii=False) + "\n"
+
+    response = flask.Response(
+        flask.stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    if cached is None:
+        response.call_on_close(admission.release)
+    return response
+
+@app.route('/api/search/batch', methods=['POST'])
+@limit_search_load
+def search_batch():
+    """
+    Пакетный поиск: {"queries": [...], "language", "top_k", флаги поиска}.
+    Ответы - в порядке запросов; закэшированные запросы не пересчитываются.
+    """
+    if rag_engine_instance is None:
+        return engine_unavailable()
+
+    try:
+        data = request.json
+        queries = data.get('queries')
+        language = data.get('language', 'ru')
+        top_k = int(data.get('top_k', 10))
+        flags = {name: data[name] for name in SEARCH_FLAGS if data.get(name) is not None}
+
+        if not isinstance(queries, list) or not queries:
+            return jsonify({'success': False, 'error': 'Field "queries" must be a non-empty list'}), 400
+        if len(queries) > MAX_BATCH_QUERIES:
+            return jsonify({'success': False, 'error': f'Too many queries (max {MAX_BATCH_QUERIES})'}), 400
+        queries = [str(q).strip() for q in queries]
+        if not all(queries):
+            return jsonify({'success': False, 'error': 'Empty query'}), 400
+
+        cache_keys = [search_cache.make_key(q, language, top_k, flags) for q in queries]
+        responses = [search_cache.get(key) for key in cache_keys]
+        missing = [i for i, r in enumerate(responses) if r is None]
+
+        timings = {}
+        if missing:
+            batch = rag_engine_instance.search_batch(
+                queries=[queries[i] for i in missing],
+                language=language,
+                top_k=top_k,
+                api_key=data.get('api_key'),
+                **flags
+            )
+            if not batch.get('success'):
+                return jsonify(batch), 200
+            timings = batch.get('timings', {})
+            for i, response in zip(missing, batch['responses']):
+                responses[i] = response
+                # Ошибки отдельных запросов и ответы неполного пакета не кэшируем
+                if cacheable(response) and not batch.get('degraded'):
+                    search_cache.put(cache_keys[i], response)
+
+        return jsonify({
+            'success': True,
+            'responses': responses,
+            'count': len(responses),
+            'cached': len(queries) - len(missing),
+            'timings': timings
+        }), 200
+    except Exception as e:
+        logger.error(f"Batch search error: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Статистика кэшей: результаты поиска, эмбеддинги, оценки re-ranking"""
+    stats = {'search': search_cache.stats()}
+    engine = rag_engine_instance
+    if engine is not None:
+        if getattr(engine, 'embedding_cache', None) is not None:
+            stats['embeddings'] = engine.embedding_cache.stats()
+        if getattr(engine, 'rerank_cache', None) is not None:
+            stats['rerank'] = engine.rerank_cache.stats()
+    return jsonify(stats), 200
+
+@app.route('/api/cache/clear', methods=['POST'])
+def clear_search_cache():
+    search_cache.clear()
+    return jsonify({'success': True})
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
+    engine = rag_engine_instance
+    readiness = engine.readiness() if engine is not None else None
     return jsonify({
         'status': 'healthy',
-        'engine_initialized': rag_engine_instance is not None
+        'engine_initialized': engine is not None,
+        'ready': bool(readiness and readiness['search_ready']),
+        'warmup': dict(warmup_state),
+        'components': readiness,
+        'languages': engine.language_stats() if engine is not None else None,
+        'load': search_admission.stats()
     }), 200
 
 # --- Остальные эндпоинты (conversations) без изменений ---
@@ -444,23 +788,59 @@ def reset_app_data():
             "error": None,
             "current_file": ""
         }
-        rag_engine_instance = None # Drop engine ref
+        # mmap индексов и SQLite кэша держат файлы открытыми (на Windows их нельзя удалить)
+        engine, rag_engine_instance = rag_engine_instance, None
+        warmup_state.update({"status": "idle", "error": None, "elapsed_ms": None})
+        search_cache.clear()
+        if engine is not None:
+            engine.close()
+        del engine
         
         # 2. Delete DATA_DIR
         if os.path.exists(DATA_DIR):
             logger.info(f"Removing DATA_DIR: {DATA_DIR}")
-            shutil.rmtree(DATA_DIR, ignore_errors=True)
+            shutil.rmtree(DATA_DIR)
             
         # 3. Delete CHAT_HISTORY_DIR
         if os.path.exists(CHAT_HISTORY_DIR):
             logger.info(f"Removing CHAT_HISTORY_DIR: {CHAT_HISTORY_DIR}")
-            shutil.rmtree(CHAT_HISTORY_DIR, ignore_errors=True)
+            shutil.rmtree(CHAT_HISTORY_DIR)
             
         return jsonify({'success': True, 'message': 'App data reset successfully. Please restart.'})
     except Exception as e:
         logger.error(f"Reset failed: {e}")
         return jsonify({'error': str(e)}), 500
 
+def run_server():
+    """
+    Запускает HTTP сервер.
+
+    waitress - многопоточный production сервер (работает и на Windows), все
+    потоки используют один экземпляр движка. На POSIX для нескольких
+    процессов используйте gunicorn с rag/gunicorn_conf.py (загрузка движка
+    до fork). SHUKABASE_SERVER=flask - dev-сервер Flask.
+    """
+    if SERVER_MODE == "waitress":
+        try:
+            from waitress import serve
+        except ImportError:
+            logger.warning("⚠️ waitress не установлен - использую dev-сервер Flask (pip install waitress)")
+        else:
+            logger.info(f"🌐 waitress: {SERVER_HOST}:{SERVER_PORT}, потоков: {SERVER_THREADS}")
+            serve(
+                app,
+                host=SERVER_HOST,
+                port=SERVER_PORT,
+                threads=SERVER_THREADS,
+                # Соединения сверх лимита ждут в backlog ОС, а не в памяти сервера
+                connection_limit=max(100, SERVER_THREADS * 4),
+                backlog=256,
+                channel_timeout=120
+            )
+            return
+
+    app.run(host=SERVER_HOST, port=SERVER_PORT, debug=False, threaded=True)
+
 if __name__ == '__main__':
     logger.info("="*80)
     logger.info(f"🚀 Shukabase AI Server Starting. Data dir: {DATA_DIR}")
@@ -485,7 +865,7 @@ if __name__ == '__main__':
         # Инициализируем в фоне, чтобы не задерживать старт сервера и сплэша
         threading.Thread(target=initialize_engine, daemon=True).start()
         
-        app.run(host='0.0.0.0', port=5000, debug=False)
+        run_server()
     except Exception as e:
         logger.critical(f"🔥 SERVER CRASHED: {e}", exc_info=True)
         # Также пишем в отдельный файл на случай если логгер умер
@@ -9,16 +9,20 @@
 5. Гибридный поиск (Vector + BM25 + Simple Keyword)
 """
 
+import asyncio
 import json
 import numpy as np
-import pickle
 from pathlib import Path
-from typing import List, Dict, Tuple, Any
+from typing import List, Dict, Tuple, Any, Iterator, Optional
 import logging
 import os
 import time
 import re
 import difflib
+import gc
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 
 # Управление зависимостями
 try:
@@ -27,12 +31,35 @@ try:
     import torch
     import google.generativeai as genai
     from dotenv import load_dotenv
-    from rank_bm25 import BM25Okapi
-    from nltk.stem import SnowballStemmer
+    import nltk
 except ImportError as e:
     raise ImportError(
         f"Отсутствует зависимость: {e}. "
-        "Установите необходимые пакеты: pip install faiss-cpu transformers torch google-generativeai python-dotenv rank_bm25 nltk"
+        "Установите необходимые пакеты: pip install faiss-cpu transformers torch google-generativeai python-dotenv nltk"
+    )
+
+# Локальные модули (импорт как пакета rag или из папки rag в sys.path)
+try:
+    from rag.array_file import close_array_files
+    from rag.phrase_index import PhraseIndex
+    from rag.verse_index import VerseIndex, normalize_chapter, verse_candidates
+    from rag.cache_utils import EmbeddingCache, LRUCache, normalize_query
+    from rag.bm25_sparse import SparseBM25
+    from rag.bm25_tokenizer import tokenize, tokenize_corpus, tokenizer_signature
+    from rag.chunk_store import (
+        ChunkTextStore, flatten_faiss_metadata, open_chunk_store, write_chunk_texts, write_chunk_meta,
+        META_BOOK, META_CHAPTER, META_CHUNK_IDX, NO_VALUE
+    )
+except ImportError:
+    from array_file import close_array_files
+    from phrase_index import PhraseIndex
+    from verse_index import VerseIndex, normalize_chapter, verse_candidates
+    from cache_utils import EmbeddingCache, LRUCache, normalize_query
+    from bm25_sparse import SparseBM25
+    from bm25_tokenizer import tokenize, tokenize_corpus, tokenizer_signature
+    from chunk_store import (
+        ChunkTextStore, flatten_faiss_metadata, open_chunk_store, write_chunk_texts, write_chunk_meta,
+        META_BOOK, META_CHAPTER, META_CHUNK_IDX, NO_VALUE
     )
 
 logger = logging.getLogger(__name__)
@@ -115,13 +142,29 @@ class QueryExpander:
 
 class RerankerModel:
     """Модель re-ranking для переоценки релевантности"""
+
+    MAX_LENGTH = 512               # Максимум токенов в паре [query, doc]
+    MICRO_BATCH_SIZE = 16          # Максимум пар в одном проходе модели
+    MICRO_BATCH_TOKENS = 4096      # Максимум (пар x длина с паддингом) в одном проходе
+    DOC_TOKEN_CACHE_SIZE = 4096    # Чанков с закэшированными токенами
     
-    def __init__(self, model_name: str = "jinaai/jina-reranker-v2-base-multilingual"):
+    def __init__(self, model_name: str = "jinaai/jina-reranker-v2-base-multilingual", score_cache: LRUCache = None):
+        """
+        Args:
+            score_cache: кэш оценок (нормализованный запрос, чанк, версия модели) -> логит
+        """
         logger.info(f"Загружаю модель re-ranking: {model_name}")
         self.model = None
         self.tokenizer = None
         self.device = "cpu"
-        
+        self.model_name = model_name
+        self.score_cache = score_cache
+        # Токены документов по хэшу текста чанка (без спецтокенов, обрезаны до MAX_LENGTH)
+        self._doc_tokens = LRUCache(self.DOC_TOKEN_CACHE_SIZE)
+        self._pair_template = None
+        self._load(model_name)
+
+    def _load(self, model_name: str):
         try:
             # Сначала пробуем загрузить, если есть интернет или кэш
             self.tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
@@ -136,35 +179,203 @@ class RerankerModel:
             logger.warning(f"⚠️ Не удалось загрузить модель re-ranking (Jina): {e}")
             logger.warning("⚠️ RAG будет работать без фазы переранжирования (только векторный поиск). Это нормально для оффлайн режима.")
             self.model = None
-    
+
+    @property
+    def model_version(self) -> str:
+        """Версия модели для ключей кэша оценок."""
+        revision = getattr(getattr(self.model, 'config', None), '_commit_hash', None)
+        return f"torch:{self.model_name}@{revision or 'local'}"
+
+    @staticmethod
+    def _doc_key(document: str) -> bytes:
+        """Идентификатор чанка - хэш его текста."""
+        return hashlib.blake2b(document.encode('utf-8'), digest_size=16).digest()
+
+    def _get_pair_template(self) -> Dict[str, Any]:
+        """
+        Спецтокены пары [query, doc], как их расставляет токенизатор:
+        prefix + query + middle + doc + suffix (и token_type_ids каждой части).
+        """
+        if self._pair_template is None:
+            ids_a = self.tokenizer("a", add_special_tokens=False)['input_ids']
+            ids_b = self.tokenizer("b", add_special_tokens=False)['input_ids']
+            encoded = self.tokenizer("a", "b")
+            full = list(encoded['input_ids'])
+            i = next(k for k in range(len(full)) if full[k:k + len(ids_a)] == ids_a)
+            j = next(k for k in range(i + len(ids_a), len(full)) if full[k:k + len(ids_b)] == ids_b)
+            types = list(encoded.get('token_type_ids') or [0] * len(full))
+            self._pair_template = {
+                'prefix': full[:i], 'middle': full[i + len(ids_a):j], 'suffix': full[j + len(ids_b):],
+                'types': (types[:i], types[i], types[i + len(ids_a):j], types[j], types[j + len(ids_b):]),
+                'with_types': 'token_type_ids' in encoded
+            }
+        return self._pair_template
+
+    def _doc_token_ids(self, document: str, key: bytes, limit: int) -> List[int]:
+        """Токены документа (из кэша, если чанк уже встречался)."""
+        ids = self._doc_tokens.get(key)
+        if ids is None:
+            ids = self.tokenizer(document, add_special_tokens=False)['input_ids'][:limit]
+            self._doc_tokens.put(key, ids)
+        return ids
+
+    def _encode_pairs(self, query: str, documents: List[str], doc_keys: List[bytes]) -> Tuple[List[List[int]], List[List[int]]]:
+        """input_ids и token_type_ids пар с обрезкой longest_first до MAX_LENGTH."""
+        template = self._get_pair_template()
+        budget = self.MAX_LENGTH - len(template['prefix']) - len(template['middle']) - len(template['suffix'])
+        query_ids = self.tokenizer(query, add_special_tokens=False)['input_ids']
+        t_prefix, t_query, t_middle, t_doc, t_suffix = template['types']
+
+        all_ids, all_types = [], []
+        for document, key in zip(documents, doc_keys):
+            doc_ids = self._doc_token_ids(document, key, budget)
+            q_len, d_len = len(query_ids), len(doc_ids)
+            if q_len + d_len > budget:
+                # Как truncation='longest_first': сначала обрезается более длинная часть,
+                # и только если короткая больше половины бюджета - обе до половины
+                shorter = min(q_len, d_len)
+                if 2 * shorter > budget:
+                    shorter = budget // 2
+                if q_len <= d_len:
+                    q_len, d_len = shorter, budget - shorter
+                else:
+                    q_len, d_len = budget - shorter, shorter
+            all_ids.append(template['prefix'] + query_ids[:q_len] + template['middle'] + doc_ids[:d_len] + template['suffix'])
+            all_types.append(t_prefix + [t_query] * q_len + t_middle + [t_doc] * d_len + t_suffix)
+        return all_ids, all_types
+
+    def _micro_batches(self, lengths: List[int]) -> List[List[int]]:
+        """Группирует пары по длине: короткие не дополняются до самой длинной."""
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+        batches, current = [], []
+        for i in order:
+            # order по возрастанию, поэтому длина с паддингом = длина текущей пары
+            if current and (len(current) >= self.MICRO_BATCH_SIZE or
+                            (len(current) + 1) * lengths[i] > self.MICRO_BATCH_TOKENS):
+                batches.append(current)
+                current = []
+            current.append(i)
+        if current:
+            batches.append(current)
+        return batches
+
+    def _forward(self, inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        """Логиты модели для подготовленного батча."""
+        with torch.no_grad():
+            tensors = {name: torch.from_numpy(value).to(self.device) for name, value in inputs.items()}
+            return self.model(**tensors, return_dict=True).logits.reshape(-1).float().cpu().numpy()
+
+    def _score(self, query: str, documents: List[str]) -> np.ndarray:
+        """Оценки релевантности (логиты cross-encoder) для пар [query, doc]."""
+        return self._score_many([(query, documents)])[0]
+
+    def _score_many(self, requests: List[Tuple[str, List[str]]]) -> List[np.ndarray]:
+        """Оценки для нескольких запросов: все пары вне кэша идут через модель общим батчем."""
+        all_scores, pending = [], []
+        for query, documents in requests:
+            doc_keys = [self._doc_key(doc) for doc in documents]
+            scores = np.zeros(len(documents), dtype=np.float32)
+            missing = list(range(len(documents)))
+            if self.score_cache is not None:
+                # Через модель идут только пары, которых нет в кэше
+                prefix = (normalize_query(query), self.model_version)
+                missing = []
+                for i, key in enumerate(doc_keys):
+                    cached = self.score_cache.get(prefix + (key,))
+                    if cached is None:
+                        missing.append(i)
+                    else:
+                        scores[i] = cached
+            all_scores.append(scores)
+            if missing:
+                pending.append((len(all_scores) - 1, query, documents, doc_keys, missing))
+
+        if pending:
+            encoded = [
+                self._encode_pairs(query, [documents[i] for i in missing], [doc_keys[i] for i in missing])
+                for _, query, documents, doc_keys, missing in pending
+            ]
+            computed = self._compute_scores(
+                [ids for all_ids, _ in encoded for ids in all_ids],
+                [types for _, all_types in encoded for types in all_types]
+            )
+            offset = 0
+            for (n, query, _, doc_keys, missing) in pending:
+                part = computed[offset:offset + len(missing)]
+                offset += len(missing)
+                all_scores[n][missing] = part
+                if self.score_cache is not None:
+                    prefix = (normalize_query(query), self.model_version)
+                    for i, score in zip(missing, part):
+                        self.score_cache.put(prefix + (doc_keys[i],), float(score))
+        return all_scores
+
+    def _compute_scores(self, all_ids: List[List[int]], all_types: List[List[int]]) -> np.ndarray:
+        """Прогоняет закодированные пары через модель микро-батчами по длине."""
+        with_types = self._get_pair_template()['with_types']
+        pad_id = self.tokenizer.pad_token_id or 0
+        scores = np.zeros(len(all_ids), dtype=np.float32)
+
+        for batch in self._micro_batches([len(ids) for ids in all_ids]):
+            width = max(len(all_ids[i]) for i in batch)
+            input_ids = np.full((len(batch), width), pad_id, dtype=np.int64)
+            attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+            token_type_ids = np.zeros((len(batch), width), dtype=np.int64)
+            for row, i in enumerate(batch):
+                n = len(all_ids[i])
+                input_ids[row, :n] = all_ids[i]
+                attention_mask[row, :n] = 1
+                token_type_ids[row, :n] = all_types[i]
+
+            inputs = {'input_ids': input_ids, 'attention_mask': attention_mask}
+            if with_types:
+                inputs['token_type_ids'] = token_type_ids
+            scores[batch] = self._forward(inputs)
+        return scores
+
     def rerank(self, query: str, documents: List[str], top_k: int = 5) -> List[Tuple[int, float, str]]:
-        if not self.model or not documents:
-            return [(i, 1.0, doc) for i, doc in enumerate(documents)][:top_k]
+        return self.rerank_many([(query, documents)])[0][:top_k]
+
+    def rerank_many(self, requests: List[Tuple[str, List[str]]]) -> List[List[Tuple[int, float, str]]]:
+        """Re-ranking нескольких запросов за один прогон модели: [(query, documents)] -> ранжирование каждого."""
+        fallback = [[(i, 1.0, doc) for i, doc in enumerate(documents)] for _, documents in requests]
+        if not self.model or not any(documents for _, documents in requests):
+            return fallback
         try:
-            with torch.no_grad():
-                inputs = self.tokenizer(
-                    [[query, doc] for doc in documents],
-                    padding=True, truncation=True, return_tensors="pt", max_length=512
-                ).to(self.device)
-                scores = self.model(**inputs, return_dict=True).logits.squeeze(-1).cpu().numpy()
-            
-            ranked = sorted([(i, score, documents[i]) for i, score in enumerate(scores)], key=lambda x: x[1], reverse=True)
-            return ranked[:top_k]
+            all_scores = self._score_many(requests)
+            return [
+                sorted([(i, score, documents[i]) for i, score in enumerate(scores)], key=lambda x: x[1], reverse=True)
+                for (_, documents), scores in zip(requests, all_scores)
+            ]
         except Exception as e:
             logger.error(f"Ошибка при re-ranking: {e}")
-            return [(i, 1.0, doc) for i, doc in enumerate(documents)][:top_k]
+            return fallback
 
 
 # --- Обновленный RAGEngine ---
 
 class RAGEngine:
     """Главный класс RAG системы с Google Gemini API"""
+
+    EMBED_BATCH_SIZE = 100  # Максимум текстов в одном запросе embed_content
+    EMBED_TASK_TYPE = "RETRIEVAL_QUERY"
+    IDLE_UNLOAD_SECONDS = 30  # Язык без запросов дольше этого можно выгрузить ради бюджета памяти
     
     def __init__(
         self,
         reranker_model: str = "jinaai/jina-reranker-v2-base-multilingual",
         languages: List[str] = ['ru', 'en'],
-        base_dir: str = "rag"
+        base_dir: str = "rag",
+        embedding_cache: bool = True,
+        embedding_cache_mb: float = 200.0,
+        concurrent_retrieval: bool = True,
+        retrieval_workers: int = 8,
+        bm25_workers: int = 1,
+        reranker_backend: str = "torch",
+        rerank_cache_size: int = 20000,
+        lazy_loading: bool = False,
+        memory_budget_mb: float = None,
+        load_reranker: bool = True
     ):
         logger.info("🚀 Инициализирую RAG Engine...")
         
@@ -173,24 +384,150 @@ class RAGEngine:
         self.base_dir = Path(base_dir)
         self.embedding_model_name = "models/text-embedding-004"
         self.languages = languages
+        self.bm25_workers = bm25_workers  # Процессы для токенизации корпуса BM25
+
+        # Кэш эмбеддингов запросов (LRU в памяти + SQLite в папке данных)
+        self.embedding_cache = None
+        if embedding_cache:
+            self.embedding_cache = EmbeddingCache(
+                self.base_dir / "embedding_cache.sqlite", max_disk_mb=embedding_cache_mb
+            )
+
+        # Пул потоков для параллельных ретриверов (numpy/FAISS отпускают GIL)
+        self.retrieval_workers = retrieval_workers
+        self._executor = None
+        if concurrent_retrieval:
+            self._executor = ThreadPoolExecutor(max_workers=retrieval_workers, thread_name_prefix='rag-retrieval')
         
-        self.reranker = RerankerModel(reranker_model)
-        
-        self.stemmers = {
-            'ru': SnowballStemmer('russian'),
-            'en': SnowballStemmer('english')
-        }
+        # Кэш оценок cross-encoder для повторяющихся пар (запрос, чанк)
+        self.rerank_cache = LRUCache(rerank_cache_size) if rerank_cache_size else None
+        # load_reranker=False: модель загружается позже (load_reranker/warm_up), до этого
+        # поиск работает без re-ranking
+        self._reranker_config = (reranker_model, reranker_backend)
+        self._reranker_lock = threading.Lock()
+        self._load_timings: Dict[str, Dict[str, float]] = {}
+        self.reranker = None
+        if load_reranker:
+            self.load_reranker()
         
         self.indices: Dict[str, faiss.Index] = {}
-        self.bm25_indices: Dict[str, Any] = {}
+        self.index_configs: Dict[str, Dict[str, Any]] = {}
+        self.bm25_indices: Dict[str, SparseBM25] = {}
         self.metadata: Dict[str, Any] = {}
         self.chunked_data: Dict[str, Dict] = {}
+        self.text_stores: Dict[str, ChunkTextStore] = {}
+        self.phrase_indices: Dict[str, PhraseIndex] = {}
+        self.verse_indices: Dict[str, VerseIndex] = {}
+
+        # Данные языков: загрузка при первом запросе (lazy_loading) и выгрузка
+        # давно не использованных языков при превышении memory_budget_mb
+        self.lazy_loading = lazy_loading
+        self.memory_budget_bytes = int(memory_budget_mb * 1024 * 1024) if memory_budget_mb else None
+        self._load_lock = threading.RLock()
+        self._ready_languages = set()
+        self._extras_pending = set()  # Языки, для которых warm_up еще не загрузил BM25/фразы/стихи
+        self._language_bytes: Dict[str, int] = {}
+        self._last_used: Dict[str, float] = {}
         
-        for lang in languages:
-            self._load_language_data(lang)
+        if not lazy_loading:
+            for lang in languages:
+                self.load_language(lang)
         
         logger.info("✅ RAG Engine готов к работе!")
 
+    def load_reranker(self):
+        """Загружает модель re-ranking (если еще не загружена)."""
+        with self._reranker_lock:
+            if self.reranker is not None:
+                return
+            start = time.perf_counter()
+            reranker = self._create_reranker(*self._reranker_config)
+            self._load_timings.setdefault('reranker', {})['reranker'] = round((time.perf_counter() - start) * 1000, 2)
+            self.reranker = reranker
+
+    @property
+    def reranker_ready(self) -> bool:
+        return self.reranker is not None and bool(self.reranker.model)
+
+    def _mark_degraded(
+        self,
+        response: Dict[str, Any],
+        use_reranking: bool,
+        target_languages: List[str],
+        embedding_failed: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Отмечает в ответе компоненты, без которых он получен:
+        '<lang>:bm25' - индексы BM25/фраз/стихов языка, 'reranker' - модель re-ranking
+        (еще прогреваются), 'embedding' - эмбеддинги запроса не получены (ошибка API).
+        """
+        degraded = [f"{lang}:bm25" for lang in target_languages if lang in self._extras_pending]
+        if use_reranking and self.reranker is None:
+            degraded.append('reranker')
+        if embedding_failed:
+            degraded.append('embedding')
+        if degraded:
+            response['degraded'] = degraded
+        return response
+
+    def _create_reranker(self, model_name: str, backend: str) -> RerankerModel:
+        """
+        Создает модель re-ranking.
+
+        Args:
+            backend: 'torch' (transformers, float32) или 'onnx' (ONNX Runtime, int8 на CPU)
+        """
+        if backend == "onnx":
+            try:
+                from rag.reranker_onnx import OnnxRerankerModel
+            except ImportError:
+                from reranker_onnx import OnnxRerankerModel
+            reranker = OnnxRerankerModel(
+                model_name, cache_dir=self.base_dir / "onnx_reranker", score_cache=self.rerank_cache
+            )
+            if reranker.model is not None:
+                return reranker
+            logger.warning("⚠️ ONNX бэкенд re-ranking недоступен, использую torch")
+        elif backend != "torch":
+            logger.warning(f"⚠️ Неизвестный бэкенд re-ranking '{backend}', использую torch")
+        return RerankerModel(model_name, score_cache=self.rerank_cache)
+
+    def after_fork(self):
+        """
+        Подготовка движка в дочернем процессе после fork (gunicorn --preload).
+
+        Индексы FAISS и mmap-хранилища остаются общими (copy-on-write), а потоки
+        пула и соединение SQLite через fork не наследуются - создаем их заново.
+        """
+        if self._executor is not None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.retrieval_workers, thread_name_prefix='rag-retrieval'
+            )
+        if self.embedding_cache is not None:
+            self.embedding_cache.after_fork()
+
+    def close(self):
+        """
+        Освобождает файлы папки данных (перед ее удалением): выгружает все языки,
+        закрывает mmap-отображения индексов и базу SQLite кэша эмбеддингов.
+        После close() движок не используется.
+
+        Raises:
+            RuntimeError: если файлы остались открытыми (на данные еще есть ссылки)
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        loaded = set(self.indices) | set(self.metadata) | set(self.bm25_indices) | set(self.text_stores)
+        for language in loaded:
+            self.unload_language(language)
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
+        still_open = close_array_files(self.base_dir)
+        if still_open:
+            raise RuntimeError(f"Файлы данных остались открытыми: {', '.join(str(p) for p in still_open)}")
+        logger.info("🔒 RAG Engine закрыт, файлы данных освобождены")
+
     def _configure_gemini_api(self):
         """Загружает и настраивает ключ API для Gemini."""
         load_dotenv()
@@ -208,66 +545,280 @@ class RAGEngine:
         except Exception as e:
             logger.error(f"❌ Ошибка при конфигурации Gemini API: {e}")
 
+    def load_language(self, language: str, extras: bool = True) -> bool:
+        """
+        Загружает данные языка, если они еще не загружены.
+
+        Args:
+            extras: загрузить и индексы BM25/фраз/стихов (False - только FAISS и
+                метаданные, остальное загружает warm_up)
+
+        Returns:
+            True, если индекс языка доступен для поиска
+        """
+        if language in self._ready_languages:
+            self._last_used[language] = time.monotonic()
+            return True
+
+        with self._load_lock:
+            if language not in self.indices and language in self.languages:
+                start = time.perf_counter()
+                if extras:
+                    self._load_language_data(language)
+                elif self._load_language_core(language):
+                    self._extras_pending.add(language)
+                if language in self.indices:
+                    self._language_bytes[language] = self._estimate_language_bytes(language)
+                    logger.info(
+                        f"⏱️ Данные языка '{language}' загружены за {time.perf_counter() - start:.1f} сек "
+                        f"(~{self._language_bytes[language] / (1024 * 1024):.0f} МБ)"
+                    )
+            if language not in self.indices:
+                return False
+            self._ready_languages.add(language)
+            self._last_used[language] = time.monotonic()
+            self._enforce_memory_budget(keep=language)
+        return True
+
+    def unload_language(self, language: str):
+        """Выгружает данные языка (при следующем запросе они загрузятся снова)."""
+        with self._load_lock:
+            self._ready_languages.discard(language)
+            self._extras_pending.discard(language)
+            for store in (self.indices, self.index_configs, self.bm25_indices, self.metadata, self.chunked_data,
+                          self.text_stores, self.phrase_indices, self.verse_indices):
+                store.pop(language, None)
+            freed = self._language_bytes.pop(language, 0)
+            self._last_used.pop(language, None)
+        gc.collect()
+        logger.info(f"🧹 Данные языка '{language}' выгружены (~{freed / (1024 * 1024):.0f} МБ)")
+
+    def _estimate_language_bytes(self, language: str) -> int:
+        """Оценка памяти языка по размеру его файлов (индекс FAISS загружается целиком)."""
+        names = [f"faiss_index_{language}.bin", f"bm25_index_{language}.bin",
+                 f"phrase_index_{language}.bin", f"verse_index_{language}.bin"]
+        if language in self.text_stores:
+            names += [f"chunk_texts_{language}.bin", f"chunk_meta_{language}.bin"]
+        else:
+            names += [f"faiss_metadata_{language}.json", f"chunked_scriptures_{language}.json"]
+        total = 0
+        for name in names:
+            path = self.base_dir / name
+            if path.exists():
+                total += path.stat().st_size
+        return total
+
+    def _enforce_memory_budget(self, keep: str):
+        """Выгружает давно не использованные языки, пока данные не уложатся в бюджет."""
+        if self.memory_budget_bytes is None:
+            return
+        total = sum(self._language_bytes.values())
+        now = time.monotonic()
+        for language in sorted(self._ready_languages - {keep}, key=lambda l: self._last_used.get(l, 0.0)):
+            if total <= self.memory_budget_bytes:
+                break
+            # Язык, использованный недавно, может быть занят идущим поиском
+            if now - self._last_used.get(language, 0.0) < self.IDLE_UNLOAD_SECONDS:
+                continue
+            total -= self._language_bytes.get(language, 0)
+            self.unload_language(language)
+        if total > self.memory_budget_bytes:
+            logger.warning(
+                f"⚠️ Данные языков (~{total / (1024 * 1024):.0f} МБ) превышают бюджет "
+                f"{self.memory_budget_bytes / (1024 * 1024):.0f} МБ"
+            )
+
+    def language_stats(self) -> Dict[str, Any]:
+        """Загруженные языки: оценка памяти и время с последнего запроса."""
+        now = time.monotonic()
+        return {
+            'loaded': {
+                language: {
+                    'mb': round(self._language_bytes.get(language, 0) / (1024 * 1024), 1),
+                    'idle_s': round(now - self._last_used.get(language, now), 1)
+                }
+                for language in sorted(self._ready_languages)
+            },
+            'memory_budget_mb': round(self.memory_budget_bytes / (1024 * 1024), 1) if self.memory_budget_bytes else None
+        }
+
     def _load_language_data(self, language: str):
         """Загружает индекс, метаданные и чанки для указанного языка."""
+        if self._load_language_core(language):
+            self._load_language_extras(language)
+
+    def _load_language_core(self, language: str) -> bool:
+        """Минимум для поиска: индекс FAISS и метаданные/тексты чанков."""
         index_file = self.base_dir / f"faiss_index_{language}.bin"
-        metadata_file = self.base_dir / f"faiss_metadata_{language}.json"
-        chunks_file = self.base_dir / f"chunked_scriptures_{language}.json"
 
         if not index_file.exists():
             logger.warning(f"⚠️ Индекс FAISS не найден: {index_file}")
-            return
+            return False
             
         logger.info(f"📂 Загружаю данные для языка '{language}'...")
-        self.indices[language] = faiss.read_index(str(index_file))
-        logger.info(f"  - Загружено {self.indices[language].ntotal:,} векторов из {index_file}")
+        index = self._timed(self._load_timings.setdefault(language, {}), 'faiss', faiss.read_index, str(index_file))
+        self._apply_index_config(index, language)
+        logger.info(f"  - Загружено {index.ntotal:,} векторов из {index_file}")
+
+        self._timed(self._load_timings[language], 'metadata', self._load_chunk_data, language)
+        self.indices[language] = index
+        return True
+
+    def _apply_index_config(self, index: faiss.Index, language: str):
+        """
+        Применяет параметры поиска (nprobe, efSearch) из faiss_index_{lang}.json,
+        записанного faiss_indexer.py. Тип индекса (IVF-PQ, HNSW, SQ8...) FAISS
+        определяет сам при чтении файла.
+        """
+        config_file = self.base_dir / f"faiss_index_{language}.json"
+        if not config_file.exists():
+            return
+        try:
+            with open(config_file, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            self.index_configs[language] = config
+            params = faiss.ParameterSpace()
+            for name, value in config.get('search_params', {}).items():
+                params.set_index_parameter(index, name, value)
+            logger.info(f"  - Индекс {config.get('factory', config.get('type'))}, параметры поиска: {config.get('search_params', {})}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка при применении параметров индекса FAISS ({language}): {e}")
+
+    def _load_chunk_data(self, language: str):
+        if not self._open_chunk_store(language):
+            self._load_json_chunk_data(language)
+
+    def _load_language_extras(self, language: str):
+        """Индексы BM25, фраз и стихов (без них поиск работает медленнее или без BM25)."""
+        timings = self._load_timings.setdefault(language, {})
+        # --- Построение или Загрузка BM25 индекса ---
+        if language in self.metadata and self.metadata[language]:
+            self._timed(timings, 'bm25', self._load_bm25_index, language)
+
+        self._timed(timings, 'phrase', self._load_phrase_index, language)
+        self._timed(timings, 'verse', self._load_verse_index, language)
+
+    def warm_up(self, languages: List[str] = None):
+        """
+        Поэтапный прогрев: сначала FAISS и метаданные каждого языка (с этого
+        момента поиск отвечает без BM25 и re-ranking), затем индексы BM25,
+        фраз и стихов, затем модель re-ranking.
+        """
+        languages = self.languages if languages is None else languages
+        ready = [lang for lang in languages if self.load_language(lang, extras=False)]
+        for lang in ready:
+            with self._load_lock:
+                if lang in self._extras_pending:
+                    # Пока индексы строятся, ответы поиска отмечаются как degraded
+                    try:
+                        self._load_language_extras(lang)
+                    finally:
+                        self._extras_pending.discard(lang)
+                    self._language_bytes[lang] = self._estimate_language_bytes(lang)
+        self.load_reranker()
+        logger.info("🔥 Прогрев RAG Engine завершен")
+
+    def readiness(self) -> Dict[str, Any]:
+        """Готовность компонентов по языкам и время их загрузки (мс)."""
+        components = {
+            'faiss': self.indices, 'metadata': self.metadata, 'bm25': self.bm25_indices,
+            'phrase': self.phrase_indices, 'verse': self.verse_indices
+        }
+        languages = {}
+        for lang in self.languages:
+            timings = self._load_timings.get(lang, {})
+            languages[lang] = {
+                name: {'ready': lang in store, 'ms': timings.get(name)} for name, store in components.items()
+            }
+        return {
+            'search_ready': any(lang in self.indices and lang in self.metadata for lang in self.languages),
+            'languages': languages,
+            'reranker': {
+                'ready': self.reranker_ready,
+                'loaded': self.reranker is not None,
+                'ms': self._load_timings.get('reranker', {}).get('reranker')
+            }
+        }
+
+    def _corpus_fingerprint(self, language: str) -> str:
+        """Отпечаток текстов корпуса (меняется при изменении чанков)."""
+        store = self.text_stores.get(language)
+        if store is None:
+            store = ChunkTextStore.from_texts(
+                (self._get_chunk_text(idx, language) for idx in range(len(self.metadata[language]))),
+                with_lower=False
+            )
+        return store.fingerprint()
+
+    def _load_bm25_index(self, language: str):
+        """Открывает BM25 индекс (mmap) или строит его заново, если файл устарел."""
+        bm25_file = self.base_dir / f"bm25_index_{language}.bin"
+        tokenizer = tokenizer_signature(language)
+        fingerprint = self._corpus_fingerprint(language)
+
+        if bm25_file.exists():
+            logger.info(f"📂 Загружаю индекс BM25 для языка '{language}' из файла...")
+            try:
+                bm25 = SparseBM25.load(bm25_file, tokenizer, fingerprint)
+                if bm25 is not None:
+                    self.bm25_indices[language] = bm25
+                    logger.info(f"✅ Индекс BM25 успешно загружен")
+                    return
+                logger.info("   Индекс BM25 устарел. Буду строить заново.")
+            except Exception as e:
+                logger.error(f"❌ Ошибка при загрузке BM25 индекса: {e}. Буду строить заново.")
+
+        logger.info(f"⏳ Строю индекс BM25 для языка '{language}'...")
+        try:
+            texts = (self._get_chunk_text(idx, language) for idx in range(len(self.metadata[language])))
+            corpus = tokenize_corpus(texts, language, self.bm25_workers)
+
+            self.bm25_indices[language] = SparseBM25.build(corpus)
+            logger.info(f"✅ Индекс BM25 построен ({len(corpus)} документов)")
+
+            logger.info(f"💾 Сохраняю индекс BM25 в файл {bm25_file}...")
+            self.bm25_indices[language].save(bm25_file, tokenizer, fingerprint)
+            logger.info(f"✅ Индекс BM25 сохранен")
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка при построении BM25: {e}")
+
+    def _open_chunk_store(self, language: str) -> bool:
+        """Открывает бинарные файлы чанков (mmap), если они есть и актуальны."""
+        texts_file = self.base_dir / f"chunk_texts_{language}.bin"
+        meta_file = self.base_dir / f"chunk_meta_{language}.bin"
+        if not texts_file.exists() or not meta_file.exists():
+            return False
+
+        try:
+            opened = open_chunk_store(
+                texts_file, meta_file,
+                texts_source=self.base_dir / f"chunked_scriptures_{language}.json",
+                meta_source=self.base_dir / f"faiss_metadata_{language}.json"
+            )
+        except Exception as e:
+            logger.error(f"❌ Ошибка при открытии бинарного хранилища чанков: {e}. Загружаю JSON.")
+            return False
+
+        if opened is None:
+            logger.warning(f"⚠️ Бинарное хранилище чанков для '{language}' устарело. Загружаю JSON.")
+            return False
+
+        self.text_stores[language], self.metadata[language] = opened
+        logger.info(f"  - Открыто бинарное хранилище чанков ({len(self.metadata[language])} записей)")
+        return True
+
+    def _load_json_chunk_data(self, language: str):
+        """Загружает метаданные и чанки из JSON и сохраняет их в бинарном формате."""
+        metadata_file = self.base_dir / f"faiss_metadata_{language}.json"
+        chunks_file = self.base_dir / f"chunked_scriptures_{language}.json"
 
         if metadata_file.exists():
             with open(metadata_file, 'r', encoding='utf-8') as f:
                 raw_metadata = json.load(f)
             
             # Flatten metadata to match FAISS indices
-            flat_metadata = []
-            structure = raw_metadata.get('structure', {})
-            
-            # Collect all chapters
-            all_chapters = []
-            for book_key, book_data in structure.items():
-                for chapter_key, chapter_data in book_data.items():
-                    if 'embedding_key' in chapter_data:
-                        all_chapters.append({
-                            'book': book_key,
-                            'chapter': chapter_key,
-                            'data': chapter_data
-                        })
-            
-            # Sort by embedding_key index (e.g., embeddings_0, embeddings_1)
-            def get_embedding_index(item):
-                key = item['data']['embedding_key']
-                try:
-                    return int(key.split('_')[1])
-                except (IndexError, ValueError):
-                    return 999999
-            
-            all_chapters.sort(key=get_embedding_index)
-            
-            # Create flat list
-            for item in all_chapters:
-                book = item['book']
-                chapter = item['chapter']
-                data = item['data']
-                num_chunks = data.get('num_chunks', 0)
-                text_previews = data.get('text_previews', [])
-                
-                for i in range(num_chunks):
-                    preview = text_previews[i] if i < len(text_previews) else ""
-                    flat_metadata.append({
-                        'book': book,
-                        'chapter': chapter,
-                        'chunk_idx': i,
-                        'text_preview': preview,
-                        'html_path': data.get('html_path')
-                    })
+            flat_metadata = flatten_faiss_metadata(raw_metadata)
             
             self.metadata[language] = flat_metadata
             logger.info(f"  - Загружены и обработаны метаданные ({len(flat_metadata)} записей)")
@@ -281,40 +832,68 @@ class RAGEngine:
         else:
              logger.warning(f"  - Файл с чанками не найден: {chunks_file}")
 
-        # --- Построение или Загрузка BM25 индекса ---
-        bm25_file = self.base_dir / f"bm25_index_{language}.pkl"
+        if not self.metadata.get(language):
+            return
 
-        if language in self.metadata and self.metadata[language]:
-            if bm25_file.exists():
-                logger.info(f"📂 Загружаю индекс BM25 для языка '{language}' из файла...")
-                try:
-                    with open(bm25_file, 'rb') as f:
-                        self.bm25_indices[language] = pickle.load(f)
-                    logger.info(f"✅ Индекс BM25 успешно загружен")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка при загрузке BM25 индекса: {e}. Буду строить заново.")
-
-            if language not in self.bm25_indices:
-                logger.info(f"⏳ Строю индекс BM25 для языка '{language}'...")
-                try:
-                    corpus = []
-                    for meta in self.metadata[language]:
-                        text = self._get_text_from_meta(meta, language)
-                        corpus.append(self._tokenize(text, language))
-                    
-                    self.bm25_indices[language] = BM25Okapi(corpus)
-                    logger.info(f"✅ Индекс BM25 построен ({len(corpus)} документов)")
-                    
-                    logger.info(f"💾 Сохраняю индекс BM25 в файл {bm25_file}...")
-                    with open(bm25_file, 'wb') as f:
-                        pickle.dump(self.bm25_indices[language], f)
-                    logger.info(f"✅ Индекс BM25 сохранен")
-                    
-                except Exception as e:
-                    logger.error(f"❌ Ошибка при построении BM25: {e}")
+        # Плоское хранилище текстов по id строки FAISS; вложенный словарь больше не нужен
+        flat_metadata = self.metadata[language]
+        texts = [self._get_text_from_meta(meta, language) for meta in flat_metadata]
+        self.text_stores[language] = ChunkTextStore.from_texts(texts)
+        self.chunked_data.pop(language, None)
+        logger.info(f"  - Тексты чанков упакованы ({len(self.text_stores[language].blob) / (1024*1024):.1f} МБ)")
 
-    def _get_embedding(self, texts: List[str], api_key: str = None) -> np.ndarray:
-        """Получает эмбеддинги для списка текстов с помощью Gemini API."""
+        # Сохраняем бинарный формат, чтобы следующий запуск открыл его через mmap
+        try:
+            texts_file = self.base_dir / f"chunk_texts_{language}.bin"
+            write_chunk_texts(texts_file, (
+                (meta.get('book'), meta.get('chapter'), meta.get('chunk_idx'), text)
+                for meta, text in zip(flat_metadata, texts)
+            ), source_file=chunks_file)
+            write_chunk_meta(
+                self.base_dir / f"chunk_meta_{language}.bin",
+                flat_metadata, list(range(len(flat_metadata))),
+                source_file=metadata_file
+            )
+            logger.info(f"💾 Бинарное хранилище чанков сохранено для языка '{language}'")
+        except Exception as e:
+            logger.error(f"❌ Ошибка при сохранении бинарного хранилища чанков: {e}")
+
+    def _load_phrase_index(self, language: str):
+        """Загружает или строит триграммный индекс для поиска точных фраз."""
+        metadata_list = self.metadata.get(language)
+        if not metadata_list:
+            return
+
+        phrase_file = self.base_dir / f"phrase_index_{language}.bin"
+        fingerprint = self._corpus_fingerprint(language)
+
+        if phrase_file.exists():
+            try:
+                index = PhraseIndex.load(phrase_file, fingerprint)
+                if index is not None and index.num_docs == len(metadata_list):
+                    self.phrase_indices[language] = index
+                    logger.info(f"✅ Индекс фраз загружен ({len(index.grams):,} триграмм)")
+                    return
+                logger.warning(f"⚠️ Индекс фраз {phrase_file} устарел. Буду строить заново.")
+            except Exception as e:
+                logger.error(f"❌ Ошибка при загрузке индекса фраз: {e}. Буду строить заново.")
+
+        logger.info(f"⏳ Строю индекс фраз для языка '{language}'...")
+        try:
+            start = time.time()
+            index = PhraseIndex.build(
+                (self._get_chunk_text_lower(idx, language) for idx in range(len(metadata_list))), fingerprint
+            )
+            self.phrase_indices[language] = index
+            logger.info(f"✅ Индекс фраз построен за {time.time() - start:.1f} сек ({len(index.grams):,} триграмм)")
+
+            index.save(phrase_file)
+            logger.info(f"💾 Индекс фраз сохранен в {phrase_file}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка при построении индекса фраз: {e}")
+
+    def _use_api_key(self, api_key: str = None):
+        """Переключает ключ Gemini API, если в запросе передан другой."""
         if api_key and api_key != self.current_api_key:
             try:
                 masked_key = f"{api_key[:4]}...{api_key[-4:]}" if len(api_key) > 8 else "***"
@@ -324,37 +903,106 @@ class RAGEngine:
             except Exception as e:
                 logger.error(f"Error configuring API key: {e}")
 
+    def _cached_embeddings(self, texts: List[str]) -> Tuple[List[Any], List[int]]:
+        """Эмбеддинги из кэша (None для отсутствующих) и индексы текстов, которых нет в кэше."""
+        vectors = [None] * len(texts)
+        if self.embedding_cache is not None:
+            vectors = self.embedding_cache.get_many(self.embedding_model_name, self.EMBED_TASK_TYPE, texts)
+        return vectors, [i for i, v in enumerate(vectors) if v is None]
+
+    def _embedding_batches(self, texts: List[str]) -> List[List[str]]:
+        """Батчи для embed_content (лимит API - 100 текстов в запросе)."""
+        return [texts[i:i + self.EMBED_BATCH_SIZE] for i in range(0, len(texts), self.EMBED_BATCH_SIZE)]
+
+    @staticmethod
+    def _embedding_request(batch: List[str]) -> Any:
+        return batch if len(batch) > 1 else batch[0]
+
+    @staticmethod
+    def _embedding_response(batch: List[str], result: Dict[str, Any]) -> List[Any]:
+        embedding = result['embedding']
+        return embedding if len(batch) > 1 else [embedding]
+
+    def _merge_embeddings(
+        self,
+        texts: List[str],
+        vectors: List[Any],
+        missing: List[int],
+        new_embeddings: List[Any] = None,
+        error: Exception = None
+    ) -> np.ndarray:
+        """
+        Объединяет кэшированные и полученные эмбеддинги (при ошибке API - нулевые векторы).
+        Строки результата нормализованы (L2), поэтому векторный поиск использует их без копии.
+        """
+        if error is not None:
+            logger.error(f"❌ Ошибка при получении эмбеддинга от Gemini API: {error}", exc_info=error)
+            dim = 768
+            return np.array(
+                [v if v is not None else np.zeros(dim, dtype='float32') for v in vectors], dtype='float32'
+            )
+        if missing:
+            new_embeddings = np.array(new_embeddings, dtype='float32')
+            if self.embedding_cache is not None:
+                self.embedding_cache.put_many(
+                    self.embedding_model_name, self.EMBED_TASK_TYPE, [texts[i] for i in missing], new_embeddings
+                )
+            for i, emb in zip(missing, new_embeddings):
+                vectors[i] = emb
+        matrix = np.array(vectors, dtype='float32')
+        faiss.normalize_L2(matrix)
+        return matrix
+
+    @staticmethod
+    def _embedding_failed(embeddings: np.ndarray) -> bool:
+        """Есть ли нулевые векторы (подставляются _merge_embeddings при ошибке API)."""
+        embeddings = np.asarray(embeddings)
+        return embeddings.size > 0 and not np.all(np.any(embeddings, axis=-1))
+
+    def _get_embedding(self, texts: List[str], api_key: str = None) -> np.ndarray:
+        """Получает эмбеддинги для списка текстов с помощью Gemini API (с кэшем запросов)."""
+        self._use_api_key(api_key)
+        vectors, missing = self._cached_embeddings(texts)
+        if not missing:
+            return self._merge_embeddings(texts, vectors, missing)
+
         try:
-            if len(texts) == 1:
+            new_embeddings = []
+            # Один запрос на батч (лимит API - 100 текстов)
+            for batch in self._embedding_batches([texts[i] for i in missing]):
                 result = genai.embed_content(
-                    model="models/text-embedding-004",
-                    content=texts[0],
-                    task_type="RETRIEVAL_QUERY"
+                    model=self.embedding_model_name,
+                    content=self._embedding_request(batch),
+                    task_type=self.EMBED_TASK_TYPE
                 )
-                embedding = result['embedding']
-                return np.array([embedding], dtype='float32')
-            else:
-                all_embeddings = []
-                for text in texts:
-                    result = genai.embed_content(
-                        model="models/text-embedding-004",
-                        content=text,
-                        task_type="RETRIEVAL_QUERY"
-                    )
-                    all_embeddings.append(result['embedding'])
-                return np.array(all_embeddings, dtype='float32')
+                new_embeddings.extend(self._embedding_response(batch, result))
+            return self._merge_embeddings(texts, vectors, missing, new_embeddings)
         except Exception as e:
-            logger.error(f"❌ Ошибка при получении эмбеддинга от Gemini API: {e}", exc_info=True)
-            dim = 768
-            return np.zeros((len(texts), dim), dtype='float32')
+            return self._merge_embeddings(texts, vectors, missing, error=e)
+
+    async def _get_embedding_async(self, texts: List[str], api_key: str = None) -> np.ndarray:
+        """Асинхронный вариант _get_embedding: сетевой запрос не занимает поток."""
+        self._use_api_key(api_key)
+        vectors, missing = self._cached_embeddings(texts)
+        if not missing:
+            return self._merge_embeddings(texts, vectors, missing)
+
+        try:
+            new_embeddings = []
+            for batch in self._embedding_batches([texts[i] for i in missing]):
+                result = await genai.embed_content_async(
+                    model=self.embedding_model_name,
+                    content=self._embedding_request(batch),
+                    task_type=self.EMBED_TASK_TYPE
+                )
+                new_embeddings.extend(self._embedding_response(batch, result))
+            return self._merge_embeddings(texts, vectors, missing, new_embeddings)
+        except Exception as e:
+            return self._merge_embeddings(texts, vectors, missing, error=e)
 
     def _tokenize(self, text: str, language: str) -> List[str]:
         """Токенизация со стеммингом для BM25"""
-        words = re.findall(r'\w+', text.lower())
-        stemmer = self.stemmers.get(language)
-        if stemmer:
-            return [stemmer.stem(w) for w in words]
-        return words
+        return tokenize(text, language)
 
     def _get_text_from_meta(self, meta: Dict, language: str) -> str:
         """Извлекает полный текст чанка по метаданным"""
@@ -376,6 +1024,22 @@ class RAGEngine:
             
         return text
 
+    def _get_chunk_text(self, idx: int, language: str) -> str:
+        """Возвращает полный текст чанка по id строки FAISS."""
+        store = self.text_stores.get(language)
+        if store is not None and 0 <= idx < len(store):
+            return store.get(idx)
+        metadata_list = self.metadata.get(language, [])
+        meta = metadata_list[idx] if 0 <= idx < len(metadata_list) else {}
+        return self._get_text_from_meta(meta, language)
+
+    def _get_chunk_text_lower(self, idx: int, language: str) -> str:
+        """Возвращает текст чанка в нижнем регистре по id строки FAISS."""
+        store = self.text_stores.get(language)
+        if store is not None and 0 <= idx < len(store):
+            return store.get_lower(idx)
+        return self._get_chunk_text(idx, language).lower()
+
     def _search_by_keyword(self, query: str, language: str, top_k: int) -> List[Dict[str, Any]]:
         """Поиск по ключевым словам с помощью BM25"""
         bm25 = self.bm25_indices.get(language)
@@ -383,38 +1047,84 @@ class RAGEngine:
         
         try:
             tokenized_query = self._tokenize(query, language)
-            scores = bm25.get_scores(tokenized_query)
-            
-            top_n_indices = np.argsort(scores)[::-1][:top_k]
-            
-            results = []
-            metadata_list = self.metadata.get(language, [])
-            
-            for idx in top_n_indices:
-                score = scores[idx]
-                if score <= 0: continue
-                
-                meta = metadata_list[idx] if idx < len(metadata_list) else {}
-                text = self._get_text_from_meta(meta, language)
-                
-                results.append({
-                    'index': int(idx),
-                    'distance': 0.0,
-                    'score': float(score),
-                    'text': text,
-                    'book': meta.get('book'), 
-                    'chapter': meta.get('chapter'), 
-                    'verse': None, 
-                    'chunk_idx': meta.get('chunk_idx'),
-                    'html_path': meta.get('html_path'),
-                    'source': 'bm25'
-                })
-            
-            return results
+            top_n_indices, scores = bm25.top_k(tokenized_query, top_k)
+            return self._keyword_hits(top_n_indices, scores, language)
         except Exception as e:
             logger.error(f"Ошибка при keyword поиске: {e}")
             return []
 
+    def _search_by_keyword_many(self, queries: List[str], language: str, top_k: int) -> List[List[Dict[str, Any]]]:
+        """BM25 для пакета запросов (общие термины оцениваются один раз)."""
+        bm25 = self.bm25_indices.get(language)
+        if not bm25: return [[] for _ in queries]
+
+        try:
+            tokenized = [self._tokenize(query, language) for query in queries]
+            return [
+                self._keyword_hits(top_n_indices, scores, language)
+                for top_n_indices, scores in bm25.top_k_many(tokenized, top_k)
+            ]
+        except Exception as e:
+            logger.error(f"Ошибка при keyword поиске: {e}")
+            return [[] for _ in queries]
+
+    def _keyword_hits(self, top_n_indices: np.ndarray, scores: np.ndarray, language: str) -> List[Dict[str, Any]]:
+        results = []
+        metadata_list = self.metadata.get(language, [])
+        
+        for idx, score in zip(top_n_indices, scores):
+            meta = metadata_list[idx] if idx < len(metadata_list) else {}
+            text = self._get_chunk_text(int(idx), language)
+            
+            results.append({
+                'index': int(idx),
+                'distance': 0.0,
+                'score': float(score),
+                'text': text,
+                'book': meta.get('book'), 
+                'chapter': meta.get('chapter'), 
+                'verse': None, 
+                'chunk_idx': meta.get('chunk_idx'),
+                'html_path': meta.get('html_path'),
+                'source': 'bm25'
+            })
+        
+        return results
+
+    def _load_verse_index(self, language: str):
+        """Загружает или строит индекс ссылок на стихи (книга, глава, стих) -> чанки."""
+        metadata_list = self.metadata.get(language)
+        if not metadata_list:
+            return
+
+        verse_file = self.base_dir / f"verse_index_{language}.bin"
+        fingerprint = self._corpus_fingerprint(language)
+
+        if verse_file.exists():
+            try:
+                index = VerseIndex.load(verse_file, fingerprint)
+                if index is not None:
+                    self.verse_indices[language] = index
+                    logger.info(f"✅ Индекс стихов загружен ({len(index.keys):,} ссылок)")
+                    return
+                logger.warning(f"⚠️ Индекс стихов {verse_file} устарел. Буду строить заново.")
+            except Exception as e:
+                logger.error(f"❌ Ошибка при загрузке индекса стихов: {e}. Буду строить заново.")
+
+        logger.info(f"⏳ Строю индекс стихов для языка '{language}'...")
+        try:
+            start = time.time()
+            index = VerseIndex.build(
+                metadata_list, lambda idx: self._get_chunk_text_lower(idx, language), fingerprint
+            )
+            self.verse_indices[language] = index
+            logger.info(f"✅ Индекс стихов построен за {time.time() - start:.1f} сек ({len(index.keys):,} ссылок)")
+
+            index.save(verse_file)
+            logger.info(f"💾 Индекс стихов сохранен в {verse_file}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка при построении индекса стихов: {e}")
+
     def _search_by_simple_match(self, query: str, language: str, top_k: int) -> List[Dict[str, Any]]:
         """
         Простой поиск по точному совпадению подстроки.
@@ -427,20 +1137,28 @@ class RAGEngine:
         search_query = query.lower().strip()
         results = []
 
-        # Итерируемся по метаданным, чтобы сохранить индекс
-        for idx, meta in enumerate(metadata_list):
-            text = self._get_text_from_meta(meta, language)
-            lower_text = text.lower()
+        # Проверяем только чанки, содержащие все триграммы запроса
+        candidate_ids = None
+        phrase_index = self.phrase_indices.get(language)
+        if phrase_index is not None:
+            candidate_ids = phrase_index.candidates(search_query)
+        if candidate_ids is None:
+            candidate_ids = range(len(metadata_list))
+
+        for idx in candidate_ids:
+            idx = int(idx)
+            lower_text = self._get_chunk_text_lower(idx, language)
             
             if search_query in lower_text:
                 # Считаем количество вхождений для ранжирования
                 count = lower_text.count(search_query)
+                meta = metadata_list[idx]
                 
                 results.append({
                     'index': int(idx),
                     'distance': 0.0,
                     'score': float(count), # Score = количество вхождений
-                    'text': text,
+                    'text': self._get_chunk_text(idx, language),
                     'book': meta.get('book'),
                     'chapter': meta.get('chapter'),
                     'verse': None,
@@ -453,60 +1171,144 @@ class RAGEngine:
         results.sort(key=lambda x: x['score'], reverse=True)
         return results[:top_k]
 
-    def _search_by_vector(self, query_embedding: np.ndarray, language: str, top_k: int, vector_distance_threshold: float = None) -> List[Dict[str, Any]]:
-        """Внутренний метод векторного поиска в FAISS."""
+    def _search_by_simple_match_many(self, queries: List[str], language: str, top_k: int) -> List[List[Dict[str, Any]]]:
+        return [self._search_by_simple_match(query, language, top_k) for query in queries]
+
+    def _search_by_vector(self, query_embeddings: np.ndarray, language: str, top_k: int, vector_distance_threshold: float = None) -> List[Dict[str, Any]]:
+        """
+        Векторный поиск в FAISS по эмбеддингу или матрице эмбеддингов (варианты
+        запроса) одним вызовом index.search. Строки объединяются в NumPy: для
+        каждого чанка (book, chapter, chunk_idx) остается лучшая оценка, результаты
+        идут по убыванию оценки (при равенстве - в порядке строк).
+        """
         index = self.indices.get(language)
         if not index: return []
 
         try:
-            query_norm = query_embedding.copy().reshape(1, -1)
-            faiss.normalize_L2(query_norm)
-            distances, indices_found = index.search(query_norm, top_k * 2)
-            
-            results = []
-            metadata_list = self.metadata.get(language, [])
-            
-            seen_ids = set()
-            
-            for i, (dist, idx) in enumerate(zip(distances[0], indices_found[0])):
-                if idx < 0: continue
-
-                if vector_distance_threshold is not None and dist > vector_distance_threshold:
-                    continue
-
-                meta = metadata_list[idx] if isinstance(metadata_list, list) and idx < len(metadata_list) else {}
-                book, chapter = meta.get('book'), meta.get('chapter')
-                chunk_idx = meta.get('chunk_idx')
-                
-                unique_id = f"{book}_{chapter}_{chunk_idx}"
-                if unique_id in seen_ids:
-                    continue
-                seen_ids.add(unique_id)
-                
-                text = self._get_text_from_meta(meta, language)
-                if not text:
-                    text = meta.get('text_preview', '') + '...'
+            # Эмбеддинги уже нормализованы (_merge_embeddings)
+            queries = np.asarray(query_embeddings, dtype='float32')
+            if not queries.size: return []
+            queries = np.ascontiguousarray(queries.reshape(-1, queries.shape[-1]))
+            distances, indices_found = index.search(queries, top_k * 2)
+            hits = self._vector_candidates(
+                distances, indices_found, language, top_k, vector_distance_threshold, self._is_similarity(index)
+            )
+            order = np.argsort(-hits['score'], kind='stable')
+            _, first = np.unique(hits['group'][order], return_index=True)
+            return self._vector_results(hits, order[np.sort(first)], language)
+        except Exception as e:
+            logger.error(f"Ошибка при поиске по вектору ({language}): {e}", exc_info=True)
+            return []
 
-                results.append({
-                    'index': int(idx),
-                    'distance': float(dist),
-                    'score': float(1.0 / (1.0 + dist)),
-                    'text': text,
-                    'book': book, 
-                    'chapter': chapter, 
-                    'verse': None, 
-                    'chunk_idx': chunk_idx,
-                    'html_path': meta.get('html_path'),
-                    'source': 'vector'
-                })
-                
-                if len(results) >= top_k:
-                    break
+    def _search_by_vectors(self, query_embeddings: np.ndarray, language: str, top_k: int, vector_distance_threshold: float = None) -> List[List[Dict[str, Any]]]:
+        """Векторный поиск для матрицы независимых запросов одним вызовом index.search (результаты по строкам)."""
+        index = self.indices.get(language)
+        if not index or not len(query_embeddings): return [[] for _ in query_embeddings]
 
-            return results
+        try:
+            queries = np.ascontiguousarray(query_embeddings, dtype='float32').reshape(len(query_embeddings), -1)
+            distances, indices_found = index.search(queries, top_k * 2)
+            hits = self._vector_candidates(
+                distances, indices_found, language, top_k, vector_distance_threshold, self._is_similarity(index)
+            )
+            bounds = np.searchsorted(hits['row'], np.arange(len(queries) + 1))
+            return [
+                self._vector_results(hits, np.arange(bounds[row], bounds[row + 1]), language)
+                for row in range(len(queries))
+            ]
         except Exception as e:
             logger.error(f"Ошибка при поиске по вектору ({language}): {e}", exc_info=True)
-            return []
+            return [[] for _ in query_embeddings]
+
+    @staticmethod
+    def _is_similarity(index: faiss.Index) -> bool:
+        """True для индекса со скалярным произведением (FAISS возвращает косинусное сходство)."""
+        return getattr(index, 'metric_type', None) == faiss.METRIC_INNER_PRODUCT
+
+    def _chunk_groups(self, language: str, ids: np.ndarray) -> np.ndarray:
+        """Номер группы для каждого id строки FAISS: одинаковый у строк одного чанка (book, chapter, chunk_idx)."""
+        if not len(ids):
+            return np.empty(0, dtype=np.int64)
+        metadata_list = self.metadata.get(language, [])
+        records = getattr(metadata_list, 'records', None)
+        if records is not None:
+            # Бинарные метаданные: id строк книги и главы уникальны, сравниваем числа
+            triples = np.full((len(ids), 3), NO_VALUE - 1, dtype=np.int64)
+            known = ids < len(records)
+            triples[known] = records[ids[known]][:, [META_BOOK, META_CHAPTER, META_CHUNK_IDX]]
+            return np.unique(triples, axis=0, return_inverse=True)[1].reshape(-1)
+
+        groups = {}
+        keys = []
+        for idx in ids.tolist():
+            meta = metadata_list[idx] if idx < len(metadata_list) else {}
+            unique_id = f"{meta.get('book')}_{meta.get('chapter')}_{meta.get('chunk_idx')}"
+            keys.append(groups.setdefault(unique_id, len(groups)))
+        return np.array(keys, dtype=np.int64)
+
+    def _vector_candidates(self, distances: np.ndarray, indices_found: np.ndarray, language: str, top_k: int, vector_distance_threshold: float = None, similarity: bool = False) -> Dict[str, np.ndarray]:
+        """
+        Кандидаты из ответа FAISS (строка = запрос): без пустых id и строк за порогом,
+        без повторов чанка в строке, не больше top_k на строку. Массивы в порядке строк и рангов.
+
+        similarity=True: значения - косинусное сходство (индекс METRIC_INNER_PRODUCT).
+        Оно переводится в квадрат расстояния L2 (для нормализованных векторов
+        d = 2 - 2*cos), поэтому порог, расстояние и оценка 1/(1+d) одинаковы для
+        обеих метрик и результаты разных индексов сравнимы при language='all'.
+        """
+        ids = np.asarray(indices_found).reshape(-1)
+        dists = np.asarray(distances).reshape(-1)
+        if similarity:
+            dists = 2.0 - 2.0 * dists
+        rows = np.repeat(np.arange(len(np.asarray(indices_found))), np.asarray(indices_found).shape[-1])
+
+        valid = ids >= 0
+        if vector_distance_threshold is not None:
+            valid &= dists <= vector_distance_threshold
+        rows, ids, dists = rows[valid], ids[valid], dists[valid]
+        groups = self._chunk_groups(language, ids)
+
+        # Первое (лучшее) вхождение чанка в строке, затем top_k чанков на строку
+        _, first = np.unique(rows * (int(groups.max(initial=0)) + 1) + groups, return_index=True)
+        first.sort()
+        rows, ids, dists, groups = rows[first], ids[first], dists[first], groups[first]
+        rank = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+        keep = rank < top_k
+        rows, ids, dists, groups = rows[keep], ids[keep], dists[keep], groups[keep]
+
+        return {
+            'row': rows, 'id': ids, 'distance': dists, 'group': groups,
+            'score': 1.0 / (1.0 + dists)
+        }
+
+    def _vector_results(self, hits: Dict[str, np.ndarray], positions: np.ndarray, language: str) -> List[Dict[str, Any]]:
+        """Результаты векторного поиска для выбранных кандидатов (см. _vector_candidates)."""
+        results = []
+        metadata_list = self.metadata.get(language, [])
+
+        for pos in positions:
+            idx = int(hits['id'][pos])
+            dist = hits['distance'][pos]
+            meta = metadata_list[idx] if idx < len(metadata_list) else {}
+
+            text = self._get_chunk_text(idx, language)
+            if not text:
+                text = meta.get('text_preview', '') + '...'
+
+            results.append({
+                'index': idx,
+                'distance': float(dist),
+                'score': float(hits['score'][pos]),
+                'text': text,
+                'book': meta.get('book'), 
+                'chapter': meta.get('chapter'), 
+                'verse': None, 
+                'chunk_idx': meta.get('chunk_idx'),
+                'html_path': meta.get('html_path'),
+                'source': 'vector'
+            })
+
+        return results
 
     def _detect_verse_reference(self, query: str) -> Dict[str, Any]:
         """Пытается определить, что запрос — это ссылка на стих (БГ 2.1, ШБ 1.1.1, УГ 1.1)."""
@@ -550,60 +1352,320 @@ class RAGEngine:
         target_verse = ref['verse']
         
         logger.info(f"🎯 Exact Verse Search: Book={target_book}, Ch={target_chapter}, V={target_verse}")
-        
-        for idx, meta in enumerate(metadata_list):
-            # Сравниваем книгу (нечеткое сравнение если нужно, но здесь точное по ключу)
-            # Но ключи могут отличаться (bg vs Bhagavad-Gita). 
-            # Для стандартных книг ключи обычно короткие (bg, sb), для новых - длинные.
-            # Если target_book = 'Uddhava-Gita', ищем вхождение.
-            
-            meta_book = meta.get('book', '').lower()
-            if target_book.lower() not in meta_book and meta_book not in target_book.lower():
-                 continue
 
-            meta_chapter = str(meta.get('chapter', ''))
-            
-            def normalize_chapter(ch):
-                return '.'.join([p.lstrip('0') for p in str(ch).split('.')])
-            
-            if normalize_chapter(meta_chapter) == normalize_chapter(target_chapter):
-                text = self._get_text_from_meta(meta, language)
-                clean_text = text.lower()
-                
-                is_match = False
-                
-                # Эвристики для поиска номера стиха в тексте
-                indicators = [
-                    f"text {target_verse}", f"текст {target_verse}", 
-                    f"verse {target_verse}", f"стих {target_verse}",
-                    f"{target_verse}."
-                ]
-                
-                if any(ind in clean_text[:100] for ind in indicators):
-                     is_match = True
-                elif f"{target_verse}-" in clean_text[:20]: # 10-11
-                     is_match = True
-                elif clean_text.strip().startswith(target_verse):
-                     is_match = True
-
-                if is_match:
-                    logger.info(f"✅ Found exact verse at index {idx}")
-                    results.append({
-                        'index': int(idx),
-                        'distance': 0.0,
-                        'score': 100.0,
-                        'text': text,
-                        'book': meta.get('book'), 
-                        'chapter': meta_chapter, 
-                        'verse': target_verse, 
-                        'chunk_idx': meta.get('chunk_idx'),
-                        'html_path': meta.get('html_path'),
-                        'source': 'exact_verse',
-                        'is_study_guide': False # Стихи обычно из шастр
-                    })
+        verse_index = self.verse_indices.get(language)
+        if verse_index is not None:
+            matched_ids = verse_index.lookup(target_book, target_chapter, target_verse)
+        else:
+            matched_ids = self._scan_verse_in_metadata(ref, language)
+
+        for idx in matched_ids:
+            idx = int(idx)
+            meta = metadata_list[idx]
+            logger.info(f"✅ Found exact verse at index {idx}")
+            results.append({
+                'index': idx,
+                'distance': 0.0,
+                'score': 100.0,
+                'text': self._get_chunk_text(idx, language),
+                'book': meta.get('book'), 
+                'chapter': str(meta.get('chapter', '')), 
+                'verse': target_verse, 
+                'chunk_idx': meta.get('chunk_idx'),
+                'html_path': meta.get('html_path'),
+                'source': 'exact_verse',
+                'is_study_guide': False # Стихи обычно из шастр
+            })
         
         return results
 
+    def _scan_verse_in_metadata(self, ref: Dict[str, Any], language: str) -> List[int]:
+        """Полный просмотр метаданных (если индекс стихов не построен)."""
+        matched_ids = []
+        target_book = ref['book'].lower()
+        target_chapter = normalize_chapter(ref['chapter'])
+
+        for idx, meta in enumerate(self.metadata.get(language, [])):
+            # Ключи книг могут отличаться (bg vs Bhagavad-Gita): ищем вхождение
+            meta_book = (meta.get('book') or '').lower()
+            if target_book not in meta_book and meta_book not in target_book:
+                 continue
+
+            if normalize_chapter(meta.get('chapter', '')) == target_chapter:
+                if ref['verse'] in verse_candidates(self._get_chunk_text_lower(idx, language)):
+                    matched_ids.append(idx)
+
+        return matched_ids
+
+    def _timed(self, timings: Dict[str, Any], key: str, fn, *args):
+        """Выполняет стадию поиска и записывает ее длительность (мс) в timings."""
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            timings[key] = round((time.perf_counter() - start) * 1000, 2)
+
+    def _submit(self, fn, *args) -> Future:
+        """Запускает задачу в пуле потоков (или сразу, если параллельный режим выключен)."""
+        if self._executor is None:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self._executor.submit(fn, *args)
+
+    def _expand_query_variants(self, query: str, target_languages: List[str], expand_query: bool) -> Tuple[Dict[str, List[str]], List[str]]:
+        """Возвращает варианты запроса для каждого языка и общий список вариантов."""
+        all_query_variants = [query]
+        lang_query_variants = {}
+        for lang in target_languages:
+            lang_query_variants[lang] = [query]
+            if expand_query:
+                expander_method = getattr(QueryExpander, f'expand_query_{lang}', None)
+                if expander_method:
+                    variants = expander_method(query)
+                    all_query_variants.extend(variants)
+                    lang_query_variants[lang] = variants
+        return lang_query_variants, all_query_variants
+
+    def _retrieve(
+        self,
+        query: str,
+        target_languages: List[str],
+        top_k: int,
+        expand_query: bool,
+        vector_distance_threshold: float,
+        api_key: str,
+        timings: Dict[str, Any]
+    ) -> Dict[str, List]:
+        """
+        Запускает ретриверы (вектор, BM25, фраза) для всех языков.
+        Сетевой запрос эмбеддингов идет параллельно с BM25 и поиском фраз.
+        """
+        # 1. Расширение запроса для каждого языка
+        lang_query_variants, all_query_variants = self._expand_query_variants(query, target_languages, expand_query)
+
+        # 2. Эмбеддинги всех вариантов всех языков одним батч-запросом (в фоне)
+        unique_variants = self._unique_variants(lang_query_variants)
+        embedding_future = self._submit(self._timed, timings, 'embedding_ms', self._get_embedding, unique_variants, api_key)
+
+        # 3. BM25 и поиск фраз не ждут эмбеддингов
+        futures = self._submit_lexical(query, target_languages, top_k, timings)
+
+        # 4. Векторный поиск по вариантам каждого языка
+        embeddings = embedding_future.result()
+        self._submit_vector(
+            futures, lang_query_variants, dict(zip(unique_variants, embeddings)),
+            target_languages, top_k, vector_distance_threshold, timings
+        )
+        return self._collect_retrieved(futures, target_languages, all_query_variants, embeddings)
+
+    @staticmethod
+    def _unique_variants(lang_query_variants: Dict[str, List[str]]) -> List[str]:
+        return list(dict.fromkeys(v for variants in lang_query_variants.values() for v in variants))
+
+    def _submit_lexical(self, query: str, target_languages: List[str], top_k: int, timings: Dict[str, Any]) -> Dict[Tuple[str, str], Future]:
+        """Запускает BM25 и поиск фраз для каждого языка."""
+        futures = {}
+        for lang in target_languages:
+            lang_timings = timings.setdefault(lang, {})
+            if lang in self.bm25_indices:
+                futures[(lang, 'keyword')] = self._submit(
+                    self._timed, lang_timings, 'bm25_ms', self._search_by_keyword, query, lang, top_k * 2)
+            futures[(lang, 'simple_match')] = self._submit(
+                self._timed, lang_timings, 'phrase_ms', self._search_by_simple_match, query, lang, top_k * 2)
+        return futures
+
+    def _submit_vector(
+        self,
+        futures: Dict[Tuple[str, str], Future],
+        lang_query_variants: Dict[str, List[str]],
+        variant_embeddings: Dict[str, np.ndarray],
+        target_languages: List[str],
+        top_k: int,
+        vector_distance_threshold: float,
+        timings: Dict[str, Any]
+    ):
+        """Запускает векторный поиск по эмбеддингам вариантов запроса каждого языка."""
+        for lang in target_languages:
+            embeddings = [variant_embeddings[v] for v in lang_query_variants[lang] if v in variant_embeddings]
+            # Все варианты языка - одна матрица и один вызов index.search
+            futures[(lang, 'vector')] = self._submit(
+                self._timed, timings.setdefault(lang, {}), 'vector_ms', self._search_by_vector,
+                np.array(embeddings, dtype='float32'), lang, top_k * 2, vector_distance_threshold)
+
+    def _collect_retrieved(
+        self,
+        futures: Dict[Tuple[str, str], Future],
+        target_languages: List[str],
+        all_query_variants: List[str],
+        embeddings: np.ndarray = None
+    ) -> Dict[str, List]:
+        """Собирает результаты ретриверов в порядке языков, как при последовательном поиске."""
+        retrieved = {'vector': [], 'keyword': [], 'simple_match': [], 'query_variants': all_query_variants}
+        if embeddings is not None and self._embedding_failed(embeddings):
+            retrieved['embedding_failed'] = True
+        for lang in target_languages:
+            for kind in ('vector', 'keyword', 'simple_match'):
+                future = futures.get((lang, kind))
+                if future is not None:
+                    retrieved[kind].extend(future.result() or [])
+        return retrieved
+
+    def _fuse_results(self, retrieved: Dict[str, List], top_k: int) -> List[Dict[str, Any]]:
+        """Гибридное слияние результатов ретриверов (RRF) с приоритетом базовых книг."""
+        # ==================== PRIORITY RAG LAYER CONFIG ====================
+        # Книги, которые всегда должны быть в топе ("Core ISKCON Basics")
+        CORE_BOOKS = [
+             'Introductory-handbook-for-Krishna-Consciousness', # Normalized name
+             'Introductory_handbook_for_Krishna_Consciousness',
+             'Disciple-Course-SHB-5th-Edition',
+             'Disciple-Course-SHB-5th-Edition-March-2017'
+        ]
+        CORE_BOOST_MULTIPLIER = 3.0 
+        # ===================================================================
+
+        all_vector_results = retrieved['vector']
+        all_keyword_results = retrieved['keyword']
+        all_simple_match_results = retrieved['simple_match']
+
+        # Deduplicate vector results (by index AND language? No, index is per-language specific)
+        # We must be careful: index 10 in RU is different from index 10 in EN.
+        # We need a unique ID that includes language.
+        # My current implementation of `_search_by_...` returns 'book', 'chapter', etc.
+        # But 'index' is raw integer.
+        # RRF loop below uses `idx`. We need to make `idx` composite or unique.
+        # Let's Modify the results to have a unique key for RRF.
+
+        # Helper to make unique key
+        def make_unique_key(res):
+            # We don't have 'lang' in 'res' yet. We assume res are distinct objects.
+            # But RRF uses 'index'.
+            # Let's use (book, chapter, chunk_idx) as unique key which is stable across logic
+            return f"{res.get('book')}_{res.get('chapter')}_{res.get('chunk_idx')}"
+
+        # 6. Hybrid Fusion (RRF)
+        k_rrf = 60
+        combined_scores = {}
+
+        # Helper to check if book is CORE
+        def get_boost_multiplier(res_item):
+            book_name = res_item.get('book', '')
+            if any(cb.lower() in book_name.lower().replace('_', '-') for cb in CORE_BOOKS) or \
+               any(cb.lower() in book_name.lower().replace('-', '_') for cb in CORE_BOOKS):
+                logger.info(f"   🚀 BOOSTING CORE BOOK: {book_name}")
+                return CORE_BOOST_MULTIPLIER
+            return 1.0
+
+        # Process Vector Results
+        # Sort globally by score before RRF ranking? 
+        # Ideally RRF ranks per-system. Here we treat "Vector Search" as one system, regardless of language.
+        # So we sort all vector results by distance/score.
+        all_vector_results.sort(key=lambda x: x['score'], reverse=True)
+
+        # Remove duplicates based on unique content
+        seen_content = set()
+        unique_vector_results = []
+        for res in all_vector_results:
+            ukey = make_unique_key(res)
+            if ukey not in seen_content:
+                seen_content.add(ukey)
+                unique_vector_results.append(res)
+
+        for rank, res in enumerate(unique_vector_results[:top_k * 4]): # Consider more candidates
+            ukey = make_unique_key(res)
+            if ukey not in combined_scores:
+                combined_scores[ukey] = {'data': res, 'rrf_score': 0.0}
+
+            boost = get_boost_multiplier(res)
+            combined_scores[ukey]['rrf_score'] += (1.0 / (k_rrf + rank + 1)) * boost
+            combined_scores[ukey]['data']['vector_rank'] = rank + 1
+
+        # Process BM25 Results
+        all_keyword_results.sort(key=lambda x: x['score'], reverse=True)
+        for rank, res in enumerate(all_keyword_results[:top_k * 4]):
+            ukey = make_unique_key(res)
+            if ukey not in combined_scores:
+                combined_scores[ukey] = {'data': res, 'rrf_score': 0.0}
+
+            boost = get_boost_multiplier(res)
+            combined_scores[ukey]['rrf_score'] += (1.0 / (k_rrf + rank + 1)) * boost
+            combined_scores[ukey]['data']['keyword_rank'] = rank + 1
+
+        # Process Simple Match Results
+        all_simple_match_results.sort(key=lambda x: x['score'], reverse=True)
+        for rank, res in enumerate(all_simple_match_results[:top_k * 4]):
+            ukey = make_unique_key(res)
+            if ukey not in combined_scores:
+                combined_scores[ukey] = {'data': res, 'rrf_score': 0.0}
+
+            boost = get_boost_multiplier(res)
+            combined_scores[ukey]['rrf_score'] += (1.0 / (k_rrf + rank + 1)) * boost
+            combined_scores[ukey]['data']['simple_match_rank'] = rank + 1
+
+        # Sort by RRF score
+        hybrid_results = sorted(combined_scores.values(), key=lambda x: x['rrf_score'], reverse=True)
+
+        # Extract top_k
+        final_candidates = []
+        for item in hybrid_results[:top_k]:
+            res = item['data']
+            res['score'] = item['rrf_score']
+            final_candidates.append(res)
+        return final_candidates
+
+    def _rerank_candidates(self, query: str, final_candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Переранжирует кандидатов cross-encoder моделью (при ошибке - исходный порядок)."""
+        return self._rerank_candidates_many([query], [final_candidates])[0]
+
+    def _rerank_candidates_many(self, queries: List[str], candidate_lists: List[List[Dict[str, Any]]]) -> List[List[Dict[str, Any]]]:
+        """Переранжирование кандидатов нескольких запросов одним прогоном cross-encoder."""
+        try:
+            logger.info("⏳ Starting Re-ranking process...")
+            requests, plans = [], []
+            for query, final_candidates in zip(queries, candidate_lists):
+                docs_to_rerank = []
+                indices_to_rerank = []
+                final_results = []
+
+                for i, res in enumerate(final_candidates):
+                    if res['score'] > 50.0: # High confidence exact match
+                        res['final_score'] = 1.0
+                        final_results.append(res)
+                    else:
+                        docs_to_rerank.append(res['text'])
+                        indices_to_rerank.append(i)
+                plans.append((final_candidates, indices_to_rerank, final_results))
+                requests.append((query, docs_to_rerank))
+
+            total_docs = sum(len(docs) for _, docs in requests)
+            if total_docs:
+                logger.info(f"   Reranking {total_docs} documents...")
+            reranked = self.reranker.rerank_many(requests)
+
+            all_results = []
+            for (final_candidates, indices_to_rerank, final_results), reranked_tuples in zip(plans, reranked):
+                if indices_to_rerank:
+                    for original_idx_in_subset, score, text in reranked_tuples:
+                        original_idx = indices_to_rerank[original_idx_in_subset]
+                        original_result = final_candidates[original_idx]
+                        original_result['final_score'] = float(score)
+                        final_results.append(original_result)
+                else:
+                    final_results.extend([res for res in final_candidates if 'final_score' not in res])
+
+                # Sort final results by final_score
+                final_results.sort(key=lambda x: x.get('final_score', 0), reverse=True)
+                all_results.append(final_results)
+            logger.info("✅ Re-ranking finished successfully.")
+            return all_results
+
+        except Exception as e:
+            logger.error(f"❌ Re-ranking failed (using standard results): {e}")
+            return candidate_lists
+
     def search(
         self, 
         query: str, 
@@ -617,225 +1679,361 @@ class RAGEngine:
         """
         Основной метод поиска.
         Объединяет: Exact Verse + Vector Search + BM25 + Simple Keyword Search
+        В ответе 'timings' - длительность каждой стадии в миллисекундах.
         """
-        # ==================== PRIORITY RAG LAYER CONFIG ====================
-        # Книги, которые всегда должны быть в топе ("Core ISKCON Basics")
-        CORE_BOOKS = [
-             'Introductory-handbook-for-Krishna-Consciousness', # Normalized name
-             'Introductory_handbook_for_Krishna_Consciousness',
-             'Disciple-Course-SHB-5th-Edition',
-             'Disciple-Course-SHB-5th-Edition-March-2017'
-        ]
-        CORE_BOOST_MULTIPLIER = 3.0 
-        # ===================================================================
-
         logger.info(f"🔍 Поиск: '{query}' (lang={language}, top_k={top_k})")
         
-        target_languages = []
-        if language == 'all':
-            target_languages = list(self.indices.keys())
-        else:
-            if language in self.indices:
-                target_languages = [language]
-            else:
-                return {'success': False, 'error': f'Индекс для языка {language} не загружен.'}
+        target_languages = self._target_languages(language)
+        if target_languages is None:
+            return {'success': False, 'error': f'Индекс для языка {language} не загружен.'}
 
+        timings = {}
+        search_start = time.perf_counter()
         try:
-            all_exact_results = []
-            all_vector_results = []
-            all_keyword_results = []
-            all_simple_match_results = []
-            all_query_variants = [query]
+            # Точная ссылка на стих (БГ 2.12) ищется по индексу стихов до гибридного поиска
+            all_exact_results = self._search_exact(query, target_languages, timings)
+            if all_exact_results:
+                return self._exact_response(query, all_exact_results, timings, search_start)
 
-            # --- SEARCH IN EACH LANGUAGE ---
-            for lang in target_languages:
-                # 0. Проверка на точный стих
-                verse_ref = self._detect_verse_reference(query)
-                if verse_ref:
-                    exact_res = self._find_verse_in_metadata(verse_ref, lang)
-                    if exact_res:
-                        all_exact_results.extend(exact_res)
-
-                # 1. Расширение запроса
-                if expand_query:
-                    expander_method = getattr(QueryExpander, f'expand_query_{lang}', None)
-                    if expander_method:
-                        variants = expander_method(query)
-                        all_query_variants.extend(variants)
-
-                # 2. Получение эмбеддингов и Векторный поиск
-                # Используем варианты для текущего языка + оригинал
-                # (Можно оптимизировать и эмбеддить один раз для всех вариантов, но пока так)
-                lang_query_variants = [query]
-                if expand_query and getattr(QueryExpander, f'expand_query_{lang}', None):
-                     lang_query_variants = getattr(QueryExpander, f'expand_query_{lang}')(query)
-                
-                variant_embeddings = self._get_embedding(lang_query_variants, api_key=api_key)
-                
-                for idx, emb in enumerate(variant_embeddings):
-                    vec_res = self._search_by_vector(emb, lang, top_k * 2, vector_distance_threshold)
-                    all_vector_results.extend(vec_res)
-
-                # 4. Keyword Search (BM25)
-                if lang in self.bm25_indices:
-                    kw_res = self._search_by_keyword(query, lang, top_k * 2)
-                    all_keyword_results.extend(kw_res)
-
-                # 5. Simple Exact Phrase Search
-                sm_res = self._search_by_simple_match(query, lang, top_k * 2)
-                all_simple_match_results.extend(sm_res)
-
-            # Если нашли точные стихи, возвращаем их сразу (если их достаточно?)
-            # Но пользователь может хотеть мульти-язычный ответ. 
-            # Если reference, то вернем что нашли.
+            retrieved = self._retrieve(
+                query, target_languages, top_k, expand_query, vector_distance_threshold, api_key, timings
+            )
+            return self._finish_search(query, retrieved, top_k, use_reranking, timings, search_start, target_languages)
+        
+        except Exception as e:
+            logger.error(f"❌ Критическая ошибка при поиске: {e}", exc_info=True)
+            return {'success': False, 'error': str(e), 'query': query}
+
+    async def search_async(
+        self,
+        query: str,
+        language: str = 'ru',
+        top_k: int = 5,
+        use_reranking: bool = True,
+        expand_query: bool = True,
+        vector_distance_threshold: float = None,
+        api_key: str = None
+    ) -> Dict[str, Any]:
+        """
+        Асинхронный вариант search() с тем же результатом.
+        Запрос эмбеддингов выполняется через embed_content_async (поток не блокируется
+        на сети), загрузка языка (lazy_loading), расширение запроса, поиск по индексам
+        и re-ranking - в пуле потоков движка.
+        """
+        logger.info(f"🔍 Поиск (async): '{query}' (lang={language}, top_k={top_k})")
+
+        loop = asyncio.get_running_loop()
+        target_languages = await loop.run_in_executor(self._executor, self._target_languages, language)
+        if target_languages is None:
+            return {'success': False, 'error': f'Индекс для языка {language} не загружен.'}
+
+        timings = {}
+        search_start = time.perf_counter()
+        try:
+            all_exact_results = await loop.run_in_executor(
+                self._executor, self._search_exact, query, target_languages, timings
+            )
             if all_exact_results:
-                logger.info(f"🎉 Найдены точные совпадения стихов: {len(all_exact_results)}")
-                return {
-                    'success': True,
-                    'results': all_exact_results,
-                    'query': query,
-                    'search_type': 'exact_verse_reference',
-                    'count': len(all_exact_results)
-                }
+                return self._exact_response(query, all_exact_results, timings, search_start)
 
-            # Deduplicate variants
-            all_query_variants = list(set(all_query_variants))
-            logger.info(f"   📋 Варианты запроса (combined): {all_query_variants}")
-
-            # Deduplicate vector results (by index AND language? No, index is per-language specific)
-            # We must be careful: index 10 in RU is different from index 10 in EN.
-            # We need a unique ID that includes language.
-            # My current implementation of `_search_by_...` returns 'book', 'chapter', etc.
-            # But 'index' is raw integer.
-            # RRF loop below uses `idx`. We need to make `idx` composite or unique.
-            # Let's Modify the results to have a unique key for RRF.
-            
-            # Helper to make unique key
-            def make_unique_key(res):
-                # We don't have 'lang' in 'res' yet. We assume res are distinct objects.
-                # But RRF uses 'index'.
-                # Let's use (book, chapter, chunk_idx) as unique key which is stable across logic
-                return f"{res.get('book')}_{res.get('chapter')}_{res.get('chunk_idx')}"
-
-            # 6. Hybrid Fusion (RRF)
-            k_rrf = 60
-            combined_scores = {}
-            
-            # Helper to check if book is CORE
-            def get_boost_multiplier(res_item):
-                book_name = res_item.get('book', '')
-                if any(cb.lower() in book_name.lower().replace('_', '-') for cb in CORE_BOOKS) or \
-                   any(cb.lower() in book_name.lower().replace('-', '_') for cb in CORE_BOOKS):
-                    logger.info(f"   🚀 BOOSTING CORE BOOK: {book_name}")
-                    return CORE_BOOST_MULTIPLIER
-                return 1.0
-
-            # Process Vector Results
-            # Sort globally by score before RRF ranking? 
-            # Ideally RRF ranks per-system. Here we treat "Vector Search" as one system, regardless of language.
-            # So we sort all vector results by distance/score.
-            all_vector_results.sort(key=lambda x: x['score'], reverse=True)
-            
-            # Remove duplicates based on unique content
-            seen_content = set()
-            unique_vector_results = []
-            for res in all_vector_results:
-                ukey = make_unique_key(res)
-                if ukey not in seen_content:
-                    seen_content.add(ukey)
-                    unique_vector_results.append(res)
-            
-            for rank, res in enumerate(unique_vector_results[:top_k * 4]): # Consider more candidates
-                ukey = make_unique_key(res)
-                if ukey not in combined_scores:
-                    combined_scores[ukey] = {'data': res, 'rrf_score': 0.0}
-                
-                boost = get_boost_multiplier(res)
-                combined_scores[ukey]['rrf_score'] += (1.0 / (k_rrf + rank + 1)) * boost
-                combined_scores[ukey]['data']['vector_rank'] = rank + 1
-
-            # Process BM25 Results
-            all_keyword_results.sort(key=lambda x: x['score'], reverse=True)
-            for rank, res in enumerate(all_keyword_results[:top_k * 4]):
-                ukey = make_unique_key(res)
-                if ukey not in combined_scores:
-                    combined_scores[ukey] = {'data': res, 'rrf_score': 0.0}
-                
-                boost = get_boost_multiplier(res)
-                combined_scores[ukey]['rrf_score'] += (1.0 / (k_rrf + rank + 1)) * boost
-                combined_scores[ukey]['data']['keyword_rank'] = rank + 1
-
-            # Process Simple Match Results
-            all_simple_match_results.sort(key=lambda x: x['score'], reverse=True)
-            for rank, res in enumerate(all_simple_match_results[:top_k * 4]):
-                ukey = make_unique_key(res)
-                if ukey not in combined_scores:
-                    combined_scores[ukey] = {'data': res, 'rrf_score': 0.0}
-                
-                boost = get_boost_multiplier(res)
-                combined_scores[ukey]['rrf_score'] += (1.0 / (k_rrf + rank + 1)) * boost
-                combined_scores[ukey]['data']['simple_match_rank'] = rank + 1
+            lang_query_variants, all_query_variants = await loop.run_in_executor(
+                self._executor, self._expand_query_variants, query, target_languages, expand_query
+            )
+            unique_variants = self._unique_variants(lang_query_variants)
+            embedding_task = asyncio.ensure_future(self._timed_async(
+                timings, 'embedding_ms', self._get_embedding_async(unique_variants, api_key)
+            ))
 
-            # Sort by RRF score
-            hybrid_results = sorted(combined_scores.values(), key=lambda x: x['rrf_score'], reverse=True)
-            
-            # Extract top_k
-            final_candidates = []
-            for item in hybrid_results[:top_k]:
-                res = item['data']
-                res['score'] = item['rrf_score']
-                final_candidates.append(res)
-            
-            logger.info(f"   🤝 Гибридный поиск: объединено {len(final_candidates)} результатов")
-
-            # 7. Переранжирование (Re-ranking)
-            if use_reranking and self.reranker.model:
-                try:
-                    logger.info("⏳ Starting Re-ranking process...")
-                    docs_to_rerank = []
-                    indices_to_rerank = []
-                    final_results = []
-                    
-                    for i, res in enumerate(final_candidates):
-                        if res['score'] > 50.0: # High confidence exact match
-                            res['final_score'] = 1.0
-                            final_results.append(res)
-                        else:
-                            docs_to_rerank.append(res['text'])
-                            indices_to_rerank.append(i)
-                    
-                    if docs_to_rerank:
-                        logger.info(f"   Reranking {len(docs_to_rerank)} documents...")
-                        reranked_tuples = self.reranker.rerank(query, docs_to_rerank, len(docs_to_rerank))
-                        
-                        for original_idx_in_subset, score, text in reranked_tuples:
-                            original_idx = indices_to_rerank[original_idx_in_subset]
-                            original_result = final_candidates[original_idx]
-                            original_result['final_score'] = float(score)
-                            final_results.append(original_result)
-                    else:
-                        final_results.extend([res for res in final_candidates if 'final_score' not in res])
-                    
-                    # Sort final results by final_score
-                    final_results.sort(key=lambda x: x.get('final_score', 0), reverse=True)
-                    logger.info("✅ Re-ranking finished successfully.")
+            futures = self._submit_lexical(query, target_languages, top_k, timings)
+            embeddings = await embedding_task
+            self._submit_vector(
+                futures, lang_query_variants, dict(zip(unique_variants, embeddings)),
+                target_languages, top_k, vector_distance_threshold, timings
+            )
+            await asyncio.gather(*(asyncio.wrap_future(f) for f in futures.values()))
+            retrieved = self._collect_retrieved(futures, target_languages, all_query_variants, embeddings)
+
+            return await loop.run_in_executor(
+                self._executor, self._finish_search, query, retrieved, top_k, use_reranking, timings, search_start,
+                target_languages
+            )
+
+        except Exception as e:
+            logger.error(f"❌ Критическая ошибка при поиске: {e}", exc_info=True)
+            return {'success': False, 'error': str(e), 'query': query}
+
+    def search_stream(
+        self,
+        query: str,
+        language: str = 'ru',
+        top_k: int = 5,
+        use_reranking: bool = True,
+        expand_query: bool = True,
+        vector_distance_threshold: float = None,
+        api_key: str = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Поиск с промежуточными результатами (для потоковой выдачи клиенту).
+
+        Стадии по мере готовности:
+            'exact'   - точные совпадения по ссылке на стих (сразу за ним 'final')
+            'lexical' - результаты BM25 и поиска фраз (не ждут эмбеддингов)
+            'fused'   - гибридный список после RRF
+            'final'   - ответ в формате search() (после re-ranking)
+        В каждой стадии 'elapsed_ms' - время от начала поиска.
+        """
+        target_languages = self._target_languages(language)
+        if target_languages is None:
+            yield {'stage': 'final', 'success': False, 'error': f'Индекс для языка {language} не загружен.'}
+            return
+
+        timings = {}
+        search_start = time.perf_counter()
+
+        def elapsed():
+            return round((time.perf_counter() - search_start) * 1000, 2)
+
+        try:
+            all_exact_results = self._search_exact(query, target_languages, timings)
+            if all_exact_results:
+                yield {'stage': 'exact', 'results': all_exact_results, 'elapsed_ms': elapsed()}
+                yield dict(self._exact_response(query, all_exact_results, timings, search_start), stage='final')
+                return
+
+            lang_query_variants, all_query_variants = self._expand_query_variants(query, target_languages, expand_query)
+            unique_variants = self._unique_variants(lang_query_variants)
+            embedding_future = self._submit(self._timed, timings, 'embedding_ms', self._get_embedding, unique_variants, api_key)
+            futures = self._submit_lexical(query, target_languages, top_k, timings)
 
-                except Exception as e:
-                    logger.error(f"❌ Re-ranking failed (using standard results): {e}")
-                    final_results = final_candidates
+            # Копии: следующие стадии дополняют результаты рангами и оценками
+            lexical = {'keyword': [], 'simple_match': []}
+            for lang in target_languages:
+                for kind in lexical:
+                    future = futures.get((lang, kind))
+                    if future is not None:
+                        lexical[kind].extend(dict(r) for r in future.result() or [])
+            yield {'stage': 'lexical', **lexical, 'elapsed_ms': elapsed()}
+
+            embeddings = embedding_future.result()
+            self._submit_vector(
+                futures, lang_query_variants, dict(zip(unique_variants, embeddings)),
+                target_languages, top_k, vector_distance_threshold, timings
+            )
+            retrieved = self._collect_retrieved(futures, target_languages, all_query_variants, embeddings)
+            final_candidates = self._timed(timings, 'fusion_ms', self._fuse_results, retrieved, top_k)
+            yield {'stage': 'fused', 'results': [dict(r) for r in final_candidates], 'elapsed_ms': elapsed()}
+
+            if use_reranking and self.reranker_ready:
+                final_results = self._timed(timings, 'rerank_ms', self._rerank_candidates, query, final_candidates)
             else:
                 final_results = final_candidates
-
-            return {
+            timings['total_ms'] = elapsed()
+            yield self._mark_degraded({
+                'stage': 'final',
                 'success': True,
                 'results': final_results,
-                'query_variants': all_query_variants,
-                'count': len(final_results)
-            }
-        
+                'query_variants': list(set(all_query_variants)),
+                'count': len(final_results),
+                'timings': timings
+            }, use_reranking, target_languages, retrieved.get('embedding_failed', False))
+
         except Exception as e:
             logger.error(f"❌ Критическая ошибка при поиске: {e}", exc_info=True)
-            return {'success': False, 'error': str(e), 'query': query}
+            yield {'stage': 'final', 'success': False, 'error': str(e), 'query': query}
+
+    def search_batch(
+        self,
+        queries: List[str],
+        language: str = 'ru',
+        top_k: int = 5,
+        use_reranking: bool = True,
+        expand_query: bool = True,
+        vector_distance_threshold: float = None,
+        api_key: str = None
+    ) -> Dict[str, Any]:
+        """
+        Поиск по пакету запросов. Результат для каждого запроса такой же, как у search(),
+        но стадии выполняются для всего пакета сразу: эмбеддинги всех вариантов -
+        одним батч-запросом, FAISS - одним index.search на язык, BM25 - с общими
+        оценками терминов, re-ranking - общим прогоном cross-encoder.
+
+        Returns:
+            {'success', 'responses': [ответ search() для каждого запроса], 'count', 'timings'}
+        """
+        logger.info(f"🔍 Пакетный поиск: {len(queries)} запросов (lang={language}, top_k={top_k})")
+
+        target_languages = self._target_languages(language)
+        if target_languages is None:
+            return {'success': False, 'error': f'Индекс для языка {language} не загружен.'}
+
+        timings = {}
+        search_start = time.perf_counter()
+        embedding_failed = False
+        try:
+            responses = [None] * len(queries)
+
+            # 1. Точные ссылки на стихи отвечаются сразу
+            pending = []
+            for n, query in enumerate(queries):
+                exact = self._search_exact(query, target_languages, timings)
+                if exact:
+                    responses[n] = self._exact_response(query, exact, {}, search_start)
+                else:
+                    pending.append(n)
+
+            if pending:
+                pending_queries = [queries[n] for n in pending]
+                expanded = [self._expand_query_variants(q, target_languages, expand_query) for q in pending_queries]
+
+                # 2. Эмбеддинги вариантов всех запросов - один батч-запрос
+                unique_variants = list(dict.fromkeys(
+                    v for lang_variants, _ in expanded for v in self._unique_variants(lang_variants)
+                ))
+                embedding_future = self._submit(
+                    self._timed, timings, 'embedding_ms', self._get_embedding, unique_variants, api_key
+                )
+
+                # 3. BM25 пакетом и поиск фраз по каждому языку, не дожидаясь эмбеддингов
+                futures = {}
+                for lang in target_languages:
+                    lang_timings = timings.setdefault(lang, {})
+                    futures[(lang, 'keyword')] = self._submit(
+                        self._timed, lang_timings, 'bm25_ms', self._search_by_keyword_many,
+                        pending_queries, lang, top_k * 2)
+                    futures[(lang, 'simple_match')] = self._submit(
+                        self._timed, lang_timings, 'phrase_ms', self._search_by_simple_match_many,
+                        pending_queries, lang, top_k * 2)
+
+                # 4. Векторный поиск: все варианты всех запросов языка - одной матрицей
+                variant_rows = {v: i for i, v in enumerate(unique_variants)}
+                embeddings = embedding_future.result()
+                embedding_failed = self._embedding_failed(embeddings)
+                for lang in target_languages:
+                    rows = [variant_rows[v] for lang_variants, _ in expanded for v in lang_variants[lang]]
+                    futures[(lang, 'vector')] = self._submit(
+                        self._timed, timings[lang], 'vector_ms', self._search_by_vectors,
+                        embeddings[rows], lang, top_k * 2, vector_distance_threshold)
+
+                # 5. Результаты ретриверов каждого запроса в порядке языков (как в search)
+                retrieved = [
+                    {'vector': [], 'keyword': [], 'simple_match': [], 'query_variants': all_variants}
+                    for _, all_variants in expanded
+                ]
+                for lang in target_languages:
+                    vector_rows = iter(futures[(lang, 'vector')].result())
+                    keyword = futures[(lang, 'keyword')].result()
+                    simple_match = futures[(lang, 'simple_match')].result()
+                    for i, (lang_variants, _) in enumerate(expanded):
+                        for _ in lang_variants[lang]:
+                            retrieved[i]['vector'].extend(next(vector_rows))
+                        if lang in self.bm25_indices:
+                            retrieved[i]['keyword'].extend(keyword[i])
+                        retrieved[i]['simple_match'].extend(simple_match[i] or [])
+
+                # 6. RRF для каждого запроса, затем общий re-ranking
+                fusion_start = time.perf_counter()
+                candidates = [self._fuse_results(r, top_k) for r in retrieved]
+                timings['fusion_ms'] = round((time.perf_counter() - fusion_start) * 1000, 2)
+
+                if use_reranking and self.reranker_ready:
+                    candidates = self._timed(
+                        timings, 'rerank_ms', self._rerank_candidates_many, pending_queries, candidates
+                    )
+
+                for n, r, final_results in zip(pending, retrieved, candidates):
+                    responses[n] = {
+                        'success': True,
+                        'results': final_results,
+                        'query_variants': list(set(r['query_variants'])),
+                        'count': len(final_results)
+                    }
+
+            timings['total_ms'] = round((time.perf_counter() - search_start) * 1000, 2)
+            return self._mark_degraded(
+                {'success': True, 'responses': responses, 'count': len(responses), 'timings': timings},
+                use_reranking, target_languages, embedding_failed
+            )
+
+        except Exception as e:
+            logger.error(f"❌ Критическая ошибка при пакетном поиске: {e}", exc_info=True)
+            return {'success': False, 'error': str(e)}
+
+    async def _timed_async(self, timings: Dict[str, Any], key: str, coro):
+        """Ожидает корутину стадии поиска и записывает ее длительность (мс) в timings."""
+        start = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            timings[key] = round((time.perf_counter() - start) * 1000, 2)
+
+    def _target_languages(self, language: str) -> Optional[List[str]]:
+        """Языки поиска ('all' - все доступные); None, если индекс языка не загружен."""
+        if language == 'all':
+            available = [lang for lang in self.languages if self.load_language(lang)]
+            return available + [lang for lang in self.indices if lang not in self.languages]
+        if self.load_language(language):
+            return [language]
+        return None
+
+    def _search_exact(self, query: str, target_languages: List[str], timings: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Поиск по точной ссылке на стих во всех языках."""
+        all_exact_results = []
+        verse_ref = self._detect_verse_reference(query)
+        if verse_ref:
+            for lang in target_languages:
+                all_exact_results.extend(self._timed(
+                    timings.setdefault(lang, {}), 'verse_ms', self._find_verse_in_metadata, verse_ref, lang
+                ))
+        return all_exact_results
+
+    def _exact_response(self, query: str, all_exact_results: List[Dict[str, Any]], timings: Dict[str, Any], search_start: float) -> Dict[str, Any]:
+        # Если нашли точные стихи, возвращаем их сразу (если их достаточно?)
+        # Но пользователь может хотеть мульти-язычный ответ. 
+        # Если reference, то вернем что нашли.
+        logger.info(f"🎉 Найдены точные совпадения стихов: {len(all_exact_results)}")
+        timings['total_ms'] = round((time.perf_counter() - search_start) * 1000, 2)
+        return {
+            'success': True,
+            'results': all_exact_results,
+            'query': query,
+            'search_type': 'exact_verse_reference',
+            'count': len(all_exact_results),
+            'timings': timings
+        }
+
+    def _finish_search(
+        self,
+        query: str,
+        retrieved: Dict[str, List],
+        top_k: int,
+        use_reranking: bool,
+        timings: Dict[str, Any],
+        search_start: float,
+        target_languages: List[str] = ()
+    ) -> Dict[str, Any]:
+        """Слияние результатов ретриверов (RRF), re-ranking и ответ поиска."""
+        # Deduplicate variants
+        all_query_variants = list(set(retrieved['query_variants']))
+        logger.info(f"   📋 Варианты запроса (combined): {all_query_variants}")
+
+        # 6. Hybrid Fusion (RRF)
+        final_candidates = self._timed(timings, 'fusion_ms', self._fuse_results, retrieved, top_k)
+        logger.info(f"   🤝 Гибридный поиск: объединено {len(final_candidates)} результатов")
+
+        # 7. Переранжирование (Re-ranking)
+        if use_reranking and self.reranker_ready:
+            final_results = self._timed(timings, 'rerank_ms', self._rerank_candidates, query, final_candidates)
+        else:
+            final_results = final_candidates
+
+        timings['total_ms'] = round((time.perf_counter() - search_start) * 1000, 2)
+        return self._mark_degraded({
+            'success': True,
+            'results': final_results,
+            'query_variants': all_query_variants,
+            'count': len(final_results),
+            'timings': timings
+        }, use_reranking, target_languages, retrieved.get('embedding_failed', False))
 
     def keyword_search(self, query: str, language: str = 'en', case_sensitive: bool = False) -> Dict[str, Any]:
         """
@@ -844,7 +2042,7 @@ class RAGEngine:
         """
         logger.info(f"🔍 Standalone Keyword search: '{query}'")
         
-        if language not in self.languages:
+        if language not in self.languages or not self.load_language(language):
             return {'success': False, 'error': f'Language {language} not supported'}
         
         # Используем внутренний метод, если регистр не важен
@@ -861,8 +2059,8 @@ class RAGEngine:
         # Если нужен case_sensitive, идем старым путем
         metadata = self.metadata[language]
         results = []
-        for item in metadata:
-            text = self._get_text_from_meta(item, language)
+        for idx, item in enumerate(metadata):
+            text = self._get_chunk_text(idx, language)
             if query in text:
                 results.append({
                     'text': text,
@@ -1,3 +1,4 @@
+import argparse
 import sys
 import os
 import logging
@@ -11,7 +12,8 @@ from rag.rag_engine import RAGEngine
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def rebuild():
+def rebuild(workers: int = None):
+    """Перестраивает индексы BM25; workers - процессы для токенизации (None - по числу ядер)."""
     print("="*70)
     print("BM25 INDEX REBUILDER")
     print("="*70)
@@ -22,20 +24,25 @@ def rebuild():
     # Define languages to process
     langs = ['ru', 'en']
     
-    # Delete old pkl files to force rebuild
+    # Delete old index files (and legacy pkl) to force rebuild
     for lang in langs:
-        pkl_path = os.path.join(base_dir, f"bm25_index_{lang}.pkl")
-        if os.path.exists(pkl_path):
-            print(f"Removing old BM25 index: {pkl_path}")
-            os.remove(pkl_path)
+        for name in (f"bm25_index_{lang}.bin", f"bm25_index_{lang}.pkl"):
+            index_path = os.path.join(base_dir, name)
+            if os.path.exists(index_path):
+                print(f"Removing old BM25 index: {index_path}")
+                os.remove(index_path)
 
     # Initialize RAGEngine. It will build BM25 indices automatically if they are missing.
     print("\nInitializing RAGEngine to trigger BM25 build...")
-    engine = RAGEngine(base_dir=base_dir, languages=langs)
+    engine = RAGEngine(base_dir=base_dir, languages=langs, bm25_workers=workers or 0)
     
     print("\n" + "="*70)
     print("BM25 REBUILD COMPLETED!")
     print("="*70)
 
 if __name__ == "__main__":
-    rebuild()
+    parser = argparse.ArgumentParser(description="Rebuild BM25 keyword indices")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes for corpus tokenization (default: CPU count, 1 = no pool)")
+    args = parser.parse_args()
+    rebuild(workers=args.workers)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+⚡ RE-RANKING ЧЕРЕЗ ONNX RUNTIME (INT8)
+
+Альтернативный бэкенд RerankerModel для CPU. При первом запуске модель
+экспортируется в ONNX, веса квантуются в int8 (dynamic quantization),
+после чего выполняется сверка оценок с исходной torch-моделью. Если
+расхождение больше PARITY_TOLERANCE, используется неквантованный ONNX.
+
+Файлы (в cache_dir):
+    model.onnx, model_int8.onnx - экспортированная модель
+    manifest.json               - имя модели, выбранный файл, результат сверки
+    tokenizer files             - копия токенизатора для оффлайн работы
+
+Требует пакеты onnxruntime и onnx (requirements.txt).
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+try:
+    import onnxruntime as ort
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+except ImportError:
+    ort = None
+
+try:
+    from rag.rag_engine import RerankerModel
+except ImportError:
+    from rag_engine import RerankerModel
+
+logger = logging.getLogger(__name__)
+
+ONNX_OPSET = 17
+MANIFEST_VERSION = 1
+PARITY_TOLERANCE = 0.1  # Максимальная разница логитов int8 и torch
+
+# Пары для сверки оценок ONNX и torch после экспорта
+PARITY_PAIRS = [
+    ("What is the soul?", "The soul is eternal, it is never born and never dies."),
+    ("Что такое душа?", "Душа вечна: она не рождается и не умирает."),
+    ("Кто такой Кришна?", "Кришна - Верховная Личность Бога, источник всех воплощений."),
+    ("karma yoga", "One who performs his duty without attachment attains the Supreme."),
+    ("преданное служение", "Рецепт приготовления овощного супа с картофелем."),
+]
+
+
+class _LogitsModule(torch.nn.Module):
+    """Обертка для экспорта: (input_ids, attention_mask) -> logits"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+
+def _create_session(model_file: Path, intra_op_threads: Optional[int] = None):
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = intra_op_threads or default_intra_op_threads()
+    options.inter_op_num_threads = 1
+    return ort.InferenceSession(str(model_file), options, providers=['CPUExecutionProvider'])
+
+
+def default_intra_op_threads() -> int:
+    """Число потоков для матричных операций: физические ядра (оценка - половина логических)."""
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def _run_session(session, tokenizer, pairs: List[List[str]]) -> np.ndarray:
+    inputs = tokenizer(pairs, padding=True, truncation=True, return_tensors="np", max_length=512)
+    input_names = {i.name for i in session.get_inputs()}
+    feed = {name: np.asarray(value, dtype=np.int64) for name, value in inputs.items() if name in input_names}
+    return session.run(None, feed)[0].reshape(-1)
+
+
+def check_parity(torch_model, tokenizer, session, pairs: List[Tuple[str, str]] = PARITY_PAIRS) -> float:
+    """Максимальная разница логитов ONNX и torch на контрольных парах."""
+    pairs = [list(p) for p in pairs]
+    with torch.no_grad():
+        inputs = tokenizer(pairs, padding=True, truncation=True, return_tensors="pt", max_length=512)
+        expected = torch_model(**inputs, return_dict=True).logits.reshape(-1).numpy()
+    actual = _run_session(session, tokenizer, pairs)
+    return float(np.max(np.abs(expected - actual)))
+
+
+def export_reranker(model_name: str, output_dir: Path, quantize: bool = True) -> dict:
+    """
+    Экспортирует cross-encoder в ONNX и (опционально) квантует в int8.
+
+    Returns:
+        манифест экспорта (также сохраняется в output_dir/manifest.json)
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    logger.info(f"⏳ Экспортирую модель re-ranking в ONNX: {model_name}")
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+    model = AutoModelForSequenceClassification.from_pretrained(
+        model_name, trust_remote_code=True, torch_dtype=torch.float32
+    )
+    model.eval()
+
+    sample = tokenizer([list(p) for p in PARITY_PAIRS[:2]], padding=True, return_tensors="pt")
+    fp32_file = output_dir / "model.onnx"
+    with torch.no_grad():
+        torch.onnx.export(
+            _LogitsModule(model).eval(),
+            (sample['input_ids'], sample['attention_mask']),
+            str(fp32_file),
+            input_names=['input_ids', 'attention_mask'],
+            output_names=['logits'],
+            dynamic_axes={
+                'input_ids': {0: 'batch', 1: 'sequence'},
+                'attention_mask': {0: 'batch', 1: 'sequence'},
+                'logits': {0: 'batch'}
+            },
+            opset_version=ONNX_OPSET,
+            dynamo=False
+        )
+
+    model_file = fp32_file
+    parity = check_parity(model, tokenizer, _create_session(fp32_file))
+    logger.info(f"   Сверка ONNX fp32 с torch: max |Δ| = {parity:.5f}")
+
+    if quantize:
+        int8_file = output_dir / "model_int8.onnx"
+        quantize_dynamic(str(fp32_file), str(int8_file), weight_type=QuantType.QInt8)
+        int8_parity = check_parity(model, tokenizer, _create_session(int8_file))
+        logger.info(f"   Сверка ONNX int8 с torch: max |Δ| = {int8_parity:.5f}")
+        if int8_parity <= PARITY_TOLERANCE:
+            model_file, parity = int8_file, int8_parity
+        else:
+            logger.warning(f"⚠️ int8 модель расходится с torch (>{PARITY_TOLERANCE}), использую fp32 ONNX")
+
+    tokenizer.save_pretrained(str(output_dir))
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'model_name': model_name,
+        'quantize': quantize,
+        'file': model_file.name,
+        'quantized': model_file.name != fp32_file.name,
+        'parity_max_abs_diff': parity,
+        'opset': ONNX_OPSET,
+        'onnxruntime': ort.__version__
+    }
+    with open(output_dir / "manifest.json", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    logger.info(f"✅ Модель re-ranking экспортирована: {output_dir / model_file.name}")
+    return manifest
+
+
+class OnnxRerankerModel(RerankerModel):
+    """RerankerModel с выполнением через ONNX Runtime (int8 на CPU)"""
+
+    def __init__(
+        self,
+        model_name: str = "jinaai/jina-reranker-v2-base-multilingual",
+        cache_dir: Path = Path("rag/onnx_reranker"),
+        quantize: bool = True,
+        intra_op_threads: Optional[int] = None,
+        score_cache=None
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.quantize = quantize
+        self.intra_op_threads = intra_op_threads or default_intra_op_threads()
+        self.manifest = None
+        super().__init__(model_name, score_cache)
+
+    @property
+    def model_version(self) -> str:
+        manifest = self.manifest or {}
+        return f"onnx:{self.model_name}:{manifest.get('file')}:{manifest.get('opset')}"
+
+    def _load(self, model_name: str):
+        if ort is None:
+            logger.warning("⚠️ onnxruntime не установлен - ONNX бэкенд re-ranking недоступен")
+            return
+
+        try:
+            manifest = None
+            manifest_file = self.cache_dir / "manifest.json"
+            if manifest_file.exists():
+                with open(manifest_file, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if (manifest.get('version') != MANIFEST_VERSION or manifest.get('model_name') != model_name
+                        or manifest.get('quantize') != self.quantize or not (self.cache_dir / manifest['file']).exists()):
+                    manifest = None
+            if manifest is None:
+                manifest = export_reranker(model_name, self.cache_dir, self.quantize)
+
+            self.tokenizer = AutoTokenizer.from_pretrained(str(self.cache_dir), trust_remote_code=True)
+            self.model = _create_session(self.cache_dir / manifest['file'], self.intra_op_threads)
+            self.manifest = manifest
+            logger.info(f"✅ Модель re-ranking загружена (ONNX {manifest['file']}, потоков: {self.intra_op_threads})")
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось загрузить ONNX модель re-ranking: {e}")
+            self.model = None
+
+    def _forward(self, inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        input_names = {i.name for i in self.model.get_inputs()}
+        return self.model.run(None, {k: v for k, v in inputs.items() if k in input_names})[0].reshape(-1)
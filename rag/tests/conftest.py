@@ -1,11 +1,15 @@
 import pytest
 import sys
 import os
+import tempfile
 from unittest.mock import MagicMock
 
 # Add the project root to sys.path so we can import 'rag'
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
+# rag_api_server writes its log file on import: keep it out of the source tree
+os.environ.setdefault('SHUKABASE_LOG_DIR', tempfile.mkdtemp(prefix='shukabase-test-logs-'))
+
 @pytest.fixture
 def mock_genai(mocker):
     """Mocks google.generativeai module."""
@@ -52,7 +56,7 @@ def sample_metadata():
     ]
 
 @pytest.fixture
-def mock_rag_engine(mocker, sample_metadata, mock_faiss, mock_genai):
+def mock_rag_engine(mocker, tmp_path, sample_metadata, mock_faiss, mock_genai):
     """Creates a RAGEngine instance with mocked dependencies."""
     # Patch dependencies globally for the module
     mocker.patch('rag.rag_engine.RerankerModel') # Mock the RerankerModel class
@@ -74,7 +78,7 @@ def mock_rag_engine(mocker, sample_metadata, mock_faiss, mock_genai):
     # Patch _load_language_data to do nothing
     mocker.patch.object(RAGEngine, '_load_language_data')
     
-    engine = RAGEngine(languages=['ru'])
+    engine = RAGEngine(languages=['ru'], base_dir=str(tmp_path))
     
     # Manually hydrate
     engine.metadata['ru'] = sample_metadata
@@ -82,3 +86,29 @@ def mock_rag_engine(mocker, sample_metadata, mock_faiss, mock_genai):
     # engine.bm25_indices['ru'] = ...
     
     return engine
+
+@pytest.fixture
+def tiny_reranker_dir(tmp_path):
+    """Tiny random XLM-R cross-encoder with a word-level tokenizer (offline stand-in for Jina)."""
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors
+    from transformers import PreTrainedTokenizerFast, XLMRobertaConfig, XLMRobertaForSequenceClassification
+
+    model_dir = tmp_path / "tiny-reranker"
+    words = "<s> <pad> </s> <unk> what is the soul eternal что такое душа вечна".split()
+    tok = Tokenizer(models.WordLevel({w: i for i, w in enumerate(words)}, unk_token="<unk>"))
+    tok.pre_tokenizer = pre_tokenizers.Whitespace()
+    tok.post_processor = processors.TemplateProcessing(
+        single="<s> $A </s>", pair="<s> $A </s> </s> $B </s>", special_tokens=[("<s>", 0), ("</s>", 2)]
+    )
+    PreTrainedTokenizerFast(
+        tokenizer_object=tok, bos_token="<s>", eos_token="</s>", pad_token="<pad>", unk_token="<unk>"
+    ).save_pretrained(model_dir)
+
+    torch.manual_seed(0)
+    config = XLMRobertaConfig(
+        vocab_size=len(words), hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+        intermediate_size=64, num_labels=1, max_position_embeddings=600, pad_token_id=1
+    )
+    XLMRobertaForSequenceClassification(config).save_pretrained(model_dir)
+    return model_dir
@@ -1,4 +1,5 @@
 import pytest
+import numpy as np
 from unittest.mock import MagicMock
 # Implementation details are mocked in conftest.py
 
@@ -53,3 +54,763 @@ def test_search_error_handling(mock_rag_engine):
     # In rag_engine.py: catch Exception -> return {'success': False, 'error': ...}
     assert result['success'] is False
     assert "API Error" in result['error']
+
+def test_simple_match_uses_phrase_index(mock_rag_engine):
+    """Phrase index lookups return the same hits as a full scan."""
+    from rag.phrase_index import PhraseIndex
+    engine = mock_rag_engine
+
+    scan_results = engine._search_by_simple_match("verse 5", "ru", top_k=10)
+
+    engine.phrase_indices['ru'] = PhraseIndex.build(
+        meta['text_preview'].lower() for meta in engine.metadata['ru']
+    )
+    index_results = engine._search_by_simple_match("verse 5", "ru", top_k=10)
+
+    assert index_results == scan_results
+    assert [r['index'] for r in index_results] == [1]
+    assert index_results[0]['source'] == 'simple_match'
+    assert engine._search_by_simple_match("no such phrase", "ru", top_k=10) == []
+
+def test_phrase_index_rebuilt_when_text_changes_with_same_chunk_count(tmp_path, sample_metadata):
+    """A corrected chunk text invalidates the saved phrase index even if the number of chunks is unchanged."""
+    from rag.chunk_store import ChunkTextStore
+    from rag.rag_engine import RAGEngine
+
+    engine = RAGEngine(languages=[], base_dir=str(tmp_path), load_reranker=False)
+    engine.metadata['ru'] = sample_metadata
+    engine.text_stores['ru'] = ChunkTextStore.from_texts(["Душа вечна", "Кришна и Арджуна"])
+    engine._load_phrase_index('ru')
+    assert list(engine.phrase_indices['ru'].candidates("арджуна")) == [1]
+
+    engine.text_stores['ru'] = ChunkTextStore.from_texts(["Душа вечно жива", "Кришна и Уддхава"])
+    engine._load_phrase_index('ru')
+    assert list(engine.phrase_indices['ru'].candidates("арджуна")) == []
+    assert list(engine.phrase_indices['ru'].candidates("уддхава")) == [1]
+
+def test_chunk_text_store_lookup(mock_rag_engine):
+    """Chunk texts are served from the flat store by FAISS row id."""
+    from rag.chunk_store import ChunkTextStore
+    engine = mock_rag_engine
+
+    engine.text_stores['ru'] = ChunkTextStore.from_texts(['Бхагавад-гита 2.12', 'Second chunk'])
+
+    assert engine._get_chunk_text(0, 'ru') == 'Бхагавад-гита 2.12'
+    assert engine._get_chunk_text_lower(0, 'ru') == 'бхагавад-гита 2.12'
+    assert engine._get_chunk_text(1, 'ru') == 'Second chunk'
+
+def test_binary_chunk_store_stale_after_same_size_source_edit(tmp_path):
+    """A same-length edit of the source JSON invalidates the binary store; a copy with a new mtime does not."""
+    import json
+    import os
+    from rag.chunk_store import open_chunk_store, write_chunk_meta_for_texts, write_chunk_texts_from_chunked
+    texts_file, meta_file = tmp_path / "chunk_texts_ru.bin", tmp_path / "chunk_meta_ru.bin"
+    source = tmp_path / "chunked_scriptures_ru.json"
+    source.write_text(json.dumps({'bg': {'1': ['Душа вечна']}}))
+    write_chunk_texts_from_chunked(texts_file, json.loads(source.read_text()), source)
+    write_chunk_meta_for_texts(meta_file, texts_file, [{'book': 'bg', 'chapter': '1', 'chunk_idx': 0}])
+
+    stat = source.stat()
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert open_chunk_store(texts_file, meta_file, texts_source=source) is not None
+
+    source.write_text(json.dumps({'bg': {'1': ['Душа вечно']}}))
+    assert source.stat().st_size == stat.st_size
+    assert open_chunk_store(texts_file, meta_file, texts_source=source) is None
+
+def test_binary_chunk_store_roundtrip(tmp_path):
+    """Chunk texts and metadata written in binary form are read back through mmap."""
+    from rag.chunk_store import write_chunk_texts, write_chunk_meta_for_texts, open_chunk_store
+    texts_file = tmp_path / "chunk_texts_ru.bin"
+    meta_file = tmp_path / "chunk_meta_ru.bin"
+
+    # Splitter order differs from FAISS order
+    write_chunk_texts(texts_file, [
+        ('bg', '2', 0, 'Текст 12. Душа вечна'),
+        ('bg', '1', 0, 'TEXT 1 Dhrtarastra said'),
+    ])
+    flat_metadata = [
+        {'book': 'bg', 'chapter': '1', 'chunk_idx': 0, 'html_path': 'bg/1/index.html'},
+        {'book': 'bg', 'chapter': '2', 'chunk_idx': 0, 'html_path': None},
+    ]
+    assert write_chunk_meta_for_texts(meta_file, texts_file, flat_metadata) == 0
+
+    store, metadata = open_chunk_store(texts_file, meta_file)
+
+    assert len(metadata) == 2
+    assert metadata[0]['html_path'] == 'bg/1/index.html'
+    assert metadata[1]['chapter'] == '2'
+    assert metadata[1]['html_path'] is None
+    assert store.get(0) == 'TEXT 1 Dhrtarastra said'
+    assert store.get_lower(1) == 'текст 12. душа вечна'
+
+def test_embedding_cache_skips_network(mock_rag_engine, mock_genai):
+    """Repeated and near-repeated queries are served from the embedding cache."""
+    engine = mock_rag_engine
+
+    first = engine._get_embedding(["What is karma?"])
+    second = engine._get_embedding(["  what is KARMA "])
+
+    assert mock_genai.call_count == 1
+    assert np.array_equal(first, second)
+    assert engine.embedding_cache.stats()['hits'] == 1
+
+def test_search_embeds_all_variants_in_one_request(mock_rag_engine, mock_genai):
+    """Variants for every target language are embedded in a single batched call."""
+    engine = mock_rag_engine
+    engine.indices['en'] = engine.indices['ru']
+    engine.metadata['en'] = engine.metadata['ru']
+    engine.reranker.model = None
+    mock_genai.side_effect = lambda model, content, task_type: {
+        'embedding': [[0.1] * 768 for _ in content] if isinstance(content, list) else [0.1] * 768
+    }
+
+    result = engine.search("love of god", language="all")
+
+    assert result['success'] is True
+    assert mock_genai.call_count == 1
+    assert isinstance(mock_genai.call_args.kwargs['content'], list)
+
+def test_concurrent_retrieval_matches_sequential(mock_rag_engine):
+    """Running retrievers in the thread pool gives the same results and reports timings."""
+    engine = mock_rag_engine
+    engine.reranker.model = None
+
+    concurrent = engine.search("Chapter 2", expand_query=False)
+    engine._executor = None
+    sequential = engine.search("Chapter 2", expand_query=False)
+
+    assert concurrent['success'] is True
+    assert concurrent['results'] == sequential['results']
+    assert 'total_ms' in concurrent['timings']
+    assert {'vector_ms', 'phrase_ms'} <= set(concurrent['timings']['ru'])
+
+def test_sparse_bm25_matches_rank_bm25():
+    """SparseBM25 reproduces BM25Okapi scores and returns the best documents first."""
+    from rank_bm25 import BM25Okapi
+    from rag.bm25_sparse import SparseBM25
+
+    corpus = [
+        ['krishna', 'arjuna', 'yoga'],
+        ['soul', 'eternal', 'soul'],
+        ['yoga', 'karma', 'soul', 'krishna'],
+        [],
+        ['devotion'],
+    ]
+    query = ['soul', 'yoga', 'soul', 'unknown']
+    okapi = BM25Okapi(corpus)
+    sparse = SparseBM25.build(corpus)
+
+    assert np.array_equal(sparse.get_scores(query), okapi.get_scores(query))
+
+    docs, scores = sparse.top_k(query, 2)
+    expected = np.argsort(okapi.get_scores(query))[::-1][:2]
+    assert list(docs) == list(expected)
+    assert np.all(np.diff(scores) <= 0)
+
+def test_bm25_index_file_roundtrip(tmp_path):
+    """The BM25 file reloads with equal scores and is rejected when stale or corrupted."""
+    from rag.bm25_sparse import SparseBM25
+
+    corpus = [['душа', 'вечна'], ['krishna', 'yoga'], ['yoga', 'душа', 'душа']]
+    bm25 = SparseBM25.build(corpus)
+    path = tmp_path / 'bm25_index_ru.bin'
+    bm25.save(path, 'v1:RussianStemmer', '3:abc')
+
+    loaded = SparseBM25.load(path, 'v1:RussianStemmer', '3:abc')
+    query = ['душа', 'yoga', 'нет']
+    assert np.array_equal(loaded.get_scores(query), bm25.get_scores(query))
+
+    assert SparseBM25.load(path, 'v2:RussianStemmer', '3:abc') is None
+    assert SparseBM25.load(path, 'v1:RussianStemmer', '4:def') is None
+
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xFF
+    path.write_bytes(bytes(data))
+    assert SparseBM25.load(path, 'v1:RussianStemmer', '3:abc') is None
+
+def test_tokenize_corpus_with_process_pool(monkeypatch):
+    """Memoized stemming matches Snowball, and pooled tokenization keeps document order."""
+    from nltk.stem import SnowballStemmer
+    from rag import bm25_tokenizer
+
+    stemmer = SnowballStemmer('russian')
+    assert bm25_tokenizer.tokenize("Душа вечна, душа!", 'ru') == [stemmer.stem(w) for w in ['душа', 'вечна', 'душа']]
+
+    monkeypatch.setattr(bm25_tokenizer, 'CORPUS_BATCH_SIZE', 2)
+    texts = [f"Кришна говорит {i} стих" for i in range(7)]
+    assert bm25_tokenizer.tokenize_corpus(texts, 'ru', workers=2) == bm25_tokenizer.tokenize_corpus(texts, 'ru', workers=1)
+
+def test_verse_index_returns_exact_verse_without_embedding(mock_rag_engine, mock_genai):
+    """A verse reference is resolved from the verse index before the hybrid pipeline."""
+    from rag.verse_index import VerseIndex
+
+    engine = mock_rag_engine
+    engine.metadata['ru'] = [
+        {'book': 'bg', 'chapter': '2', 'chunk_idx': 0, 'text_preview': 'TEXT 12 Never was there a time', 'html_path': 'bg/2/12.html'},
+        {'book': 'bg', 'chapter': '02', 'chunk_idx': 1, 'text_preview': 'ТЕКСТЫ 10-11 Благословенный Господь', 'html_path': 'bg/2/10.html'},
+        {'book': 'sb', 'chapter': '2', 'chunk_idx': 0, 'text_preview': 'TEXT 12 Other book', 'html_path': 'sb/2/12.html'},
+    ]
+    engine.verse_indices['ru'] = VerseIndex.build(
+        engine.metadata['ru'], lambda idx: engine._get_chunk_text_lower(idx, 'ru')
+    )
+
+    ref = {'book': 'bg', 'chapter': '2', 'verse': '12'}
+    assert list(engine.verse_indices['ru'].lookup('bg', '2', '12')) == engine._scan_verse_in_metadata(ref, 'ru') == [0]
+    assert list(engine.verse_indices['ru'].lookup('bg', '2', '10')) == [1]
+
+    result = engine.search("БГ 2.12")
+
+    assert result['search_type'] == 'exact_verse_reference'
+    assert [r['index'] for r in result['results']] == [0]
+    assert mock_genai.call_count == 0
+
+def test_onnx_reranker_matches_torch(tmp_path, tiny_reranker_dir):
+    """The ONNX backend exports once and scores pairs like the torch model."""
+    pytest.importorskip("onnxruntime")
+    from rag.rag_engine import RerankerModel
+    from rag.reranker_onnx import OnnxRerankerModel, PARITY_TOLERANCE
+
+    model_dir = str(tiny_reranker_dir)
+    cache_dir = tmp_path / "onnx"
+    onnx_reranker = OnnxRerankerModel(model_dir, cache_dir=cache_dir)
+    assert onnx_reranker.model is not None
+    assert onnx_reranker.manifest['parity_max_abs_diff'] <= PARITY_TOLERANCE
+
+    docs = ["the soul is eternal", "душа вечна", "что"]
+    expected = RerankerModel(model_dir)._score("что такое душа", docs)
+    assert np.allclose(onnx_reranker._score("что такое душа", docs), expected, atol=PARITY_TOLERANCE)
+
+    # Повторная загрузка использует сохраненный экспорт
+    mtime = (cache_dir / "manifest.json").stat().st_mtime_ns
+    assert OnnxRerankerModel(model_dir, cache_dir=cache_dir).model is not None
+    assert (cache_dir / "manifest.json").stat().st_mtime_ns == mtime
+
+def test_reranker_micro_batches_match_single_batch(tiny_reranker_dir):
+    """Length-sorted micro-batches with cached document tokens give the same scores."""
+    import torch
+    from rag.rag_engine import RerankerModel
+
+    reranker = RerankerModel(str(tiny_reranker_dir))
+    reranker.MICRO_BATCH_SIZE = 2
+    reranker.MAX_LENGTH = 12
+    query = "что такое душа"
+    docs = ["the soul is eternal " * 5, "душа", "что такое душа вечна", "soul soul soul", "eternal"]
+
+    with torch.no_grad():
+        inputs = reranker.tokenizer([[query, d] for d in docs], padding=True, truncation=True,
+                                    return_tensors="pt", max_length=12)
+        encoded = reranker._encode_pairs(query, docs, [reranker._doc_key(d) for d in docs])[0]
+        assert [len(ids) for ids in encoded] == inputs['attention_mask'].sum(1).tolist()
+        expected = reranker.model(**inputs).logits.reshape(-1).numpy()
+
+    assert np.allclose(reranker._score(query, docs), expected, atol=1e-5)
+    assert len(reranker._micro_batches([5, 3, 9, 1, 2])) == 3
+
+    reranker._score(query, docs)
+    assert reranker._doc_tokens.hits >= len(docs)
+
+def test_reranker_score_cache_runs_only_missing_pairs(tiny_reranker_dir, mocker):
+    """Cached (query, chunk) scores skip the model; only new chunks are scored."""
+    from rag.cache_utils import LRUCache
+    from rag.rag_engine import RerankerModel
+
+    reranker = RerankerModel(str(tiny_reranker_dir), score_cache=LRUCache(100))
+    first = reranker._score("Что такое душа?", ["душа вечна", "the soul is eternal"])
+
+    forward = mocker.spy(reranker, '_forward')
+    again = reranker._score("  что такое ДУША ", ["the soul is eternal", "душа вечна", "что"])
+
+    assert np.allclose(again[:2], first[::-1])
+    assert forward.call_count == 1
+    assert forward.call_args.args[0]['input_ids'].shape[0] == 1
+
+def test_search_async_matches_search_and_awaits_embeddings(mock_rag_engine, mock_genai, mocker):
+    """search_async returns the same results as search and uses the async embedding call."""
+    import asyncio
+    engine = mock_rag_engine
+    engine.reranker.model = None
+    engine.embedding_cache = None
+    async_embed = mocker.patch(
+        'google.generativeai.embed_content_async', new=mocker.AsyncMock(return_value={'embedding': [0.1] * 768})
+    )
+
+    expected = engine.search("Chapter 2", expand_query=False)
+    actual = asyncio.run(engine.search_async("Chapter 2", expand_query=False))
+
+    assert actual['success'] is True
+    assert actual['results'] == expected['results']
+    assert async_embed.await_count == 1
+    assert mock_genai.call_count == 1  # только синхронный search()
+    assert 'embedding_ms' in actual['timings']
+
+def test_search_async_lazy_load_does_not_block_event_loop(mocker, tmp_path, mock_faiss, sample_metadata):
+    """While search_async loads a language on first use, other coroutines on the loop keep running."""
+    import asyncio
+    import threading
+    from rag.rag_engine import RAGEngine
+    mocker.patch('rag.rag_engine.RerankerModel')
+    mocker.patch(
+        'google.generativeai.embed_content_async', new=mocker.AsyncMock(return_value={'embedding': [[0.1] * 768]})
+    )
+    release = threading.Event()
+
+    def slow_load(self, language):
+        assert release.wait(5)
+        self.indices[language] = mock_faiss
+        self.metadata[language] = sample_metadata
+
+    mocker.patch.object(RAGEngine, '_load_language_data', slow_load)
+    engine = RAGEngine(languages=['ru'], base_dir=str(tmp_path), lazy_loading=True, embedding_cache=False)
+    engine.reranker.model = None
+
+    async def scenario():
+        search = asyncio.ensure_future(engine.search_async("Chapter 2", expand_query=False))
+        # Другой запрос обслуживается, пока язык загружается в пуле потоков
+        await asyncio.sleep(0.05)
+        served = not search.done()
+        release.set()
+        return served, await search
+
+    served, result = asyncio.run(scenario())
+    assert served
+    assert result['success'] is True
+
+def test_single_flight_coalesces_identical_requests():
+    """Concurrent identical requests share one computation; different keys do not."""
+    import asyncio
+    from rag.cache_utils import AsyncSingleFlight
+
+    calls = []
+
+    async def compute(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return {'key': key}
+
+    async def scenario():
+        flight = AsyncSingleFlight()
+        results = await asyncio.gather(
+            *[flight.run('same', lambda: compute('same')) for _ in range(5)],
+            flight.run('other', lambda: compute('other'))
+        )
+        again = await flight.run('same', lambda: compute('same'))
+        return flight, results, again
+
+    flight, results, again = asyncio.run(scenario())
+    assert calls == ['same', 'other', 'same']
+    assert all(r is results[0] for r in results[:5])
+    assert again == {'key': 'same'}
+    assert flight.stats() == {'in_flight': 0, 'started': 3, 'coalesced': 4}
+
+def test_search_batch_matches_individual_searches(mock_rag_engine, mock_genai, mock_faiss):
+    """search_batch gives per-query results equal to search() with one embedding and one FAISS call."""
+    from rag.bm25_sparse import SparseBM25
+    from rag.bm25_tokenizer import tokenize
+    engine = mock_rag_engine
+    engine.reranker.model = None
+    engine.embedding_cache = None
+    engine.bm25_indices['ru'] = SparseBM25.build([tokenize(m['text_preview'], 'ru') for m in engine.metadata['ru']])
+    mock_faiss.search.side_effect = lambda q, k: (
+        np.tile([[0.1, 0.2]], (len(q), 1)), np.tile([[0, 1]], (len(q), 1))
+    )
+    mock_genai.side_effect = lambda model, content, task_type: {
+        'embedding': [[0.1] * 768 for _ in content] if isinstance(content, list) else [0.1] * 768
+    }
+    queries = ["Chapter 2 Verse", "Verse 5 text", "БГ 1.1", "chapter 1"]
+
+    expected = [engine.search(q) for q in queries]
+    mock_genai.reset_mock()
+    mock_faiss.search.reset_mock()
+    batch = engine.search_batch(queries)
+
+    assert batch['success'] is True
+    assert mock_genai.call_count == 1
+    assert mock_faiss.search.call_count == 1
+    for exp, actual in zip(expected, batch['responses']):
+        assert actual['results'] == exp['results']
+        assert actual.get('search_type') == exp.get('search_type')
+
+def test_reranker_rerank_many_matches_single_queries(tiny_reranker_dir, mocker):
+    """Reranking several queries together equals reranking each one, in one model pass."""
+    from rag.rag_engine import RerankerModel
+
+    reranker = RerankerModel(str(tiny_reranker_dir))
+    requests = [
+        ("что такое душа", ["душа вечна", "what is the soul", "вечна"]),
+        ("the soul", ["the soul is eternal", "душа"]),
+        ("empty", [])
+    ]
+    expected = [reranker.rerank(q, docs, len(docs)) for q, docs in requests]
+
+    forward = mocker.spy(reranker, '_forward')
+    actual = reranker.rerank_many(requests)
+
+    assert forward.call_count == 1
+    for exp, act in zip(expected, actual):
+        assert [i for i, _, _ in act] == [i for i, _, _ in exp]
+        assert np.allclose([s for _, s, _ in act], [s for _, s, _ in exp], atol=1e-5)
+
+def test_search_stream_emits_stages_before_final(mock_rag_engine):
+    """search_stream yields lexical hits, then the fused list, then the same final answer as search()."""
+    engine = mock_rag_engine
+    engine.reranker.model = None
+
+    stages = list(engine.search_stream("Chapter 2", expand_query=False))
+    expected = engine.search("Chapter 2", expand_query=False)
+
+    assert [s['stage'] for s in stages] == ['lexical', 'fused', 'final']
+    assert stages[0]['simple_match'][0]['text'] == 'Chapter 2 Verse 5 Text'
+    assert stages[-1]['results'] == expected['results']
+    assert stages[0]['elapsed_ms'] <= stages[1]['elapsed_ms']
+
+    exact = list(engine.search_stream("БГ 2.5"))
+    assert [s['stage'] for s in exact] == ['exact', 'final']
+    assert exact[-1]['search_type'] == 'exact_verse_reference'
+
+def test_lazy_loading_loads_languages_on_demand_within_budget(mocker, tmp_path, mock_faiss, mock_genai, sample_metadata):
+    """Languages load on first query; an idle language is unloaded when the memory budget is exceeded."""
+    from rag.rag_engine import RAGEngine
+    mocker.patch('rag.rag_engine.RerankerModel')
+    loaded = []
+
+    def fake_load(self, language):
+        loaded.append(language)
+        self.indices[language] = mock_faiss
+        self.metadata[language] = sample_metadata
+
+    mocker.patch.object(RAGEngine, '_load_language_data', fake_load)
+    mocker.patch.object(RAGEngine, '_estimate_language_bytes', return_value=1024 * 1024)
+    engine = RAGEngine(languages=['ru', 'en'], base_dir=str(tmp_path), lazy_loading=True, memory_budget_mb=1.5)
+    engine.reranker.model = None
+    engine.IDLE_UNLOAD_SECONDS = 0
+    assert loaded == []
+
+    assert engine.search("Chapter 2", language='en')['success'] is True
+    assert loaded == ['en']
+    engine.search("Chapter 1", language='en')
+    assert loaded == ['en']
+
+    assert engine.search("Chapter 2", language='ru')['success'] is True
+    assert loaded == ['en', 'ru']
+    assert set(engine.language_stats()['loaded']) == {'ru'}
+    assert 'en' not in engine.indices and 'en' not in engine.metadata
+
+    assert engine.search("Chapter 2", language='de')['success'] is False
+
+def test_warm_up_serves_degraded_results_until_components_ready(mocker, tmp_path, mock_faiss, mock_genai, sample_metadata):
+    """After FAISS + metadata the engine answers (marked degraded); warm_up adds BM25 and the reranker."""
+    from rag.rag_engine import RAGEngine
+    reranker_cls = mocker.patch('rag.rag_engine.RerankerModel')
+    reranker_cls.return_value.model = None
+
+    def fake_core(self, language):
+        self.indices[language] = mock_faiss
+        self.metadata[language] = sample_metadata
+        return True
+
+    def fake_extras(self, language):
+        self.bm25_indices[language] = MagicMock(top_k=MagicMock(return_value=([], [])))
+
+    mocker.patch.object(RAGEngine, '_load_language_core', fake_core)
+    mocker.patch.object(RAGEngine, '_load_language_extras', fake_extras)
+    engine = RAGEngine(languages=['ru'], base_dir=str(tmp_path), lazy_loading=True, load_reranker=False)
+
+    assert engine.readiness()['search_ready'] is False
+    engine.load_language('ru', extras=False)
+    degraded = engine.search("Chapter 2")
+    assert degraded['success'] is True
+    assert degraded['degraded'] == ['ru:bm25', 'reranker']
+    components = engine.readiness()['languages']['ru']
+    assert components['faiss']['ready'] and not components['bm25']['ready']
+
+    engine.warm_up(['ru'])
+    assert 'degraded' not in engine.search("Chapter 2")
+    assert engine.readiness()['languages']['ru']['bm25']['ready'] is True
+    assert engine.readiness()['reranker']['loaded'] is True
+    assert reranker_cls.call_count == 1
+
+
+def test_search_stays_degraded_while_warm_up_builds_extras(mocker, tmp_path, mock_faiss, mock_genai, sample_metadata):
+    """Until BM25/phrase/verse indexes finish loading, answers keep the 'degraded' mark (and are not cached)."""
+    import threading
+    from rag.rag_engine import RAGEngine
+    mocker.patch('rag.rag_engine.RerankerModel')
+    started, release = threading.Event(), threading.Event()
+
+    def fake_core(self, language):
+        self.indices[language] = mock_faiss
+        self.metadata[language] = sample_metadata
+        return True
+
+    def blocked_extras(self, language):
+        started.set()
+        assert release.wait(5)
+
+    mocker.patch.object(RAGEngine, '_load_language_core', fake_core)
+    mocker.patch.object(RAGEngine, '_load_language_extras', blocked_extras)
+    engine = RAGEngine(languages=['ru'], base_dir=str(tmp_path), lazy_loading=True, load_reranker=False)
+    engine.load_language('ru', extras=False)
+
+    warm_up = threading.Thread(target=engine.warm_up, args=(['ru'],))
+    warm_up.start()
+    try:
+        assert started.wait(5)
+        assert engine.search("Chapter 2", use_reranking=False)['degraded'] == ['ru:bm25']
+    finally:
+        release.set()
+        warm_up.join(5)
+    assert 'degraded' not in engine.search("Chapter 2", use_reranking=False)
+
+
+@pytest.mark.parametrize("index_type, options, param", [
+    ('ivfpq', {'nlist': 8, 'pq_m': 4, 'pq_bits': 4, 'nprobe': 3}, 'nprobe'),
+    ('opq', {'nlist': 8, 'pq_m': 4, 'pq_bits': 4, 'nprobe': 3}, 'nprobe'),
+    ('hnsw', {'hnsw_m': 8, 'ef_search': 24}, 'efSearch'),
+    ('sq8', {}, None),
+])
+def test_compressed_index_types_load_with_search_params(tmp_path, index_type, options, param):
+    """Indexes built by any factory are read back and get their search parameters from faiss_index_{lang}.json."""
+    import json
+    import faiss
+    from rag.faiss_indexer import FAISSIndexer
+    from rag.rag_engine import RAGEngine
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((600, 16)).astype('float32')
+    indexer = FAISSIndexer(embedding_dim=16)
+    index = indexer.build_index(vectors.copy(), index_type=index_type, **options)
+    assert indexer.index_config['type'] == index_type
+    assert indexer.index_config['bytes_per_vector'] <= 16 * 4
+
+    # Serialized value differs from the recorded one: the engine must apply the config
+    if param == 'nprobe':
+        faiss.extract_index_ivf(index).nprobe = 1
+    elif param == 'efSearch':
+        index.hnsw.efSearch = 4
+    faiss.write_index(index, str(tmp_path / "faiss_index_ru.bin"))
+    (tmp_path / "faiss_index_ru.json").write_text(json.dumps(indexer.index_config))
+
+    engine = RAGEngine(languages=[], base_dir=str(tmp_path), load_reranker=False)
+    loaded = faiss.read_index(str(tmp_path / "faiss_index_ru.bin"))
+    engine._apply_index_config(loaded, 'ru')
+
+    assert engine.index_configs['ru']['factory'] == indexer.index_config['factory']
+    if param == 'nprobe':
+        assert faiss.extract_index_ivf(loaded).nprobe == 3
+    elif param == 'efSearch':
+        assert loaded.hnsw.efSearch == 24
+    _, ids = loaded.search(vectors[:5] / np.linalg.norm(vectors[:5], axis=1, keepdims=True), 1)
+    assert (ids[:, 0] >= 0).all()
+
+
+@pytest.mark.parametrize("index_type, param", [('ivf', 'nprobe'), ('hnsw', 'efSearch')])
+def test_index_tuning_picks_cheapest_setting_meeting_recall(index_type, param):
+    """The tuner stores the cheapest nprobe/efSearch whose recall@k against a flat index meets the target."""
+    from rag.faiss_indexer import FAISSIndexer, sample_queries
+
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((2000, 16)).astype('float32')
+    indexer = FAISSIndexer(embedding_dim=16)
+    index = indexer.tune_index(vectors, sample_queries(vectors, 50), index_type=index_type, target_recall=0.9, k=5)
+
+    tuning = indexer.index_config['tuning']
+    selected = tuning['selected']
+    assert selected['recall'] >= 0.9
+    assert indexer.index_config['search_params'][param] == selected[param]
+    cheaper = [p for p in tuning['sweep'] if p['recall'] >= 0.9 and p['cost'] < selected['cost']]
+    assert cheaper == []
+    if index_type == 'ivf':
+        assert indexer.index_config['nlist'] == selected['nlist'] == index.nlist
+
+
+def _write_indexer_embeddings(tmp_path, monkeypatch, count=300, dim=768):
+    """Embeddings for faiss_indexer in tmp_path/rag (the indexer uses paths relative to the cwd)."""
+    import json
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'rag').mkdir(exist_ok=True)
+    vectors = np.random.default_rng(4).standard_normal((count, dim)).astype('float32')
+    np.savez(tmp_path / 'rag' / 'embeddings_ru.npz', embeddings_0=vectors)
+    with open(tmp_path / 'rag' / 'embeddings_metadata_ru.json', 'w', encoding='utf-8') as f:
+        json.dump({'structure': {}}, f)
+
+
+def _saved_index(tmp_path):
+    import json
+
+    with open(tmp_path / 'rag' / 'faiss_metadata_ru.json', encoding='utf-8') as f:
+        return json.load(f)['index']
+
+
+def test_index_rerun_keeps_explicit_type_and_metric(tmp_path, monkeypatch):
+    """A rerun without --index-type/--metric keeps the existing index; a full update rebuilds it with the saved settings."""
+    from rag import faiss_indexer
+
+    _write_indexer_embeddings(tmp_path, monkeypatch)
+    faiss_indexer.process_all_languages(['ru', '--index-type', 'hnsw', '--metric', 'ip', '--ef-search', '40'])
+    index_file = tmp_path / 'rag' / 'faiss_index_ru.bin'
+    built = index_file.stat().st_mtime_ns
+
+    faiss_indexer.process_all_languages(['ru'])
+    assert index_file.stat().st_mtime_ns == built
+    assert _saved_index(tmp_path)['type'] == 'hnsw'
+
+    # update_rag_db.py deletes the index and its metadata, faiss_index_ru.json stays
+    index_file.unlink()
+    (tmp_path / 'rag' / 'faiss_metadata_ru.json').unlink()
+    faiss_indexer.process_all_languages(['ru'])
+    saved = _saved_index(tmp_path)
+    assert (saved['type'], saved['metric'], saved['search_params']) == ('hnsw', 'ip', {'efSearch': 40})
+
+    faiss_indexer.process_all_languages(['ru', '--metric', 'l2'])
+    assert (_saved_index(tmp_path)['type'], _saved_index(tmp_path)['metric']) == ('hnsw', 'l2')
+
+
+def test_index_rerun_keeps_tuned_search_params(tmp_path, monkeypatch):
+    """A rerun with default arguments keeps the tuned nlist/nprobe, also when a full update rebuilds the index."""
+    from rag import faiss_indexer
+
+    _write_indexer_embeddings(tmp_path, monkeypatch)
+    faiss_indexer.process_all_languages(['ru', '--index-type', 'ivf', '--tune', '--tune-sample', '50',
+                                         '--target-recall', '0.5', '--recall-k', '5'])
+    tuned = _saved_index(tmp_path)
+    assert tuned['search_params']['nprobe'] == tuned['tuning']['selected']['nprobe']
+    index_file = tmp_path / 'rag' / 'faiss_index_ru.bin'
+    built = index_file.stat().st_mtime_ns
+
+    faiss_indexer.process_all_languages(['ru'])
+    assert index_file.stat().st_mtime_ns == built
+    assert _saved_index(tmp_path) == tuned
+
+    index_file.unlink()
+    (tmp_path / 'rag' / 'faiss_metadata_ru.json').unlink()
+    faiss_indexer.process_all_languages(['ru'])
+    rebuilt = _saved_index(tmp_path)
+    assert (rebuilt['type'], rebuilt['nlist'], rebuilt['search_params']) == ('ivf', tuned['nlist'], tuned['search_params'])
+
+
+def test_inner_product_index_scores_with_cosine_similarity(mock_rag_engine):
+    """An inner-product index returns the same hits, distances and scores as L2, so mixed-metric results compare."""
+    import faiss
+    from rag.faiss_indexer import FAISSIndexer
+
+    engine = mock_rag_engine
+    rng = np.random.default_rng(2)
+    vectors = rng.standard_normal((50, 16)).astype('float32')
+    engine.metadata['ru'] = [{'book': 'bg', 'chapter': str(i), 'chunk_idx': 0} for i in range(50)]
+    engine.text_stores.pop('ru', None)
+    query = vectors[7] + 0.1 * rng.standard_normal(16).astype('float32')
+    query /= np.linalg.norm(query)
+
+    hits = {}
+    for metric in ('l2', 'ip'):
+        engine.indices['ru'] = FAISSIndexer(embedding_dim=16).build_index(vectors.copy(), index_type='flat', metric=metric)
+        hits[metric] = engine._search_by_vector(query, 'ru', top_k=5, vector_distance_threshold=1.5)
+
+    assert [h['index'] for h in hits['ip']] == [h['index'] for h in hits['l2']]
+    assert hits['ip'][0]['index'] == 7
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    for ip_hit, l2_hit in zip(hits['ip'], hits['l2']):
+        cosine = float(normalized[ip_hit['index']] @ query)
+        assert ip_hit['distance'] == pytest.approx(2.0 - 2.0 * cosine, abs=1e-5)
+        assert ip_hit['distance'] == pytest.approx(l2_hit['distance'], abs=1e-4)
+        assert ip_hit['score'] == pytest.approx(l2_hit['score'], abs=1e-4)
+
+
+def test_vector_search_merges_query_variants_in_one_faiss_call(mock_rag_engine):
+    """A matrix of variant embeddings is searched with one index.search; each chunk keeps its best score."""
+    import faiss
+
+    engine = mock_rag_engine
+    rng = np.random.default_rng(3)
+    vectors = rng.standard_normal((40, 8)).astype('float32')
+    faiss.normalize_L2(vectors)
+    flat = faiss.IndexFlatL2(8)
+    flat.add(vectors)
+    # Rows 2k and 2k+1 belong to the same chunk
+    engine.metadata['ru'] = [{'book': 'bg', 'chapter': str(i // 2), 'chunk_idx': 0} for i in range(40)]
+    engine.text_stores.pop('ru', None)
+    queries = vectors[[0, 5, 11]] + 0.2 * rng.standard_normal((3, 8)).astype('float32')
+    faiss.normalize_L2(queries)
+
+    index = MagicMock(metric_type=flat.metric_type)
+    index.search.side_effect = flat.search
+    engine.indices['ru'] = index
+    merged = engine._search_by_vector(queries, 'ru', top_k=4)
+    assert index.search.call_count == 1
+
+    per_variant = [hit for q in queries for hit in engine._search_by_vector(q, 'ru', top_k=4)]
+    per_variant.sort(key=lambda hit: hit['score'], reverse=True)
+    expected, seen = [], set()
+    for hit in per_variant:
+        if hit['chapter'] not in seen:
+            seen.add(hit['chapter'])
+            expected.append(hit)
+    assert merged == expected
+    assert len({hit['chapter'] for hit in merged}) == len(merged)
+
+
+def test_incremental_update_adds_and_removes_books(mocker, tmp_path):
+    """Only changed files are embedded; FAISS rows, BM25 postings and chunk stores match the new corpus."""
+    import json
+    import zlib
+    import faiss
+    from rag.bm25_sparse import SparseBM25
+    from rag.bm25_tokenizer import tokenize, tokenizer_signature
+    from rag.chunk_store import open_chunk_store
+    from rag.incremental_update import IncrementalUpdater
+    from rag.rag_engine import RAGEngine
+
+    def embed(model, content, task_type):
+        vectors = [np.random.default_rng(zlib.crc32(text.encode('utf-8'))).standard_normal(8) for text in content]
+        return {'embedding': [v.tolist() for v in vectors]}
+
+    embed_mock = mocker.patch('google.generativeai.embed_content', side_effect=embed)
+    mocker.patch('rag.embeddings_generator.time.sleep')
+    mocker.patch('rag.rag_engine.RerankerModel')
+
+    long_text = " ".join(f"Стих {i}. Душа вечна, она не рождается и не умирает." for i in range(80))
+    parsed = {'bg': {'bg/1': long_text, 'bg/2': "Кришна говорит Арджуне о йоге."}}
+    (tmp_path / "parsed_scriptures_ru.json").write_text(json.dumps(parsed))
+    (tmp_path / "chunked_scriptures_ru.json").write_text("{}")
+    (tmp_path / "faiss_metadata_ru.json").write_text(json.dumps({'structure': {}}))
+    faiss.write_index(faiss.IndexFlatL2(8), str(tmp_path / "faiss_index_ru.bin"))
+
+    stats = IncrementalUpdater('ru', tmp_path).run()
+    first_rows = stats['embedded_chunks']
+    assert stats['changed_files'] == 2 and first_rows > 2
+    RAGEngine(languages=['ru'], base_dir=str(tmp_path), load_reranker=False).load_language('ru')
+    assert (tmp_path / "bm25_index_ru.bin").exists()
+
+    # Изменение: одна глава удалена, добавлена новая книга
+    parsed['bg'].pop('bg/2')
+    parsed['sb'] = {'sb/1': "Шримад Бхагаватам начинается с молитвы."}
+    (tmp_path / "parsed_scriptures_ru.json").write_text(json.dumps(parsed))
+    embed_mock.reset_mock()
+    stats = IncrementalUpdater('ru', tmp_path).run()
+    assert stats == {**stats, 'changed_files': 1, 'removed_files': 1, 'embedded_chunks': 1}
+    assert [call.kwargs['content'] for call in embed_mock.call_args_list] == [[parsed['sb']['sb/1']]]
+
+    index = faiss.read_index(str(tmp_path / "faiss_index_ru.bin"))
+    assert index.ntotal == first_rows
+    removed_row = first_rows - 1
+    _, ids = index.search(np.ones((1, 8), dtype='float32'), first_rows)
+    assert removed_row not in set(ids[0]) and first_rows in set(ids[0])
+
+    # BM25 обновлен на месте (до загрузки движком) для нового отпечатка корпуса
+    store, _ = open_chunk_store(*(tmp_path / f"{name}_ru.bin" for name in ("chunk_texts", "chunk_meta")))
+    bm25 = SparseBM25.load(tmp_path / "bm25_index_ru.bin", tokenizer_signature('ru'), store.fingerprint())
+    assert bm25 is not None
+
+    engine = RAGEngine(languages=['ru'], base_dir=str(tmp_path), load_reranker=False)
+    engine.load_language('ru')
+    texts = [engine._get_chunk_text(i, 'ru') for i in range(len(engine.metadata['ru']))]
+    assert texts[removed_row] == '' and texts[first_rows] == parsed['sb']['sb/1']
+    assert engine.metadata['ru'][first_rows]['book'] == 'sb'
+
+    expected = SparseBM25.build([tokenize(text, 'ru') for text in texts])
+    query = tokenize("молитва душа Кришна", 'ru')
+    assert np.allclose(bm25.get_scores(query), expected.get_scores(query))
+
+    assert IncrementalUpdater('ru', tmp_path).run()['changed_files'] == 0
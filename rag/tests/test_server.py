@@ -3,6 +3,7 @@ from flask import Flask
 import json
 import os
 import sys
+import time
 
 # Import app from rag_api_server
 # We need to make sure we don't accidentally start the server or fail imports
@@ -58,3 +59,266 @@ def test_search_endpoint_success(client, mocker, mock_rag_engine):
     assert data['success'] is True
     assert len(data['results']) == 1
     assert data['results'][0]['text'] == 'Test Result'
+
+@pytest.fixture
+def fresh_search_cache(mocker, tmp_path):
+    """Пустой кэш результатов поиска, данные - во временной папке."""
+    from rag.cache_utils import SearchResultCache
+    import rag.rag_api_server as server
+    mocker.patch('rag.rag_api_server.DATA_DIR', str(tmp_path))
+    cache = SearchResultCache(max_items=8, ttl_seconds=60, version_fn=server.data_signature, check_interval=0)
+    mocker.patch('rag.rag_api_server.search_cache', cache)
+    return cache
+
+def test_search_result_cache_hit_and_stats(client, mocker, mock_rag_engine, fresh_search_cache):
+    """Repeated identical searches are served from the cache and counted in stats."""
+    mocker.patch('rag.rag_api_server.rag_engine_instance', mock_rag_engine)
+    mock_rag_engine.search = mocker.MagicMock(return_value={'success': True, 'results': [{'text': 'Cached'}]})
+
+    for _ in range(3):
+        response = client.post('/api/search', json={'query': 'krishna', 'top_k': 5})
+        assert response.status_code == 200
+        assert json.loads(response.data)['results'][0]['text'] == 'Cached'
+    client.post('/api/search', json={'query': 'krishna', 'top_k': 5, 'use_reranking': False})
+
+    assert mock_rag_engine.search.call_count == 2
+    assert mock_rag_engine.search.call_args.kwargs['use_reranking'] is False
+
+    stats = json.loads(client.get('/api/cache/stats').data)['search']
+    assert stats['hits'] == 2
+    assert stats['misses'] == 2
+    assert stats['size'] == 2
+
+def test_search_result_cache_invalidated_by_data_change(client, mocker, mock_rag_engine, fresh_search_cache, tmp_path):
+    """Changing data_version.txt or an index file drops cached results."""
+    mocker.patch('rag.rag_api_server.rag_engine_instance', mock_rag_engine)
+    mock_rag_engine.search = mocker.MagicMock(return_value={'success': True, 'results': []})
+    (tmp_path / "data_version.txt").write_text("6")
+
+    client.post('/api/search', json={'query': 'krishna'})
+    client.post('/api/search', json={'query': 'krishna'})
+    assert mock_rag_engine.search.call_count == 1
+
+    (tmp_path / "data_version.txt").write_text("7!")
+    client.post('/api/search', json={'query': 'krishna'})
+    assert mock_rag_engine.search.call_count == 2
+
+    (tmp_path / "bm25_index_ru.bin").write_bytes(b"new")
+    client.post('/api/search', json={'query': 'krishna'})
+    assert mock_rag_engine.search.call_count == 3
+    assert fresh_search_cache.stats()['invalidations'] == 2
+
+def test_search_result_cache_ttl_and_lru(mocker):
+    """Expired entries are recomputed; LRU evicts the least recently used key."""
+    from rag.cache_utils import SearchResultCache
+    clock = mocker.patch('rag.cache_utils.time.monotonic', return_value=100.0)
+    cache = SearchResultCache(max_items=2, ttl_seconds=10)
+    a, b, c = (cache.make_key(q, 'ru', 5) for q in 'abc')
+
+    cache.put(a, {'success': True})
+    cache.put(b, {'success': True})
+    assert cache.get(a) is not None
+    cache.put(c, {'success': True})
+    assert cache.get(b) is None  # вытеснен как давно не использованный
+    clock.return_value = 111.0
+    assert cache.get(a) is None
+    assert cache.stats()['expired'] == 1
+
+def test_search_back_pressure_returns_503(client, mocker, mock_rag_engine):
+    """When all search slots are busy and the queue is full the API answers 503."""
+    from rag.rag_api_server import SearchAdmission
+    mocker.patch('rag.rag_api_server.rag_engine_instance', mock_rag_engine)
+    mock_rag_engine.search = mocker.MagicMock(return_value={'success': True, 'results': []})
+    admission = SearchAdmission(max_active=1, max_queued=0, timeout=0.1)
+    mocker.patch('rag.rag_api_server.search_admission', admission)
+
+    assert admission.acquire()  # единственный слот занят "долгим" запросом
+    response = client.post('/api/search', json={'query': 'busy'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert mock_rag_engine.search.call_count == 0
+
+    admission.release()
+    response = client.post('/api/search', json={'query': 'free'})
+    assert response.status_code == 200
+    assert admission.stats()['active'] == 0
+    assert admission.stats()['rejected'] == 1
+
+def test_search_batch_endpoint_uses_result_cache(client, mocker, mock_rag_engine, fresh_search_cache):
+    """Only uncached queries of a batch reach RAGEngine.search_batch; order is preserved."""
+    mocker.patch('rag.rag_api_server.rag_engine_instance', mock_rag_engine)
+    mock_rag_engine.search = mocker.MagicMock(return_value={'success': True, 'results': [{'text': 'single'}]})
+    mock_rag_engine.search_batch = mocker.MagicMock(side_effect=lambda queries, **kw: {
+        'success': True, 'responses': [{'success': True, 'results': [{'text': q}]} for q in queries], 'timings': {}
+    })
+
+    client.post('/api/search', json={'query': 'krishna', 'top_k': 3})
+    response = client.post('/api/search/batch', json={'queries': ['arjuna', 'krishna', 'yoga'], 'top_k': 3})
+
+    data = json.loads(response.data)
+    assert response.status_code == 200
+    assert [r['results'][0]['text'] for r in data['responses']] == ['arjuna', 'single', 'yoga']
+    assert data['cached'] == 1
+    assert mock_rag_engine.search_batch.call_args.kwargs['queries'] == ['arjuna', 'yoga']
+
+    assert client.post('/api/search/batch', json={'queries': []}).status_code == 400
+
+def test_search_batch_does_not_cache_failed_queries(client, mocker, mock_rag_engine, fresh_search_cache):
+    """A failed query of a batch is recomputed on the next request; successful ones are cached."""
+    mocker.patch('rag.rag_api_server.rag_engine_instance', mock_rag_engine)
+    mock_rag_engine.search_batch = mocker.MagicMock(side_effect=lambda queries, **kw: {
+        'success': True, 'timings': {}, 'responses': [
+            {'success': q != 'broken', 'results': [{'text': q}]} for q in queries
+        ]
+    })
+
+    client.post('/api/search/batch', json={'queries': ['krishna', 'broken']})
+    data = json.loads(client.post('/api/search/batch', json={'queries': ['krishna', 'broken']}).data)
+
+    assert data['cached'] == 1
+    assert mock_rag_engine.search_batch.call_args.kwargs['queries'] == ['broken']
+
+def test_search_stream_endpoint_emits_ndjson_stages(client, mocker, mock_rag_engine, fresh_search_cache):
+    """The stream endpoint writes one JSON line per stage and caches the final answer."""
+    mocker.patch('rag.rag_api_server.rag_engine_instance', mock_rag_engine)
+    mock_rag_engine.search_stream = mocker.MagicMock(return_value=iter([
+        {'stage': 'lexical', 'keyword': [], 'simple_match': [{'text': 'fast'}], 'elapsed_ms': 1.0},
+        {'stage': 'fused', 'results': [{'text': 'fast'}], 'elapsed_ms': 2.0},
+        {'stage': 'final', 'success': True, 'results': [{'text': 'reranked'}], 'count': 1}
+    ]))
+
+    response = client.post('/api/search/stream', json={'query': 'krishna'})
+    lines = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert [line['stage'] for line in lines] == ['lexical', 'fused', 'final']
+
+    # Повторный запрос - сразу финальный ответ из кэша
+    again = client.post('/api/search/stream', json={'query': 'krishna'})
+    assert [json.loads(line)['stage'] for line in again.data.decode('utf-8').splitlines()] == ['final']
+    assert mock_rag_engine.search_stream.call_count == 1
+
+    # Слот поиска освобождается при закрытии ответа (WSGI-сервер вызывает close())
+    from rag.rag_api_server import search_admission
+    response.close()
+    again.close()
+    assert search_admission.stats()['active'] == 0
+
+def test_search_does_not_block_while_engine_warms_up(client, mocker):
+    """Without an engine /api/search answers 503 at once and starts loading in the background."""
+    import rag.rag_api_server as server
+    mocker.patch('rag.rag_api_server.rag_engine_instance', None)
+    mocker.patch('rag.rag_api_server.has_index_files', return_value=True)
+    init = mocker.patch('rag.rag_api_server.initialize_engine')
+    mocker.patch.dict(server.warmup_state, {'status': 'idle'})
+
+    response = client.post('/api/search', json={'query': 'krishna'})
+    again = client.post('/api/search', json={'query': 'krishna'})
+
+    assert response.status_code == 503
+    assert json.loads(response.data)['warming_up'] is True
+    assert response.headers['Retry-After'] == '2'
+    assert again.status_code == 503
+    for _ in range(100):  # загрузка идет в фоновом потоке
+        if init.call_count:
+            break
+        time.sleep(0.01)
+    assert init.call_count == 1
+
+    health = json.loads(client.get('/api/health').data)
+    assert health['ready'] is False
+    assert health['warmup']['status'] == 'warming'
+
+def test_degraded_search_results_are_not_cached(client, mocker, tmp_path, mock_faiss, mock_genai, sample_metadata, fresh_search_cache):
+    """Results served during warm-up or after an embedding API error are recomputed once the engine is ready."""
+    from unittest.mock import MagicMock
+    from rag.rag_engine import RAGEngine
+    reranker_cls = mocker.patch('rag.rag_engine.RerankerModel')
+    reranker_cls.return_value.model = None
+
+    def fake_core(self, language):
+        self.indices[language] = mock_faiss
+        self.metadata[language] = sample_metadata
+        return True
+
+    def fake_extras(self, language):
+        self.bm25_indices[language] = MagicMock(top_k=MagicMock(return_value=([], [])))
+
+    mocker.patch.object(RAGEngine, '_load_language_core', fake_core)
+    mocker.patch.object(RAGEngine, '_load_language_extras', fake_extras)
+    engine = RAGEngine(languages=['ru'], base_dir=str(tmp_path), lazy_loading=True, load_reranker=False, embedding_cache=False)
+    engine.load_language('ru', extras=False)
+    mocker.patch('rag.rag_api_server.rag_engine_instance', engine)
+
+    first = json.loads(client.post('/api/search', json={'query': 'Chapter 2'}).data)
+    assert first['degraded'] == ['ru:bm25', 'reranker']
+    engine.warm_up(['ru'])
+    second = json.loads(client.post('/api/search', json={'query': 'Chapter 2'}).data)
+    assert 'degraded' not in second
+    assert fresh_search_cache.stats()['size'] == 1
+
+    # Ошибка API эмбеддингов: поиск работает без векторов, но ответ не кэшируется
+    mock_genai.side_effect = RuntimeError("quota exceeded")
+    mock_genai.reset_mock()
+    for _ in range(2):
+        failed = json.loads(client.post('/api/search', json={'query': 'Chapter 1'}).data)
+        assert failed['success'] is True and failed['degraded'] == ['embedding']
+    assert mock_genai.call_count == 2
+    assert fresh_search_cache.stats()['size'] == 1
+
+def test_health_reports_component_readiness(client, mocker, mock_rag_engine):
+    """/api/health exposes per-language component readiness from the engine."""
+    mocker.patch('rag.rag_api_server.rag_engine_instance', mock_rag_engine)
+
+    health = json.loads(client.get('/api/health').data)
+
+    assert health['ready'] is True
+    assert health['components']['languages']['ru']['faiss']['ready'] is True
+    assert 'reranker' in health['components']
+
+def test_reset_closes_engine_files_before_removing_data(client, mocker, tmp_path):
+    """Factory reset closes index mmaps and the SQLite cache so the data folder can be removed (Windows)."""
+    import faiss
+    import numpy as np
+    from rag.chunk_store import flatten_faiss_metadata, write_chunk_meta_for_texts, write_chunk_texts_from_chunked
+    from rag.rag_engine import RAGEngine
+
+    data_dir = tmp_path / "rag_data"
+    data_dir.mkdir()
+    chunked = {'bg': {'bg/1': ["Текст 1. Душа вечна.", "Текст 2. Кришна и Арджуна."]}}
+    metadata = {'structure': {'bg': {'bg/1': {'embedding_key': 'embeddings_0', 'num_chunks': 2, 'text_previews': ['', '']}}}}
+    (data_dir / "chunked_scriptures_ru.json").write_text(json.dumps(chunked))
+    (data_dir / "faiss_metadata_ru.json").write_text(json.dumps(metadata))
+    write_chunk_texts_from_chunked(data_dir / "chunk_texts_ru.bin", chunked, data_dir / "chunked_scriptures_ru.json")
+    write_chunk_meta_for_texts(
+        data_dir / "chunk_meta_ru.bin", data_dir / "chunk_texts_ru.bin",
+        flatten_faiss_metadata(metadata), data_dir / "faiss_metadata_ru.json"
+    )
+    index = faiss.IndexFlatL2(8)
+    index.add(np.eye(2, 8, dtype='float32'))
+    faiss.write_index(index, str(data_dir / "faiss_index_ru.bin"))
+
+    mocker.patch('rag.rag_engine.RerankerModel')
+    # Первый движок строит индексы BM25/фраз/стихов, второй открывает их файлы через mmap
+    RAGEngine(languages=['ru'], base_dir=str(data_dir), load_reranker=False).close()
+    engine = RAGEngine(languages=['ru'], base_dir=str(data_dir), load_reranker=False)
+    assert engine.load_language('ru') and 'ru' in engine.bm25_indices
+
+    def mapped_files():
+        with open('/proc/self/maps') as f:
+            return [line for line in f if str(data_dir) in line]
+
+    if os.path.exists('/proc/self/maps'):
+        assert mapped_files()
+    mocker.patch('rag.rag_api_server.rag_engine_instance', engine)
+    mocker.patch('rag.rag_api_server.DATA_DIR', str(data_dir))
+    mocker.patch('rag.rag_api_server.CHAT_HISTORY_DIR', str(tmp_path / "chat_history"))
+
+    response = client.post('/api/setup/reset')
+    assert response.status_code == 200
+    assert not data_dir.exists()
+    # Ссылка на движок (как у еще идущего запроса) не держит файлы открытыми
+    assert engine.embedding_cache._conn is None and engine.bm25_indices == {}
+    if os.path.exists('/proc/self/maps'):
+        assert mapped_files() == []
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🎯 ИНДЕКС ССЫЛОК НА СТИХИ
+
+Заранее вычисленное соответствие (книга, глава, стих) -> id чанков для
+точного поиска по ссылке ("БГ 2.12", "SB 1.1.1"). Номера стихов, которые
+может "найти" чанк, определяются теми же эвристиками, что и при полном
+просмотре метаданных: "text N" / "текст N" / "verse N" / "стих N" / "N."
+в первых 100 символах, "N-" (диапазон 10-11) в первых 20 символах и
+текст, начинающийся с N. Эвристики ищут подстроку, поэтому для каждого
+числа в тексте учитываются и его префиксы/суффиксы ("text 12" подходит
+и для стиха 1).
+
+Формат хранения (verse_index_{lang}.bin, открывается через mmap):
+    keys - отсортированные 64-битные хэши (книга, глава, стих) (uint64)
+    ids  - id чанков (строки FAISS) для каждого ключа (int32)
+В заголовке - список книг (в нижнем регистре) и отпечаток корпуса.
+"""
+
+import hashlib
+import re
+import numpy as np
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Set
+import logging
+
+try:
+    from rag.array_file import write_array_file, open_array_file
+except ImportError:
+    from array_file import write_array_file, open_array_file
+
+logger = logging.getLogger(__name__)
+
+INDICATOR_WINDOW = 100  # Символов текста, в которых ищутся "text N", "N."
+RANGE_WINDOW = 20       # Символов текста, в которых ищется "N-"
+
+_WORD_INDICATOR_RE = re.compile(r'(?:text|текст|verse|стих) (\d+)')
+_DOT_RE = re.compile(r'(\d+)\.')
+_RANGE_RE = re.compile(r'(\d+)-')
+_LEADING_RE = re.compile(r'\d+')
+
+
+def normalize_chapter(chapter) -> str:
+    """'02.005' -> '2.5'"""
+    return '.'.join([p.lstrip('0') for p in str(chapter).split('.')])
+
+
+def verse_candidates(clean_text: str) -> Set[str]:
+    """
+    Все номера стихов, для которых чанк считается точным совпадением.
+
+    Args:
+        clean_text: текст чанка в нижнем регистре
+    """
+    verses = set()
+    window = clean_text[:INDICATOR_WINDOW]
+
+    # "text N": подходит любой префикс числа
+    for match in _WORD_INDICATOR_RE.finditer(window):
+        digits = match.group(1)
+        verses.update(digits[:i] for i in range(1, len(digits) + 1))
+
+    # "N." и "N-": подходит любой суффикс числа
+    for pattern, text in ((_DOT_RE, window), (_RANGE_RE, clean_text[:RANGE_WINDOW])):
+        for match in pattern.finditer(text):
+            digits = match.group(1)
+            verses.update(digits[i:] for i in range(len(digits)))
+
+    leading = _LEADING_RE.match(clean_text.strip())
+    if leading:
+        digits = leading.group(0)
+        verses.update(digits[:i] for i in range(1, len(digits) + 1))
+    return verses
+
+
+def _key(book: str, chapter: str, verse: str) -> int:
+    raw = f"{book}\x1f{chapter}\x1f{verse}".encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), 'little')
+
+
+class VerseIndex:
+    """Хэш-индекс (книга, глава, стих) -> id чанков"""
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, keys: np.ndarray, ids: np.ndarray, books: List[str], corpus: str = ''):
+        self.keys = keys
+        self.ids = ids
+        self.books = books
+        self.corpus = corpus
+
+    @classmethod
+    def build(
+        cls,
+        metadata: Iterable[dict],
+        lower_text: Callable[[int], str],
+        corpus: str = ''
+    ) -> 'VerseIndex':
+        """
+        Строит индекс по метаданным чанков.
+
+        Args:
+            metadata: метаданные в порядке id (строк FAISS)
+            lower_text: функция id -> текст чанка в нижнем регистре
+            corpus: отпечаток корпуса (сохраняется в заголовке)
+        """
+        keys, ids = [], []
+        books = set()
+        for idx, meta in enumerate(metadata):
+            book = meta.get('book', '')
+            if book is None:
+                continue
+            book = book.lower()
+            books.add(book)
+            chapter = normalize_chapter(meta.get('chapter', ''))
+            for verse in verse_candidates(lower_text(idx)):
+                keys.append(_key(book, chapter, verse))
+                ids.append(idx)
+
+        keys = np.array(keys, dtype=np.uint64)
+        ids = np.array(ids, dtype=np.int32)
+        # Стабильная сортировка сохраняет возрастающий порядок id для одного ключа
+        order = np.argsort(keys, kind='stable')
+        return cls(keys[order], ids[order], sorted(books), corpus)
+
+    def lookup(self, book: str, chapter: str, verse: str) -> np.ndarray:
+        """
+        id чанков по ссылке, по возрастанию.
+
+        Книга сопоставляется как при просмотре метаданных: имя книги в
+        метаданных содержит искомое или содержится в нем ('ug' и 'Uddhava-Gita').
+        """
+        target = book.lower()
+        chapter = normalize_chapter(chapter)
+        parts = []
+        for meta_book in self.books:
+            if target not in meta_book and meta_book not in target:
+                continue
+            key = np.uint64(_key(meta_book, chapter, verse))
+            start = np.searchsorted(self.keys, key, side='left')
+            end = np.searchsorted(self.keys, key, side='right')
+            if end > start:
+                parts.append(self.ids[start:end])
+        if not parts:
+            return np.empty(0, dtype=np.int32)
+        if len(parts) == 1:
+            return np.asarray(parts[0])
+        return np.unique(np.concatenate(parts))
+
+    def save(self, path: Path):
+        write_array_file(
+            path,
+            {'kind': 'verse_index', 'version': self.FORMAT_VERSION, 'books': self.books, 'corpus': self.corpus},
+            {'keys': self.keys, 'ids': self.ids}
+        )
+
+    @classmethod
+    def load(cls, path: Path, corpus: str) -> Optional['VerseIndex']:
+        """Открывает индекс через mmap; None, если другая версия формата или другой корпус."""
+        header, arrays = open_array_file(path)
+        if header.get('kind') != 'verse_index' or header.get('version') != cls.FORMAT_VERSION:
+            return None
+        if header.get('corpus') != corpus:
+            return None
+        return cls(arrays['keys'], arrays['ids'], header['books'], corpus)
@@ -27,21 +27,19 @@ hidden_imports += collect_submodules('nltk.tokenize')
 datas += collect_data_files('nltk')
 
 # 5. Flask & Web
-hidden_imports += ['flask_cors', 'dotenv', 'werkzeug', 'jinja2', 'markupsafe']
+hidden_imports += ['flask_cors', 'dotenv', 'werkzeug', 'jinja2', 'markupsafe', 'waitress']
 
 # 6. Core ML & Utils
 hidden_imports += collect_submodules('transformers')
 hidden_imports += collect_submodules('torch')
 hidden_imports += collect_submodules('google.generativeai')
 hidden_imports += collect_submodules('faiss')
-hidden_imports += collect_submodules('rank_bm25')
 hidden_imports += collect_submodules('sklearn')
 hidden_imports += ['numpy', 'regex', 'requests', 'tqdm', 
                    'filelock', 'packaging', 'typing_extensions', 'pickle']
 
 # Data files
 datas += collect_data_files('transformers')
-datas += collect_data_files('rank_bm25')
 
 a = Analysis(
     ['rag/rag_api_server.py'],
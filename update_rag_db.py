@@ -2,6 +2,7 @@ import os
 import sys
 import shutil
 import logging
+import argparse
 from pathlib import Path
 
 # Setup logging
@@ -16,11 +17,58 @@ try:
     import embeddings_generator
     import faiss_indexer
     import rebuild_bm25
+    import incremental_update
 except ImportError as e:
     print(f"Error importing modules: {e}")
     sys.exit(1)
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild or incrementally update the RAG database")
+    parser.add_argument('--incremental', action='store_true',
+                        help="process only new/changed/removed files of parsed_scriptures_*.json")
+    parser.add_argument('languages', nargs='*', metavar='{ru,en,all}',
+                        help="languages for --incremental (default: all)")
+    # Index options for the full update; by default the saved index settings are kept
+    faiss_indexer.add_index_arguments(parser)
+    args = parser.parse_args(argv)
+    unknown = [lang for lang in args.languages if lang not in ('ru', 'en', 'all')]
+    if unknown:
+        parser.error(f"invalid language: {', '.join(unknown)} (choose from ru, en, all)")
+    if not args.languages or 'all' in args.languages:
+        args.languages = ['ru', 'en']
+    return args
+
+def incremental(languages):
+    print("="*80)
+    print("  RAG DATABASE INCREMENTAL UPDATE")
+    print("="*80)
+    print("Only new, changed and removed files of parsed_scriptures_*.json are processed.")
+    print("Embeddings are generated only for their chunks (Google Gemini API).")
+    print("-" * 80)
+
+    if not embeddings_generator.configure_api():
+        sys.exit(1)
+
+    try:
+        all_stats = incremental_update.update_all_languages(languages)
+    except Exception as e:
+        print(f"Error in incremental update: {e}")
+        sys.exit(1)
+
+    missing = [lang for lang in languages if lang not in all_stats]
+    if missing:
+        print(f"\nERROR: Could not update: {', '.join(missing)}. Run the full update for them.")
+        sys.exit(1)
+    print("\n" + "="*80)
+    print("SUCCESS: RAG Database Updated (incremental)!")
+    print("="*80)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.incremental:
+        incremental(args.languages)
+        return
+
     print("="*80)
     print("  RAG DATABASE UPDATER")
     print("="*80)
@@ -49,12 +97,18 @@ def main():
             rag_dir / f"faiss_index_{lang}.bin",
             rag_dir / f"faiss_metadata_{lang}.json",
             rag_dir / f"bm25_index_{lang}.pkl",
+            rag_dir / f"bm25_index_{lang}.bin",
+            rag_dir / f"phrase_index_{lang}.bin",
+            rag_dir / f"verse_index_{lang}.bin",
+            rag_dir / f"chunk_texts_{lang}.bin",
+            rag_dir / f"chunk_meta_{lang}.bin",
             # We enforce removing embeddings to ensure we pick up new content definitively,
             # though embeddings_generator overwrites, explicitly deleting avoids confusion.
             # However, if user wants to keep cache, they can't.
             # Given the request is to "add new books", we assume full rebuild.
             rag_dir / f"embeddings_{lang}.npz",
             rag_dir / f"embeddings_metadata_{lang}.json",
+            rag_dir / f"update_manifest_{lang}.json",
         ])
 
     for f in files_to_remove:
@@ -84,7 +138,7 @@ def main():
     # 4. RUN FAISS INDEXER
     print("\n[4/5] Running FAISS Indexer...")
     try:
-        faiss_indexer.process_all_languages()
+        faiss_indexer.process_all_languages(args=args)
     except Exception as e:
         print(f"Error in FAISS Indexer: {e}")
         return